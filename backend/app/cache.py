@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    maxsize: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return 0.0 if total == 0 else self.hits / total
+
+    def as_dict(self) -> dict[str, float | int]:
+        return {
+            "maxsize": self.maxsize,
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+
+class LruCache(Generic[K, V]):
+    def __init__(self, maxsize: int, ttl_seconds: float | None = None) -> None:
+        self._maxsize = max(0, maxsize)
+        self._ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._data: OrderedDict[K, tuple[V, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        if self._maxsize == 0:
+            return
+        expires_at = None if self._ttl is None else time.monotonic() + self._ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_compute(self, key: K, compute: Callable[[], V]) -> V:
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def resize(self, maxsize: int) -> None:
+        with self._lock:
+            self._maxsize = max(0, maxsize)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._expirations = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                maxsize=self._maxsize,
+                size=len(self._data),
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                expirations=self._expirations,
+            )
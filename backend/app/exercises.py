@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from sympy.core.expr import Expr
+from sympy.sets.sets import Set
+
+from .math_engine import (
+    ParsedStep,
+    SolutionSetMemo,
+    apply_substitutions,
+    parse_context_substitutions,
+    parse_step,
+)
+
+DEFAULT_VARIABLE = "x"
+
+
+class UnknownExerciseError(KeyError):
+    pass
+
+
+class AmbiguousExerciseError(KeyError):
+    def __init__(self, exercise_id: str, candidates: list[str]) -> None:
+        super().__init__(exercise_id)
+        self.exercise_id = exercise_id
+        self.candidates = candidates
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    exercise_id: str
+    bank: str
+    prompt: str
+    expected_final: str
+    context_hint: str | None
+    variable: str
+    parsed_prompt: ParsedStep
+    parsed_expected: ParsedStep
+    substitutions: dict[str, Expr]
+    prompt_solution_set: Set | None
+    expected_solution_set: Set | None
+
+    @property
+    def qualified_id(self) -> str:
+        return f"{self.bank}:{self.exercise_id}"
+
+    def seed(self, memo: SolutionSetMemo) -> None:
+        memo.seed(self.parsed_prompt, self.variable, self.substitutions, self.prompt_solution_set)
+        memo.seed(self.parsed_expected, self.variable, self.substitutions, self.expected_solution_set)
+
+
+def default_assets_dir() -> Path:
+    default = Path(__file__).resolve().parents[2] / "assets"
+    return Path(os.getenv("MATHFIGHT_ASSETS_DIR", str(default)))
+
+
+def build_answer_key(bank: str, item: dict[str, object], variable: str = DEFAULT_VARIABLE) -> AnswerKey:
+    prompt = str(item["prompt"])
+    expected = str(item["expected_final"])
+    raw_hint = item.get("context_hint")
+    context_hint = None if raw_hint is None else str(raw_hint)
+    substitutions = parse_context_substitutions(context_hint)
+    parsed_prompt = parse_step(prompt)
+    parsed_expected = parse_step(expected)
+    memo = SolutionSetMemo()
+    return AnswerKey(
+        exercise_id=str(item["id"]),
+        bank=bank,
+        prompt=prompt,
+        expected_final=expected,
+        context_hint=context_hint,
+        variable=variable,
+        parsed_prompt=parsed_prompt,
+        parsed_expected=parsed_expected,
+        substitutions=substitutions,
+        prompt_solution_set=memo.solve(apply_substitutions(parsed_prompt, substitutions), variable, substitutions),
+        expected_solution_set=memo.solve(
+            apply_substitutions(parsed_expected, substitutions),
+            variable,
+            substitutions,
+        ),
+    )
+
+
+class ExerciseBank:
+    def __init__(self, keys: list[AnswerKey]) -> None:
+        self._by_qualified = {key.qualified_id: key for key in keys}
+        self._by_id: dict[str, list[AnswerKey]] = {}
+        for key in keys:
+            self._by_id.setdefault(key.exercise_id, []).append(key)
+
+    @classmethod
+    def load(cls, assets_dir: Path) -> ExerciseBank:
+        keys: list[AnswerKey] = []
+        for path in sorted(assets_dir.rglob("*.json")):
+            try:
+                decoded = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                continue
+            items = decoded.get("exercises") if isinstance(decoded, dict) else None
+            if not isinstance(items, list):
+                continue
+            bank = path.relative_to(assets_dir).with_suffix("").as_posix()
+            for item in items:
+                if isinstance(item, dict) and {"id", "prompt", "expected_final"} <= item.keys():
+                    keys.append(build_answer_key(bank, item))
+        return cls(keys)
+
+    def __len__(self) -> int:
+        return len(self._by_qualified)
+
+    def keys(self) -> list[AnswerKey]:
+        return list(self._by_qualified.values())
+
+    def get(self, exercise_id: str) -> AnswerKey:
+        key = self._by_qualified.get(exercise_id)
+        if key is not None:
+            return key
+        matches = self._by_id.get(exercise_id, [])
+        if not matches:
+            raise UnknownExerciseError(exercise_id)
+        if len(matches) > 1:
+            raise AmbiguousExerciseError(exercise_id, sorted(match.qualified_id for match in matches))
+        return matches[0]
+
+
+_bank: ExerciseBank | None = None
+_bank_lock = threading.Lock()
+
+
+def get_exercise_bank() -> ExerciseBank:
+    global _bank
+    if _bank is None:
+        with _bank_lock:
+            if _bank is None:
+                _bank = ExerciseBank.load(default_assets_dir())
+    return _bank
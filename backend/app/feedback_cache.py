@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import LruCache
+from .schemas import PedagogicalOutput
+from .storage import DbConfig, load_cached_feedback, store_cached_feedback
+
+_MEMORY_SIZE = int(os.getenv("MATHFIGHT_FEEDBACK_CACHE_SIZE", "1024"))
+_DB_ROWS = int(os.getenv("MATHFIGHT_FEEDBACK_CACHE_DB_ROWS", "50000"))
+_TTL_SECONDS = float(os.getenv("MATHFIGHT_FEEDBACK_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+
+class FeedbackCache:
+    def __init__(
+        self,
+        config: DbConfig | None,
+        maxsize: int | None = None,
+        max_rows: int | None = None,
+        ttl_seconds: float | None = None,
+    ) -> None:
+        ttl = _TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._ttl = ttl if ttl > 0 else None
+        self._memory: LruCache[str, tuple[PedagogicalOutput, float | None]] = LruCache(
+            _MEMORY_SIZE if maxsize is None else maxsize
+        )
+        self._config = config
+        self._max_rows = _DB_ROWS if max_rows is None else max_rows
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "expirations": 0, "writes": 0, "db_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self._memory.maxsize > 0 or self._db_config is not None
+
+    @property
+    def _db_config(self) -> DbConfig | None:
+        return self._config if self._max_rows > 0 else None
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def get(self, key: str) -> PedagogicalOutput | None:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            output, expires_at = entry
+            if expires_at is None or expires_at > now:
+                self._count("memory_hits")
+                return output.model_copy(deep=True)
+            self._count("expirations")
+        config = self._db_config
+        if config is not None:
+            try:
+                row = load_cached_feedback(config, key, now)
+            except sqlite3.Error:
+                self._count("db_errors")
+                row = None
+            if row is not None:
+                raw, expires_at = row
+                output = PedagogicalOutput.model_validate_json(raw)
+                # Promoted entries keep the database expiry rather than starting a fresh TTL.
+                self._memory.put(key, (output, expires_at))
+                self._count("db_hits")
+                return output.model_copy(deep=True)
+        self._count("misses")
+        return None
+
+    def put(self, key: str, prompt_version: str, output: PedagogicalOutput) -> None:
+        now = time.time()
+        expires_at = None if self._ttl is None else now + self._ttl
+        self._memory.put(key, (output.model_copy(deep=True), expires_at))
+        self._count("writes")
+        config = self._db_config
+        if config is None:
+            return
+        try:
+            store_cached_feedback(
+                config,
+                key,
+                prompt_version,
+                output.model_dump_json(),
+                expires_at,
+                self._max_rows,
+                now,
+            )
+        except sqlite3.Error:
+            self._count("db_errors")
+
+    def clear_memory(self) -> None:
+        self._memory.clear()
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["db_hits"]
+        return {
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": self._memory.stats().as_dict(),
+            "db_max_rows": self._max_rows if self._db_config is not None else 0,
+            "ttl_seconds": self._ttl,
+        }
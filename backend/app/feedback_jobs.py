@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Literal
+
+from starlette.concurrency import run_in_threadpool
+
+from .feedback_cache import FeedbackCache
+from .prompting import FeedbackInput, fallback_feedback, generate_pedagogical_feedback
+from .schemas import PedagogicalOutput
+from .storage import DbConfig, load_run_feedback, save_run_feedback
+
+FeedbackStatus = Literal["pending", "ready"]
+
+_WORKERS = int(os.getenv("MATHFIGHT_FEEDBACK_WORKERS", "4"))
+_KEEP = int(os.getenv("MATHFIGHT_FEEDBACK_JOBS_KEEP", "1000"))
+
+
+class FeedbackJobs:
+    def __init__(
+        self,
+        config: DbConfig | None,
+        cache: FeedbackCache | None = None,
+        workers: int | None = None,
+        keep: int | None = None,
+    ) -> None:
+        self._config = config
+        self._cache = cache
+        self._workers = max(1, _WORKERS if workers is None else workers)
+        self._keep = max(1, _KEEP if keep is None else keep)
+        self._executor: ThreadPoolExecutor | None = None
+        self._jobs: OrderedDict[str, Future[PedagogicalOutput]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "store_errors": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run(self, feedback_id: str, input_data: FeedbackInput) -> PedagogicalOutput:
+        try:
+            output = generate_pedagogical_feedback(input_data, self._cache)
+        except Exception:
+            self._count("failed")
+            output = fallback_feedback(input_data)
+        if self._config is not None:
+            try:
+                save_run_feedback(self._config, feedback_id, "ready", output.model_dump_json())
+            except sqlite3.Error:
+                self._count("store_errors")
+        self._count("completed")
+        return output
+
+    def submit(self, input_data: FeedbackInput) -> str:
+        feedback_id = uuid.uuid4().hex
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="feedback")
+            future = self._executor.submit(self._run, feedback_id, input_data)
+            self._jobs[feedback_id] = future
+            # Finished feedback is also in run_feedback, so old finished handles can be dropped from memory;
+            # pending ones have no stored row yet and stay until they finish.
+            excess = len(self._jobs) - self._keep
+            if excess > 0:
+                finished = [job_id for job_id, job in self._jobs.items() if job.done()]
+                for job_id in finished[:excess]:
+                    del self._jobs[job_id]
+            self._stats["submitted"] += 1
+        return feedback_id
+
+    def _stored(self, feedback_id: str) -> tuple[FeedbackStatus, PedagogicalOutput | None] | None:
+        if self._config is None:
+            return None
+        row = load_run_feedback(self._config, feedback_id)
+        if row is None or row[1] is None:
+            return None
+        return "ready", PedagogicalOutput.model_validate_json(row[1])
+
+    def get(self, feedback_id: str) -> tuple[FeedbackStatus, PedagogicalOutput | None] | None:
+        with self._lock:
+            future = self._jobs.get(feedback_id)
+        if future is None:
+            return self._stored(feedback_id)
+        if not future.done():
+            return "pending", None
+        return "ready", future.result()
+
+    async def wait(
+        self,
+        feedback_id: str,
+        timeout: float,
+    ) -> tuple[FeedbackStatus, PedagogicalOutput | None] | None:
+        with self._lock:
+            future = self._jobs.get(feedback_id)
+        if future is None:
+            return await run_in_threadpool(self._stored, feedback_id)
+        if not future.done() and timeout > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if not future.done():
+            return "pending", None
+        return "ready", future.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = sum(1 for future in self._jobs.values() if not future.done())
+        return stats
@@ -0,0 +1,562 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Callable
+
+from .exercises import get_exercise_bank
+from .math_engine import (
+    TIMEOUT_REASON,
+    ArithmeticStep,
+    ComputeTimeout,
+    Deadline,
+    ParsedStep,
+    SequenceCandidate,
+    SolutionSetMemo,
+    choose_candidate_sequences,
+    classify_error,
+    coerce_arithmetic_step,
+    compare_arithmetic,
+    compare_steps,
+    expressions_equivalent,
+    normalize_text,
+    parse_arithmetic,
+    parse_context_substitutions,
+    parse_step_within,
+)
+from .prompting import FeedbackInput, PedagogicalOutput
+from .schemas import StepValidationPayload, ValidateSolutionRequest, ValidateSolutionResponse
+
+# Called as on_step(candidate_index, step_index, result) right after each transition is checked.
+StepCallback = Callable[[int, int, StepValidationPayload], None]
+
+_BEAM_WIDTH = int(os.getenv("MATHFIGHT_BEAM_WIDTH", "5"))
+_OCR_TOP_K = int(os.getenv("MATHFIGHT_OCR_TOP_K", "3"))
+_BEAM_STEP_SIGNALS = os.getenv("MATHFIGHT_BEAM_STEP_SIGNALS", "1").strip().lower() in {"1", "true", "yes"}
+# Pruning stops before every beam candidate has a candidate_scores entry, so it is opt-in.
+_BEAM_PRUNING = os.getenv("MATHFIGHT_BEAM_PRUNING", "0").strip().lower() in {"1", "true", "yes"}
+# Constant-only exercises ("4 + 3") are graded with exact fractions instead of SymPy.
+_ARITHMETIC_ENGINE = os.getenv("MATHFIGHT_ARITHMETIC_ENGINE", "1").strip().lower() in {"1", "true", "yes"}
+
+
+@dataclass(frozen=True)
+class EvalResult:
+    lines: list[str]
+    normalized_steps: list[str]
+    step_validations: list[StepValidationPayload]
+    process_valid: bool
+    final_result_correct: bool
+    validation_status: str
+    first_error_index: int | None
+    error_type: str | None
+    equivalence_mode: str
+    previous_solution_set: str | None
+    current_solution_set: str | None
+
+
+def build_unreadable_response(reason: str, final_result_line: int) -> ValidateSolutionResponse:
+    return ValidateSolutionResponse(
+        decision="unreadable",
+        is_correct=False,
+        final_result_correct=False,
+        process_valid=False,
+        warning_lines=[],
+        wrong_lines=[],
+        final_result_line=max(1, final_result_line),
+        first_error_index=None,
+        error_type=reason,
+        warning_type=None,
+        warning_message="No pude interpretar la escritura con suficiente confianza.",
+        validation_status="undetermined",
+        equivalence_mode="algebraic",
+        previous_solution_set=None,
+        current_solution_set=None,
+        normalized_steps=[],
+        step_validations=[],
+        pedagogical_feedback="No pude interpretar la escritura con suficiente confianza.",
+        suggested_correction_steps=["Escribe cada paso mas claro y en lineas separadas."],
+        debug={"reason": reason},
+    )
+
+
+class _PrefixNode:
+    __slots__ = ("step", "validation", "expected_check", "children")
+
+    def __init__(self, step: ParsedStep | ArithmeticStep) -> None:
+        self.step = step
+        self.validation: StepValidationPayload | None = None
+        self.expected_check: StepValidationPayload | None = None
+        self.children: dict[str, _PrefixNode] = {}
+
+
+class CandidateTrie:
+    # Candidate sequences from one beam share long prefixes; each node holds the effective step
+    # for that prefix and the check of the transition into it, so shared transitions run once.
+    def __init__(
+        self,
+        payload: ValidateSolutionRequest,
+        deadline: Deadline | None = None,
+        arithmetic: bool | None = None,
+    ) -> None:
+        self.prompt = payload.equation_prompt
+        self.expression_prompt_mode = "=" not in payload.equation_prompt
+        self.root: _PrefixNode | None = None
+        self.arithmetic_root: _PrefixNode | None = None
+        self.arithmetic_expected: ArithmeticStep | None = None
+        if (_ARITHMETIC_ENGINE if arithmetic is None else arithmetic) and self.expression_prompt_mode:
+            prompt = parse_arithmetic(payload.equation_prompt)
+            expected = parse_arithmetic(payload.expected_final)
+            if prompt is not None and expected is not None:
+                self.arithmetic_root = _PrefixNode(prompt)
+                self.arithmetic_expected = expected
+        if self.arithmetic_root is None:
+            self.root = _PrefixNode(parse_step_within(self.prompt, deadline))
+        self.checked = 0
+        self.reused = 0
+
+    def path(self, lines: list[str], deadline: Deadline | None) -> list[_PrefixNode]:
+        if self.root is None:
+            self.root = _PrefixNode(parse_step_within(self.prompt, deadline))
+        node = self.root
+        path = [node]
+        for line in lines:
+            child = node.children.get(line)
+            if child is None:
+                current = parse_step_within(line, deadline)
+                if self.expression_prompt_mode:
+                    current = _coerce_expression_step(node.step, current, deadline)
+                child = _PrefixNode(current)
+                node.children[line] = child
+            path.append(child)
+            node = child
+        return path
+
+    def arithmetic_path(self, lines: list[str]) -> list[_PrefixNode] | None:
+        # None when some line is outside the exact subset; that sequence then goes through path().
+        node = self.arithmetic_root
+        if node is None:
+            return None
+        path = [node]
+        for line in lines:
+            child = node.children.get(line)
+            if child is None:
+                current = parse_arithmetic(line)
+                if current is None:
+                    return None
+                child = _PrefixNode(coerce_arithmetic_step(node.step, current))
+                node.children[line] = child
+            path.append(child)
+            node = child
+        return path
+
+    def retain(self, sequences: list[list[str]]) -> None:
+        keep: set[tuple[int, str]] = set()
+        roots = [root for root in (self.root, self.arithmetic_root) if root is not None]
+        for root in roots:
+            for lines in sequences:
+                node = root
+                for line in lines:
+                    child = node.children.get(line)
+                    if child is None:
+                        break
+                    keep.add((id(node), line))
+                    node = child
+        stack = roots
+        while stack:
+            node = stack.pop()
+            node.children = {line: child for line, child in node.children.items() if (id(node), line) in keep}
+            stack.extend(node.children.values())
+
+
+def _coerce_expression_step(previous: ParsedStep, current: ParsedStep, deadline: Deadline | None) -> ParsedStep:
+    if (
+        previous.expr is None
+        or current.eq is None
+        or current.parse_error is not None
+        or len(current.eq.lhs.free_symbols) != 0
+        or len(current.eq.rhs.free_symbols) != 0
+    ):
+        return current
+    try:
+        with deadline.step() if deadline is not None else nullcontext():
+            if expressions_equivalent(previous.expr, current.eq.lhs):
+                chosen = current.eq.rhs
+            elif expressions_equivalent(previous.expr, current.eq.rhs):
+                chosen = current.eq.lhs
+            else:
+                chosen = None
+    except (Exception, ComputeTimeout):
+        chosen = None
+
+    if chosen is None:
+        return current
+    return ParsedStep(
+        raw=current.raw,
+        normalized=normalize_text(str(chosen)),
+        is_equation=False,
+        expr=chosen,
+        eq=None,
+        parse_error=None,
+    )
+
+
+def _evaluate_sequence(
+    payload: ValidateSolutionRequest,
+    sequence: SequenceCandidate,
+    memo: SolutionSetMemo | None = None,
+    deadline: Deadline | None = None,
+    on_step: Callable[[int, StepValidationPayload], None] | None = None,
+    trie: CandidateTrie | None = None,
+) -> EvalResult:
+    memo = memo or SolutionSetMemo()
+    trie = trie or CandidateTrie(payload, deadline)
+    compare: Callable[..., StepValidationPayload]
+    exact_path = trie.arithmetic_path(sequence.lines)
+    if exact_path is not None:
+        path = exact_path
+        compare = compare_arithmetic
+    else:
+        path = trie.path(sequence.lines, deadline)
+        compare = partial(
+            compare_steps,
+            variable=payload.variable,
+            substitutions=parse_context_substitutions(payload.context_hint),
+            memo=memo,
+            deadline=deadline,
+        )
+    effective_steps = [node.step for node in path]
+
+    normalized_steps = [step.normalized for step in effective_steps]
+
+    step_validations: list[StepValidationPayload] = []
+    process_valid = True
+    validation_status = "valid"
+    first_error_index: int | None = None
+    error_type: str | None = None
+    equivalence_mode = "solution_set"
+    prev_set: str | None = None
+    curr_set: str | None = None
+
+    for idx in range(len(effective_steps) - 1):
+        previous = effective_steps[idx]
+        current = effective_steps[idx + 1]
+        node = path[idx + 1]
+        if node.validation is None:
+            node.validation = compare(previous, current)
+            trie.checked += 1
+        else:
+            trie.reused += 1
+        result = node.validation
+        step_validations.append(result)
+        if on_step is not None:
+            on_step(idx, result)
+        equivalence_mode = result.equivalence_mode
+        prev_set = result.previous_solution_set
+        curr_set = result.current_solution_set
+        if result.validation_status == "undetermined":
+            process_valid = False
+            validation_status = "undetermined"
+            first_error_index = idx
+            error_type = TIMEOUT_REASON if result.reason == TIMEOUT_REASON else "undetermined"
+            break
+        if not result.equivalent:
+            process_valid = False
+            validation_status = "invalid"
+            first_error_index = idx
+            error_type = classify_error(previous, current)
+            break
+
+    final_node = path[-1]
+    if final_node.expected_check is None:
+        expected = (
+            trie.arithmetic_expected
+            if exact_path is not None
+            else parse_step_within(payload.expected_final, deadline)
+        )
+        final_node.expected_check = compare(final_node.step, expected)
+    expected_check = final_node.expected_check
+    final_result_correct = (
+        expected_check.validation_status == "valid" and expected_check.equivalent
+    )
+
+    if expected_check.validation_status == "undetermined" and final_result_correct is False:
+        validation_status = "undetermined"
+        if error_type is None:
+            error_type = TIMEOUT_REASON if expected_check.reason == TIMEOUT_REASON else "undetermined"
+        equivalence_mode = expected_check.equivalence_mode
+        prev_set = expected_check.previous_solution_set
+        curr_set = expected_check.current_solution_set
+
+    return EvalResult(
+        lines=sequence.lines,
+        normalized_steps=normalized_steps,
+        step_validations=step_validations,
+        process_valid=process_valid,
+        final_result_correct=final_result_correct,
+        validation_status=validation_status,
+        first_error_index=first_error_index,
+        error_type=error_type,
+        equivalence_mode=equivalence_mode,
+        previous_solution_set=prev_set,
+        current_solution_set=curr_set,
+    )
+
+
+# Highest value _score_eval can return: final result correct plus a valid process.
+MAX_EVAL_SCORE = 150
+
+
+def _score_eval(eval_result: EvalResult) -> int:
+    score = 0
+    if eval_result.final_result_correct:
+        score += 100
+    if eval_result.process_valid:
+        score += 50
+    if eval_result.validation_status == "undetermined":
+        score -= 20
+    if eval_result.error_type == "parse_error":
+        score -= 30
+    return score
+
+
+@dataclass(frozen=True)
+class GradingResult:
+    user_lines: list[str]
+    final_result_line: int
+    best_eval: EvalResult | None
+    best_candidate: SequenceCandidate | None
+    candidate_scores: list[dict[str, object]]
+    memo_stats: dict[str, int]
+    timed_out: bool = False
+    skipped_candidates: int = 0
+    pruned_candidates: int = 0
+    transitions: dict[str, int] | None = None
+    grading_ms: float | None = None
+
+
+@dataclass(frozen=True)
+class Verdict:
+    decision: str
+    is_correct: bool
+    warning_type: str | None
+    warning_message: str | None
+    wrong_lines: list[int]
+    warning_lines: list[int]
+
+
+def seed_memo(payload: ValidateSolutionRequest, memo: SolutionSetMemo) -> None:
+    if payload.exercise_id is None:
+        return
+    key = get_exercise_bank().get(payload.exercise_id)
+    if key.variable == payload.variable:
+        key.seed(memo)
+
+
+def grade_submission(
+    payload: ValidateSolutionRequest,
+    memo: SolutionSetMemo | None = None,
+    deadline: Deadline | None = None,
+    on_step: StepCallback | None = None,
+    prune: bool | None = None,
+    trie: CandidateTrie | None = None,
+) -> GradingResult:
+    memo = memo or SolutionSetMemo()
+    deadline = deadline or Deadline()
+    user_lines = [line for line in payload.ocr_lines if line.strip()]
+    final_result_line = max(1, len(user_lines))
+    if not user_lines:
+        return GradingResult(user_lines, final_result_line, None, None, [], memo.stats())
+
+    candidates = choose_candidate_sequences(
+        user_lines,
+        payload.ocr_candidates,
+        beam_width=payload.beam_width or _BEAM_WIDTH,
+        top_k=payload.top_k or _OCR_TOP_K,
+        prompt=payload.equation_prompt if _BEAM_STEP_SIGNALS else None,
+        variable=payload.variable,
+    )
+    seed_memo(payload, memo)
+    prune = _BEAM_PRUNING if prune is None else prune
+    trie = trie or CandidateTrie(payload, deadline)
+    checked_before, reused_before = trie.checked, trie.reused
+    best_eval: EvalResult | None = None
+    best_candidate: SequenceCandidate | None = None
+    best_score = -10_000
+    scored_sequences: list[dict[str, object]] = []
+    skipped = 0
+    pruned = 0
+    for index, candidate in enumerate(candidates):
+        if best_eval is not None and (deadline.timed_out or deadline.expired()):
+            skipped = len(candidates) - index
+            break
+        # Candidates arrive sorted by beam score, so none of the rest can beat the best one.
+        if prune and best_eval is not None and best_score >= MAX_EVAL_SCORE + candidate.score:
+            pruned = len(candidates) - index
+            break
+        evaluated = _evaluate_sequence(
+            payload,
+            candidate,
+            memo,
+            deadline,
+            None if on_step is None else partial(on_step, index),
+            trie,
+        )
+        score = _score_eval(evaluated) + candidate.score
+        scored_sequences.append(
+            {
+                "lines": candidate.lines,
+                "score": score,
+                "final_result_correct": evaluated.final_result_correct,
+                "process_valid": evaluated.process_valid,
+            }
+        )
+        if score > best_score:
+            best_score = score
+            best_eval = evaluated
+            best_candidate = candidate
+
+    return GradingResult(
+        user_lines=user_lines,
+        final_result_line=final_result_line,
+        best_eval=best_eval,
+        best_candidate=best_candidate,
+        candidate_scores=scored_sequences,
+        memo_stats=memo.stats(),
+        timed_out=deadline.timed_out or skipped > 0,
+        skipped_candidates=skipped,
+        pruned_candidates=pruned,
+        transitions={"checked": trie.checked - checked_before, "reused": trie.reused - reused_before},
+    )
+
+
+def grade_group(payloads: list[ValidateSolutionRequest]) -> list[GradingResult]:
+    # Items of one exercise share a memo, so their prompt and common lines are solved once.
+    memo = SolutionSetMemo()
+    results = []
+    for payload in payloads:
+        started = time.perf_counter()
+        result = grade_submission(payload, memo)
+        results.append(replace(result, grading_ms=(time.perf_counter() - started) * 1000))
+    return results
+
+
+def _graded(grading: GradingResult) -> tuple[EvalResult, SequenceCandidate]:
+    # Callers answer unreadable submissions before building a verdict.
+    if grading.best_eval is None or grading.best_candidate is None:
+        raise ValueError("grading produced no readable candidate")
+    return grading.best_eval, grading.best_candidate
+
+
+def decide(grading: GradingResult) -> Verdict:
+    best_eval, best_candidate = _graded(grading)
+    final_result_line = grading.final_result_line
+    final_result_correct = best_eval.final_result_correct
+    process_valid = best_eval.process_valid
+    warning_type = best_candidate.warning_type
+    warning_message = best_candidate.warning_message
+
+    has_ambiguity_warning = warning_type is not None and warning_type == "ocr_ambiguous"
+    if final_result_correct and process_valid and not has_ambiguity_warning:
+        decision = "correct"
+        is_correct = True
+    elif final_result_correct and (not process_valid or has_ambiguity_warning):
+        decision = "correct_with_warnings"
+        is_correct = True
+        if warning_type is None:
+            warning_type = "process_inconsistent"
+            warning_message = (
+                "El resultado final es correcto, pero hay un paso intermedio para revisar."
+            )
+    elif best_eval.validation_status == "undetermined":
+        decision = "unreadable"
+        is_correct = False
+    else:
+        decision = "incorrect"
+        is_correct = False
+
+    wrong_lines: list[int] = []
+    warning_lines: list[int] = []
+    if best_eval.first_error_index is not None:
+        line_no = min(max(1, best_eval.first_error_index + 1), final_result_line)
+        if decision == "correct_with_warnings":
+            warning_lines.append(line_no)
+        else:
+            wrong_lines.append(line_no)
+    warning_lines.extend([line for line in best_candidate.ambiguous_lines if line <= final_result_line])
+    return Verdict(
+        decision=decision,
+        is_correct=is_correct,
+        warning_type=warning_type,
+        warning_message=warning_message,
+        wrong_lines=sorted(set(wrong_lines)),
+        warning_lines=sorted(set(warning_lines)),
+    )
+
+
+def build_feedback_input(
+    payload: ValidateSolutionRequest,
+    grading: GradingResult,
+    verdict: Verdict,
+) -> FeedbackInput:
+    best_eval, _ = _graded(grading)
+    return FeedbackInput(
+        decision=verdict.decision,
+        error_type=best_eval.error_type,
+        warning_type=verdict.warning_type,
+        expected_final=payload.expected_final,
+        normalized_steps=best_eval.normalized_steps,
+        step_validations=[item.model_dump() for item in best_eval.step_validations],
+        wrong_lines=verdict.wrong_lines,
+        warning_lines=verdict.warning_lines,
+        final_result_correct=best_eval.final_result_correct,
+        process_valid=best_eval.process_valid,
+        locale=payload.locale,
+        warning_message=verdict.warning_message,
+    )
+
+
+def build_response(
+    payload: ValidateSolutionRequest,
+    grading: GradingResult,
+    verdict: Verdict,
+    feedback: PedagogicalOutput,
+    exercise_id: str | None = None,
+) -> ValidateSolutionResponse:
+    best_eval, _ = _graded(grading)
+    return ValidateSolutionResponse(
+        decision=verdict.decision,  # type: ignore[arg-type]
+        is_correct=verdict.is_correct,
+        final_result_correct=best_eval.final_result_correct,
+        process_valid=best_eval.process_valid,
+        warning_lines=verdict.warning_lines,
+        wrong_lines=verdict.wrong_lines,
+        final_result_line=grading.final_result_line,
+        first_error_index=best_eval.first_error_index,
+        error_type=best_eval.error_type,
+        warning_type=verdict.warning_type,
+        warning_message=verdict.warning_message,
+        validation_status=best_eval.validation_status,  # type: ignore[arg-type]
+        equivalence_mode=best_eval.equivalence_mode,  # type: ignore[arg-type]
+        previous_solution_set=best_eval.previous_solution_set,
+        current_solution_set=best_eval.current_solution_set,
+        normalized_steps=best_eval.normalized_steps,
+        step_validations=best_eval.step_validations,
+        pedagogical_feedback=feedback.short_feedback,
+        suggested_correction_steps=feedback.correction_steps,
+        debug={
+            "input_steps": [payload.equation_prompt, *grading.user_lines],
+            "selected_lines": best_eval.lines,
+            "candidate_scores": grading.candidate_scores,
+            "has_ocr_candidates": bool(payload.ocr_candidates),
+            "exercise_id": exercise_id,
+            "solution_set_memo": grading.memo_stats,
+            "timed_out": grading.timed_out,
+            "skipped_candidates": grading.skipped_candidates,
+            "pruned_candidates": grading.pruned_candidates,
+            "transitions": grading.transitions,
+            "tone": feedback.tone,
+        },
+    )
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import http.client
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from starlette.concurrency import run_in_threadpool
+
+
+class HttpTransportError(OSError):
+    def __init__(self, message: str, status: int | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass(frozen=True)
+class HttpResponse:
+    status: int
+    body: bytes
+    latency_ms: float
+    reused: bool
+
+
+class HttpConnectionPool:
+    def __init__(
+        self,
+        base_url: str,
+        max_idle: int = 8,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 12.0,
+    ) -> None:
+        parts = urlsplit(base_url)
+        if parts.scheme not in {"http", "https"} or not parts.hostname:
+            raise ValueError(f"unsupported url: {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.max_idle = max(0, max_idle)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle: deque[http.client.HTTPConnection] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._opened = 0
+        self._reused = 0
+        self._requests = 0
+        self._errors = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+        self._last_ms = 0.0
+
+    def _open(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            conn: http.client.HTTPConnection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout
+            )
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        # The connect timeout only covers the handshake; responses get the longer read timeout.
+        if conn.sock is not None:
+            conn.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.sock is not None:
+                    self._reused += 1
+                    return conn, True
+                conn.close()
+        return self._open(), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if not self._closed and conn.sock is not None and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _record(self, started: float, failed: bool = False) -> float:
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._requests += 1
+            if failed:
+                self._errors += 1
+            self._total_ms += elapsed
+            self._max_ms = max(self._max_ms, elapsed)
+            self._last_ms = elapsed
+        return elapsed
+
+    def _send(
+        self,
+        conn: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        body: bytes | None,
+        headers: dict[str, str],
+    ) -> tuple[int, bytes, bool]:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        payload = response.read()
+        return response.status, payload, response.will_close
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> HttpResponse:
+        headers = {"Connection": "keep-alive", **(headers or {})}
+        started = time.perf_counter()
+        conn, reused = self._acquire()
+        try:
+            try:
+                status, payload, will_close = self._send(conn, method, path, body, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                conn.close()
+                conn, reused = self._open(), False
+                status, payload, will_close = self._send(conn, method, path, body, headers)
+        except (OSError, http.client.HTTPException) as exc:
+            conn.close()
+            self._record(started, failed=True)
+            if isinstance(exc, OSError):
+                raise
+            raise HttpTransportError(str(exc) or type(exc).__name__) from exc
+
+        if will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        latency_ms = self._record(started, failed=status >= 400)
+        if status >= 400:
+            raise HttpTransportError(f"HTTP {status} from {self.host}", status=status)
+        return HttpResponse(status=status, body=payload, latency_ms=latency_ms, reused=reused)
+
+    async def arequest(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> HttpResponse:
+        return await run_in_threadpool(self.request, method, path, body, headers)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict[str, float | int]:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "opened": self._opened,
+                "reused": self._reused,
+                "requests": self._requests,
+                "errors": self._errors,
+                "avg_latency_ms": round(self._total_ms / self._requests, 2) if self._requests else 0.0,
+                "max_latency_ms": round(self._max_ms, 2),
+                "last_latency_ms": round(self._last_ms, 2),
+            }
@@ -1,28 +1,81 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
+import os
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sympy import simplify
-
-from .math_engine import (
-    ParsedStep,
-    SequenceCandidate,
-    choose_candidate_sequences,
-    classify_error,
-    compare_steps,
-    normalize_text,
-    parse_context_substitutions,
-    parse_step,
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from .cache import LruCache
+from .feedback_cache import FeedbackCache
+from .feedback_jobs import FeedbackJobs
+from .prompting import (
+    FeedbackInput,
+    cached_pedagogical_feedback,
+    close_feedback_transport,
+    fallback_feedback,
+    feedback_transport_stats,
+    generate_pedagogical_feedback,
+    generate_pedagogical_feedback_async,
+    llm_feedback_enabled,
 )
-from .prompting import FeedbackInput, generate_pedagogical_feedback
-from .schemas import StepValidationPayload, ValidateSolutionRequest, ValidateSolutionResponse
-from .storage import init_db, load_db_config, save_validation_run
+from .schemas import (
+    FeedbackStatusResponse,
+    PedagogicalOutput,
+    SessionLineRequest,
+    SessionResponse,
+    StepValidationPayload,
+    ValidateSolutionRequest,
+    ValidateSolutionResponse,
+    ValidateSolutionsRequest,
+    ValidateSolutionsResponse,
+)
+from .sessions import InvalidLineError, SessionStore, UnknownSessionError, ValidationSession
+from .storage import (
+    ValidationRunRecord,
+    connection_stats,
+    ensure_schema,
+    init_db,
+    load_db_config,
+    persistence_stats,
+    save_validation_runs,
+    schema_ready,
+    shutdown_writers,
+    utc_now,
+)
+from .warmup import Warmup
+from .workers import GradingQueueFull, grade_many, grading_slot, pool_stats, run_grading, shutdown_pool
+
+# The grading modules import SymPy, so handlers import them on first use (normally during
+# warm-up) and health checks, storage and feedback code start without it.
+if TYPE_CHECKING:
+    from .exercises import AnswerKey
+    from .grading import GradingResult
 
 app = FastAPI(title="Math Fight Backend", version="1.1.0")
 db_config = load_db_config()
+response_cache: LruCache[str, ValidateSolutionResponse] = LruCache(
+    int(os.getenv("MATHFIGHT_RESPONSE_CACHE_SIZE", "0")),
+    ttl_seconds=float(os.getenv("MATHFIGHT_RESPONSE_CACHE_TTL_S", "300")),
+)
+feedback_cache = FeedbackCache(db_config)
+feedback_jobs = FeedbackJobs(db_config, feedback_cache)
+sessions = SessionStore()
+warmup = Warmup()
+_FEEDBACK_CONCURRENCY = int(os.getenv("MATHFIGHT_BATCH_FEEDBACK_CONCURRENCY", "8"))
+# One long-lived pool for batch feedback, so its threads (and their SQLite connections) are reused.
+_batch_executor: ThreadPoolExecutor | None = None
+_batch_executor_lock = threading.Lock()
+_FEEDBACK_MODE = "deferred" if os.getenv("MATHFIGHT_FEEDBACK_MODE", "inline").strip().lower() == "deferred" else "inline"
+_FEEDBACK_MAX_WAIT_S = float(os.getenv("MATHFIGHT_FEEDBACK_MAX_WAIT_S", "30"))
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +89,19 @@ app.add_middleware(
 @app.on_event("startup")
 def startup_event() -> None:
     init_db(db_config)
+    # Loading the exercise bank, starting workers and grading warm-up exercises happen in the
+    # background; /health answers right away and /ready reports when they are done.
+    warmup.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event() -> None:
+    warmup.join()
+    shutdown_pool()
+    feedback_jobs.shutdown()
+    _shutdown_batch_executor()
+    shutdown_writers()
+    close_feedback_transport()
 
 
 @app.get("/health")
@@ -43,308 +109,398 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@dataclass(frozen=True)
-class EvalResult:
-    lines: list[str]
-    normalized_steps: list[str]
-    step_validations: list[StepValidationPayload]
-    process_valid: bool
-    final_result_correct: bool
-    validation_status: str
-    first_error_index: int | None
-    error_type: str | None
-    equivalence_mode: str
-    previous_solution_set: str | None
-    current_solution_set: str | None
-
-
-def _build_unreadable_response(reason: str, final_result_line: int) -> ValidateSolutionResponse:
-    return ValidateSolutionResponse(
-        decision="unreadable",
-        is_correct=False,
-        final_result_correct=False,
-        process_valid=False,
-        warning_lines=[],
-        wrong_lines=[],
-        final_result_line=max(1, final_result_line),
-        first_error_index=None,
-        error_type=reason,
-        warning_type=None,
-        warning_message="No pude interpretar la escritura con suficiente confianza.",
-        validation_status="undetermined",
-        equivalence_mode="algebraic",
-        previous_solution_set=None,
-        current_solution_set=None,
-        normalized_steps=[],
-        step_validations=[],
-        pedagogical_feedback="No pude interpretar la escritura con suficiente confianza.",
-        suggested_correction_steps=["Escribe cada paso mas claro y en lineas separadas."],
-        debug={"reason": reason},
+@app.get("/ready")
+def ready(response: Response) -> dict[str, object]:
+    if not warmup.ready:
+        response.status_code = 503
+    return warmup.report()
+
+
+@app.get("/v1/metrics")
+def metrics() -> dict[str, object]:
+    from .math_engine import parse_cache_stats
+
+    return {
+        "startup": warmup.report(),
+        "parse_cache": parse_cache_stats().as_dict(),
+        "persistence": persistence_stats(db_config),
+        "connections": connection_stats(),
+        "response_cache": response_cache.stats().as_dict(),
+        "grading_pool": pool_stats(),
+        "feedback_transport": feedback_transport_stats(),
+        "feedback_cache": feedback_cache.stats(),
+        "feedback_jobs": feedback_jobs.stats(),
+        "sessions": sessions.stats(),
+    }
+
+
+def _response_cache_key(payload: ValidateSolutionRequest, user_lines: list[str], exercise_id: str | None) -> str:
+    # Lines and candidates are keyed on the stripped text grading reads, not on their normalized form.
+    canonical = {
+        "exercise_id": exercise_id,
+        "equation_prompt": payload.equation_prompt,
+        "expected_final": payload.expected_final,
+        "context_hint": (payload.context_hint or "").strip(),
+        "ocr_lines": [line.strip() for line in user_lines],
+        "ocr_candidates": [
+            [line.lineIndex, [candidate.text.strip() for candidate in line.candidates]]
+            for line in payload.ocr_candidates or []
+        ],
+        "variable": payload.variable,
+        "locale": payload.locale,
+        "feedback_mode": _feedback_mode(payload),
+        "beam_width": payload.beam_width,
+        "top_k": payload.top_k,
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _resolve_exercise(payload: ValidateSolutionRequest) -> tuple[ValidateSolutionRequest, AnswerKey | None]:
+    if payload.exercise_id is None:
+        return payload, None
+    from .exercises import AmbiguousExerciseError, UnknownExerciseError, get_exercise_bank
+
+    try:
+        key = get_exercise_bank().get(payload.exercise_id)
+    except AmbiguousExerciseError as exc:
+        raise HTTPException(
+            status_code=422,
+            detail=f"exercise_id '{exc.exercise_id}' is ambiguous; use one of {exc.candidates}",
+        ) from exc
+    except UnknownExerciseError as exc:
+        raise HTTPException(status_code=404, detail=f"unknown exercise_id '{payload.exercise_id}'") from exc
+    resolved = payload.model_copy(
+        update={
+            "equation_prompt": key.prompt,
+            "expected_final": key.expected_final,
+            "context_hint": key.context_hint,
+        }
     )
+    return resolved, key
 
 
-def _evaluate_sequence(payload: ValidateSolutionRequest, sequence: SequenceCandidate) -> EvalResult:
-    full_steps = [payload.equation_prompt, *sequence.lines]
-    substitutions = parse_context_substitutions(payload.context_hint)
-    parsed = [parse_step(step) for step in full_steps]
-
-    expression_prompt_mode = "=" not in payload.equation_prompt
-    effective_steps: list[ParsedStep] = []
-    for idx, step in enumerate(parsed):
-        if not expression_prompt_mode or idx == 0:
-            effective_steps.append(step)
-            continue
-
-        previous = effective_steps[idx - 1]
-        current = step
-        coerced = current
-        if (
-            previous.expr is not None
-            and current.eq is not None
-            and current.parse_error is None
-            and len(current.eq.lhs.free_symbols) == 0
-            and len(current.eq.rhs.free_symbols) == 0
-        ):
-            try:
-                if bool(simplify(previous.expr - current.eq.lhs) == 0):
-                    chosen = current.eq.rhs
-                elif bool(simplify(previous.expr - current.eq.rhs) == 0):
-                    chosen = current.eq.lhs
-                else:
-                    chosen = None
-            except Exception:
-                chosen = None
-
-            if chosen is not None:
-                chosen_str = str(chosen)
-                coerced = ParsedStep(
-                    raw=current.raw,
-                    normalized=normalize_text(chosen_str),
-                    is_equation=False,
-                    expr=chosen,
-                    eq=None,
-                    parse_error=None,
-                )
-        effective_steps.append(coerced)
-
-    normalized_steps = [step.normalized for step in effective_steps]
-
-    step_validations: list[StepValidationPayload] = []
-    process_valid = True
-    validation_status = "valid"
-    first_error_index: int | None = None
-    error_type: str | None = None
-    equivalence_mode = "solution_set"
-    prev_set: str | None = None
-    curr_set: str | None = None
-
-    for idx in range(len(effective_steps) - 1):
-        previous = effective_steps[idx]
-        current = effective_steps[idx + 1]
-        result = compare_steps(previous, current, payload.variable, substitutions=substitutions)
-        step_validations.append(result)
-        equivalence_mode = result.equivalence_mode
-        prev_set = result.previous_solution_set
-        curr_set = result.current_solution_set
-        if result.validation_status == "undetermined":
-            process_valid = False
-            validation_status = "undetermined"
-            first_error_index = idx
-            error_type = "undetermined"
-            break
-        if not result.equivalent:
-            process_valid = False
-            validation_status = "invalid"
-            first_error_index = idx
-            error_type = classify_error(previous, current)
-            break
-
-    expected_step = parse_step(payload.expected_final)
-    final_step = effective_steps[-1]
-    expected_check = compare_steps(
-        final_step,
-        expected_step,
-        payload.variable,
-        substitutions=substitutions,
-    )
-    final_result_correct = (
-        expected_check.validation_status == "valid" and expected_check.equivalent
-    )
+def _cache_bypassed(cache_control: str | None, cache_header: str | None) -> bool:
+    if cache_header is not None and cache_header.strip().lower() == "bypass":
+        return True
+    return cache_control is not None and "no-cache" in cache_control.lower()
+
+
+def _feedback_mode(payload: ValidateSolutionRequest) -> str:
+    return payload.feedback_mode or _FEEDBACK_MODE
 
-    if expected_check.validation_status == "undetermined" and final_result_correct is False:
-        validation_status = "undetermined"
-        if error_type is None:
-            error_type = "undetermined"
-        equivalence_mode = expected_check.equivalence_mode
-        prev_set = expected_check.previous_solution_set
-        curr_set = expected_check.current_solution_set
-
-    return EvalResult(
-        lines=sequence.lines,
-        normalized_steps=normalized_steps,
-        step_validations=step_validations,
-        process_valid=process_valid,
-        final_result_correct=final_result_correct,
-        validation_status=validation_status,
-        first_error_index=first_error_index,
-        error_type=error_type,
-        equivalence_mode=equivalence_mode,
-        previous_solution_set=prev_set,
-        current_solution_set=curr_set,
-    )
 
+def _deferred_feedback(feedback_input: FeedbackInput) -> tuple[PedagogicalOutput, str | None]:
+    # Without an LLM the fallback is final, and a cached answer is as fast as the fallback.
+    if not llm_feedback_enabled():
+        return fallback_feedback(feedback_input), None
+    cached = cached_pedagogical_feedback(feedback_input, feedback_cache)
+    if cached is not None:
+        return cached, None
+    return fallback_feedback(feedback_input), feedback_jobs.submit(feedback_input)
 
-def _score_eval(eval_result: EvalResult) -> int:
-    score = 0
-    if eval_result.final_result_correct:
-        score += 100
-    if eval_result.process_valid:
-        score += 50
-    if eval_result.validation_status == "undetermined":
-        score -= 20
-    if eval_result.error_type == "parse_error":
-        score -= 30
-    return score
+
+def _finish_response(
+    payload: ValidateSolutionRequest,
+    grading: GradingResult,
+    exercise_id: str | None,
+) -> ValidateSolutionResponse:
+    from .grading import build_feedback_input, build_response, decide
+
+    verdict = decide(grading)
+    feedback_input = build_feedback_input(payload, grading, verdict)
+    feedback_id = None
+    if _feedback_mode(payload) == "deferred":
+        feedback, feedback_id = _deferred_feedback(feedback_input)
+    else:
+        feedback = generate_pedagogical_feedback(feedback_input, feedback_cache)
+    response = build_response(payload, grading, verdict, feedback, exercise_id=exercise_id)
+    response.feedback_id = feedback_id
+    return response
 
 
 @app.post("/v1/validate-solution", response_model=ValidateSolutionResponse)
-def validate_solution(payload: ValidateSolutionRequest) -> ValidateSolutionResponse:
-    # Ensures migrations exist even when startup hooks are skipped by some test runners.
-    init_db(db_config)
+async def validate_solution(
+    payload: ValidateSolutionRequest,
+    cache_control: str | None = Header(default=None),
+    x_mathfight_cache: str | None = Header(default=None),
+) -> ValidateSolutionResponse:
+    from .grading import build_feedback_input, build_response, build_unreadable_response, decide
+
+    # Startup normally migrates; this only hits the database when startup hooks were skipped.
+    if not schema_ready(db_config):
+        await run_in_threadpool(ensure_schema, db_config)
     started = time.perf_counter()
+    payload, answer_key = _resolve_exercise(payload)
+    exercise_id = None if answer_key is None else answer_key.qualified_id
     user_lines = [line for line in payload.ocr_lines if line.strip()]
     final_result_line = max(1, len(user_lines))
     if not user_lines:
-        return _build_unreadable_response("parse_error", final_result_line)
-
-    candidates = choose_candidate_sequences(
-        user_lines,
-        payload.ocr_candidates,
-        beam_width=5,
-        top_k=3,
-    )
-    if not candidates:
-        return _build_unreadable_response("parse_error", final_result_line)
-
-    best_eval: EvalResult | None = None
-    best_candidate: SequenceCandidate | None = None
-    best_score = -10_000
-    scored_sequences: list[dict[str, object]] = []
-    for candidate in candidates:
-        evaluated = _evaluate_sequence(payload, candidate)
-        score = _score_eval(evaluated) + candidate.score
-        scored_sequences.append(
-            {
-                "lines": candidate.lines,
-                "score": score,
-                "final_result_correct": evaluated.final_result_correct,
-                "process_valid": evaluated.process_valid,
-            }
-        )
-        if score > best_score:
-            best_score = score
-            best_eval = evaluated
-            best_candidate = candidate
-
-    if best_eval is None or best_candidate is None:
-        return _build_unreadable_response("parse_error", final_result_line)
-
-    final_result_correct = best_eval.final_result_correct
-    process_valid = best_eval.process_valid
-    warning_type = best_candidate.warning_type
-    warning_message = best_candidate.warning_message
-
-    has_ambiguity_warning = warning_type is not None and warning_type == "ocr_ambiguous"
-    if final_result_correct and process_valid and not has_ambiguity_warning:
-        decision = "correct"
-        is_correct = True
-    elif final_result_correct and (not process_valid or has_ambiguity_warning):
-        decision = "correct_with_warnings"
-        is_correct = True
-        if warning_type is None:
-            warning_type = "process_inconsistent"
-            warning_message = (
-                "El resultado final es correcto, pero hay un paso intermedio para revisar."
-            )
-    elif best_eval.validation_status == "undetermined":
-        decision = "unreadable"
-        is_correct = False
+        return build_unreadable_response("parse_error", final_result_line)
+
+    cache_enabled = response_cache.maxsize > 0
+    bypass = _cache_bypassed(cache_control, x_mathfight_cache)
+    cache_key = _response_cache_key(payload, user_lines, exercise_id) if cache_enabled else None
+    if cache_key is not None and not bypass:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            hit = cached.model_copy(deep=True)
+            hit.debug["response_cache"] = "hit"
+            await run_in_threadpool(_persist_responses, [(payload, hit, _elapsed_ms(started))], cache_hit=True)
+            return hit
+
+    try:
+        grading = await run_grading(payload)
+    except GradingQueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+    if grading.best_eval is None:
+        return build_unreadable_response("parse_error", final_result_line)
+
+    if _feedback_mode(payload) == "deferred":
+        response = await run_in_threadpool(_finish_response, payload, grading, exercise_id)
     else:
-        decision = "incorrect"
-        is_correct = False
-
-    wrong_lines: list[int] = []
-    warning_lines: list[int] = []
-    if best_eval.first_error_index is not None:
-        line_no = min(max(1, best_eval.first_error_index + 1), final_result_line)
-        if decision == "correct_with_warnings":
-            warning_lines.append(line_no)
-        else:
-            wrong_lines.append(line_no)
-    warning_lines.extend([line for line in best_candidate.ambiguous_lines if line <= final_result_line])
-    wrong_lines = sorted(set(wrong_lines))
-    warning_lines = sorted(set(warning_lines))
-
-    feedback = generate_pedagogical_feedback(
-        FeedbackInput(
-            decision=decision,
-            error_type=best_eval.error_type,
-            warning_type=warning_type,
-            expected_final=payload.expected_final,
-            normalized_steps=best_eval.normalized_steps,
-            step_validations=[item.model_dump() for item in best_eval.step_validations],
-            wrong_lines=wrong_lines,
-            warning_lines=warning_lines,
-            final_result_correct=final_result_correct,
-            process_valid=process_valid,
-            locale=payload.locale,
-            warning_message=warning_message,
+        verdict = decide(grading)
+        feedback = await generate_pedagogical_feedback_async(
+            build_feedback_input(payload, grading, verdict),
+            feedback_cache,
         )
-    )
+        response = build_response(payload, grading, verdict, feedback, exercise_id=exercise_id)
+    if cache_key is not None:
+        # A timeout can come from load alone, so it must not be replayed to identical submissions.
+        if not grading.timed_out:
+            response_cache.put(cache_key, response.model_copy(deep=True))
+        response.debug["response_cache"] = "bypass" if bypass else "miss"
+
+    await run_in_threadpool(_persist_responses, [(payload, response, _elapsed_ms(started))])
+    return response
 
-    response = ValidateSolutionResponse(
-        decision=decision,  # type: ignore[arg-type]
-        is_correct=is_correct,
-        final_result_correct=final_result_correct,
-        process_valid=process_valid,
-        warning_lines=warning_lines,
-        wrong_lines=wrong_lines,
-        final_result_line=final_result_line,
-        first_error_index=best_eval.first_error_index,
-        error_type=best_eval.error_type,
-        warning_type=warning_type,
-        warning_message=warning_message,
-        validation_status=best_eval.validation_status,  # type: ignore[arg-type]
-        equivalence_mode=best_eval.equivalence_mode,  # type: ignore[arg-type]
-        previous_solution_set=best_eval.previous_solution_set,
-        current_solution_set=best_eval.current_solution_set,
-        normalized_steps=best_eval.normalized_steps,
-        step_validations=best_eval.step_validations,
-        pedagogical_feedback=feedback.short_feedback,
-        suggested_correction_steps=feedback.correction_steps,
-        debug={
-            "input_steps": [payload.equation_prompt, *user_lines],
-            "selected_lines": best_eval.lines,
-            "candidate_scores": scored_sequences,
-            "has_ocr_candidates": bool(payload.ocr_candidates),
-            "tone": feedback.tone,
-        },
-    )
 
-    elapsed_ms = int((time.perf_counter() - started) * 1000)
-    save_validation_run(
-        db_config,
-        equation_prompt=payload.equation_prompt,
-        expected_final=payload.expected_final,
-        ocr_lines=user_lines,
-        decision=response.decision,
-        error_type=response.error_type,
-        warning_type=response.warning_type,
-        wrong_lines=response.wrong_lines,
-        warning_lines=response.warning_lines,
-        final_result_correct=response.final_result_correct,
-        process_valid=response.process_valid,
-        latency_ms=elapsed_ms,
-        step_validations=[item.model_dump() for item in response.step_validations],
+def _sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_validation(
+    payload: ValidateSolutionRequest,
+    answer_key: AnswerKey | None,
+    started: float,
+) -> AsyncIterator[str]:
+    from .grading import build_feedback_input, build_response, build_unreadable_response, decide, grade_submission
+
+    user_lines = [line for line in payload.ocr_lines if line.strip()]
+    final_result_line = max(1, len(user_lines))
+    if not user_lines:
+        yield _sse("verdict", build_unreadable_response("parse_error", final_result_line).model_dump())
+        yield _sse("done", {})
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[tuple[int, int, StepValidationPayload] | None] = asyncio.Queue()
+
+    def on_step(candidate: int, index: int, result: StepValidationPayload) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, (candidate, index, result))
+
+    # Callbacks cannot cross a process boundary, so streaming always grades on the thread pool,
+    # but it still takes a process-mode queue slot so the stream cannot bypass admission control.
+    try:
+        with grading_slot():
+            task = asyncio.ensure_future(run_in_threadpool(grade_submission, payload, None, None, on_step))
+            task.add_done_callback(lambda _: queue.put_nowait(None))
+            while (item := await queue.get()) is not None:
+                candidate, index, result = item
+                yield _sse(
+                    "step", {"candidate": candidate, "index": index, "line": index + 1, "step": result.model_dump()}
+                )
+            grading = task.result()
+    except GradingQueueFull as exc:
+        yield _sse("error", {"detail": str(exc)})
+        yield _sse("done", {})
+        return
+    except Exception:
+        # The 200 headers are already sent, so a grading failure is reported in-band.
+        yield _sse("error", {"detail": "grading failed"})
+        yield _sse("done", {})
+        return
+    if grading.best_eval is None:
+        yield _sse("verdict", build_unreadable_response("parse_error", final_result_line).model_dump())
+        yield _sse("done", {})
+        return
+
+    exercise_id = None if answer_key is None else answer_key.qualified_id
+    verdict = decide(grading)
+    feedback_input = build_feedback_input(payload, grading, verdict)
+    preliminary = build_response(payload, grading, verdict, fallback_feedback(feedback_input), exercise_id=exercise_id)
+    yield _sse("verdict", preliminary.model_dump())
+
+    feedback = await generate_pedagogical_feedback_async(feedback_input, feedback_cache)
+    yield _sse("feedback", feedback.model_dump())
+    response = build_response(payload, grading, verdict, feedback, exercise_id=exercise_id)
+    await run_in_threadpool(_persist_responses, [(payload, response, _elapsed_ms(started))])
+    yield _sse("done", {})
+
+
+@app.post("/v1/validate-solution/stream")
+async def validate_solution_stream(payload: ValidateSolutionRequest) -> StreamingResponse:
+    if not schema_ready(db_config):
+        await run_in_threadpool(ensure_schema, db_config)
+    started = time.perf_counter()
+    payload, answer_key = _resolve_exercise(payload)
+    return StreamingResponse(
+        _stream_validation(payload, answer_key, started),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return response
+
+
+def _session(session_id: str) -> ValidationSession:
+    try:
+        return sessions.get(session_id)
+    except UnknownSessionError as exc:
+        raise HTTPException(status_code=404, detail=f"unknown or expired session '{session_id}'") from exc
+
+
+def _session_response(session: ValidationSession, result: ValidateSolutionResponse) -> SessionResponse:
+    return SessionResponse(session_id=session.session_id, lines=list(session.lines), result=result)
+
+
+@app.post("/v1/sessions", response_model=SessionResponse)
+def create_session(payload: ValidateSolutionRequest) -> SessionResponse:
+    payload, answer_key = _resolve_exercise(payload)
+    session = sessions.create(payload, None if answer_key is None else answer_key.qualified_id)
+    return _session_response(session, session.current())
+
+
+@app.get("/v1/sessions/{session_id}", response_model=SessionResponse)
+def get_session(session_id: str) -> SessionResponse:
+    session = _session(session_id)
+    return _session_response(session, session.current())
+
+
+@app.put("/v1/sessions/{session_id}/lines/{line_number}", response_model=SessionResponse)
+def put_session_line(session_id: str, line_number: int, line: SessionLineRequest) -> SessionResponse:
+    session = _session(session_id)
+    try:
+        result = session.set_line(line_number, line.text, line.candidates)
+    except InvalidLineError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return _session_response(session, result)
+
+
+@app.delete("/v1/sessions/{session_id}/lines/{line_number}", response_model=SessionResponse)
+def truncate_session(session_id: str, line_number: int) -> SessionResponse:
+    session = _session(session_id)
+    try:
+        result = session.truncate(line_number)
+    except InvalidLineError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return _session_response(session, result)
+
+
+@app.delete("/v1/sessions/{session_id}", status_code=204, response_class=Response)
+def delete_session(session_id: str) -> Response:
+    try:
+        sessions.delete(session_id)
+    except UnknownSessionError as exc:
+        raise HTTPException(status_code=404, detail=f"unknown or expired session '{session_id}'") from exc
+    return Response(status_code=204)
+
+
+@app.get("/v1/feedback/{feedback_id}", response_model=FeedbackStatusResponse)
+async def get_feedback(feedback_id: str, wait: float = 0.0) -> FeedbackStatusResponse:
+    if not schema_ready(db_config):
+        await run_in_threadpool(ensure_schema, db_config)
+    state = await feedback_jobs.wait(feedback_id, min(max(wait, 0.0), _FEEDBACK_MAX_WAIT_S))
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"unknown feedback_id '{feedback_id}'")
+    status, feedback = state
+    return FeedbackStatusResponse(feedback_id=feedback_id, status=status, feedback=feedback)
+
+
+@app.post("/v1/validate-solutions", response_model=ValidateSolutionsResponse)
+def validate_solutions(payload: ValidateSolutionsRequest) -> ValidateSolutionsResponse:
+    from .grading import build_unreadable_response
+
+    ensure_schema(db_config)
+    resolved: list[tuple[ValidateSolutionRequest, AnswerKey | None]] = []
+    for index, item in enumerate(payload.items):
+        try:
+            resolved.append(_resolve_exercise(item))
+        except HTTPException as exc:
+            raise HTTPException(status_code=exc.status_code, detail=f"items[{index}]: {exc.detail}") from exc
+
+    gradable = [i for i, (item, _) in enumerate(resolved) if any(line.strip() for line in item.ocr_lines)]
+    try:
+        gradings = dict(zip(gradable, grade_many([resolved[i][0] for i in gradable])))
+    except GradingQueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+
+    latencies: dict[int, int] = {}
+
+    def finish(index: int) -> ValidateSolutionResponse:
+        item, answer_key = resolved[index]
+        grading = gradings.get(index)
+        if grading is None or grading.best_eval is None:
+            lines = [line for line in item.ocr_lines if line.strip()]
+            return build_unreadable_response("parse_error", max(1, len(lines)))
+        started = time.perf_counter()
+        response = _finish_response(item, grading, None if answer_key is None else answer_key.qualified_id)
+        # Per-item cost: this item's own grading plus its feedback, not the whole batch.
+        latencies[index] = int((grading.grading_ms or 0) + (time.perf_counter() - started) * 1000)
+        return response
+
+    results = list(_get_batch_executor().map(finish, range(len(resolved))))
+
+    _persist_responses([(resolved[i][0], results[i], latencies[i]) for i in gradable if i in latencies])
+    return ValidateSolutionsResponse(results=results)
+
+
+def _get_batch_executor() -> ThreadPoolExecutor:
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=max(1, _FEEDBACK_CONCURRENCY), thread_name_prefix="batch-feedback"
+            )
+        return _batch_executor
+
+
+def _shutdown_batch_executor() -> None:
+    global _batch_executor
+    with _batch_executor_lock:
+        executor, _batch_executor = _batch_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _elapsed_ms(started: float) -> int:
+    return int((time.perf_counter() - started) * 1000)
+
+
+def _persist_responses(
+    items: list[tuple[ValidateSolutionRequest, ValidateSolutionResponse, int]],
+    cache_hit: bool = False,
+) -> None:
+    created_at = utc_now()
+    records = [
+        ValidationRunRecord(
+            equation_prompt=payload.equation_prompt,
+            expected_final=payload.expected_final,
+            ocr_lines=[line for line in payload.ocr_lines if line.strip()],
+            decision=response.decision,
+            error_type=response.error_type,
+            warning_type=response.warning_type,
+            wrong_lines=response.wrong_lines,
+            warning_lines=response.warning_lines,
+            final_result_correct=response.final_result_correct,
+            process_valid=response.process_valid,
+            latency_ms=latency_ms,
+            # A hit repeats a stored verdict; its step diagnostics already exist on the original run.
+            step_validations=[] if cache_hit else [item.model_dump() for item in response.step_validations],
+            created_at=created_at,
+            cache_hit=cache_hit,
+            timed_out=bool(response.debug.get("timed_out")),
+            feedback_id=response.feedback_id,
+        )
+        for payload, response, latency_ms in items
+    ]
+    if records:
+        save_validation_runs(db_config, records)
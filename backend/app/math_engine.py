@@ -1,10 +1,20 @@
 from __future__ import annotations
 
+import heapq
+import os
+import random
 import re
-from dataclasses import dataclass
-from typing import Literal
-
-from sympy import Eq, S, simplify, solveset, sympify
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from fractions import Fraction
+from functools import lru_cache
+from operator import itemgetter
+from typing import Iterator, Literal
+
+from sympy import Add, Eq, FiniteSet, Float, Integer, Pow, Rational, S, Symbol, simplify, solveset, sqrt, sympify
 from sympy.core.expr import Expr
 from sympy.parsing.sympy_parser import (
     convert_xor,
@@ -14,6 +24,7 @@ from sympy.parsing.sympy_parser import (
 )
 from sympy.sets.sets import Set
 
+from .cache import CacheStats, LruCache
 from .schemas import OcrLineCandidatesPayload, StepValidationPayload
 
 ValidationStatus = Literal["valid", "invalid", "undetermined"]
@@ -24,6 +35,16 @@ _TRANSFORMATIONS = standard_transformations + (
     convert_xor,
 )
 
+_PARSE_CACHE_SIZE = int(os.getenv("MATHFIGHT_PARSE_CACHE_SIZE", "4096"))
+_FAST_PARSER = os.getenv("MATHFIGHT_FAST_PARSER", "1").strip().lower() not in ("0", "false", "no")
+_NUMERIC_TRIALS = int(os.getenv("MATHFIGHT_NUMERIC_TRIALS", "6"))
+_SYMBOLIC_CONFIRM = os.getenv("MATHFIGHT_SYMBOLIC_CONFIRM", "1").strip().lower() not in ("0", "false", "no")
+_STEP_BUDGET_MS = int(os.getenv("MATHFIGHT_STEP_BUDGET_MS", "2000"))
+_REQUEST_BUDGET_MS = int(os.getenv("MATHFIGHT_REQUEST_BUDGET_MS", "8000"))
+_rng = random.Random()
+
+TIMEOUT_REASON = "timeout"
+
 
 @dataclass(frozen=True)
 class ParsedStep:
@@ -44,6 +65,65 @@ class SequenceCandidate:
     ambiguous_lines: list[int]
 
 
+class ComputeTimeout(BaseException):
+    # BaseException so SymPy's and our own `except Exception` handlers cannot swallow it.
+    pass
+
+
+def _raise_timeout(signum: int, frame: object) -> None:
+    raise ComputeTimeout()
+
+
+def _can_interrupt() -> bool:
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+class Deadline:
+    def __init__(self, step_budget_ms: int | None = None, request_budget_ms: int | None = None) -> None:
+        step_ms = _STEP_BUDGET_MS if step_budget_ms is None else step_budget_ms
+        request_ms = _REQUEST_BUDGET_MS if request_budget_ms is None else request_budget_ms
+        self.step_budget = step_ms / 1000 if step_ms > 0 else None
+        self.expires_at = time.monotonic() + request_ms / 1000 if request_ms > 0 else None
+        self.timed_out = False
+
+    def remaining(self) -> float | None:
+        return None if self.expires_at is None else self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    @contextmanager
+    def step(self) -> Iterator[None]:
+        # Hard limit via SIGALRM where possible (main thread, e.g. pool workers); elsewhere
+        # the step cannot be interrupted, so it is timed and rejected once it returns over budget.
+        limits = [value for value in (self.step_budget, self.remaining()) if value is not None]
+        if not limits:
+            yield
+            return
+        limit = min(limits)
+        if limit <= 0:
+            self.timed_out = True
+            raise ComputeTimeout()
+        if not _can_interrupt() or signal.getitimer(signal.ITIMER_REAL)[0] > 0:
+            started = time.monotonic()
+            yield
+            if time.monotonic() - started > limit:
+                self.timed_out = True
+                raise ComputeTimeout()
+            return
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, limit)
+        try:
+            yield
+        except ComputeTimeout:
+            self.timed_out = True
+            raise
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
 def normalize_text(value: str) -> str:
     cleaned = value.strip()
     cleaned = cleaned.replace("−", "-").replace("–", "-")
@@ -66,35 +146,184 @@ def parse_context_substitutions(context_hint: str | None) -> dict[str, Expr]:
         if not re.fullmatch(r"[a-zA-Z]\w*", name):
             continue
         try:
-            result[name] = parse_expr(raw, transformations=_TRANSFORMATIONS, evaluate=True)
+            result[name] = _parse_expression(raw)
         except Exception:
             continue
     return result
 
 
+_parse_cache: LruCache[str, ParsedStep] = LruCache(_PARSE_CACHE_SIZE)
+
+
+def configure_parse_cache(maxsize: int) -> None:
+    _parse_cache.resize(maxsize)
+
+
+def clear_parse_cache() -> None:
+    _parse_cache.clear()
+
+
+def parse_cache_stats() -> CacheStats:
+    return _parse_cache.stats()
+
+
 def parse_step(raw: str) -> ParsedStep:
     normalized = normalize_text(raw)
+    cached = _parse_cache.get(normalized)
+    if cached is None:
+        cached = _parse_normalized(normalized)
+        _parse_cache.put(normalized, cached)
+    return cached if cached.raw == raw else replace(cached, raw=raw)
+
+
+_FAST_TOKEN = re.compile(r"(\d+\.?\d*|\.\d+)|([a-z])|(\*\*|[-+*/^()])")
+_INFIX_POWER = {"+": 10, "-": 10, "*": 20, "/": 20, "^": 40, "**": 40}
+_IMPLICIT_POWER = 20
+_UNARY_POWER = 30
+_fast_symbols: dict[str, Symbol] = {}
+
+
+class _OutsideGrammar(Exception):
+    pass
+
+
+def _fast_tokens(text: str) -> list[tuple[str, str]]:
+    tokens: list[tuple[str, str]] = []
+    pos = 0
+    size = len(text)
+    while pos < size:
+        match = _FAST_TOKEN.match(text, pos)
+        if match is None:
+            raise _OutsideGrammar(text)
+        number, letter, op = match.groups()
+        end = match.end()
+        following = text[end] if end < size else ""
+        if number is not None:
+            # Python reads these as other literals (1e5, 2j, 0x1f, 007, 1.2.3), so leave them to parse_expr.
+            if following in ("e", "j", ".", "_") or (number[0] == "0" and number[1:2].isdigit()):
+                raise _OutsideGrammar(text)
+            if number == "0" and following in ("b", "o", "x"):
+                raise _OutsideGrammar(text)
+            tokens.append(("num", number))
+        elif letter is not None:
+            # Multi-letter names (pi, sqrt, xy) and names like x2 keep SymPy's meaning.
+            if following.isalnum() or following == "_":
+                raise _OutsideGrammar(text)
+            tokens.append(("sym", letter))
+        else:
+            tokens.append(("op", op))
+        pos = end
+    return tokens
+
+
+class _FastParser:
+    __slots__ = ("tokens", "pos")
+
+    def __init__(self, tokens: list[tuple[str, str]]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self) -> Expr:
+        expr = self.expression(0)
+        if self.pos != len(self.tokens):
+            raise _OutsideGrammar()
+        return expr
+
+    def expression(self, min_power: int) -> Expr:
+        left = self.prefix()
+        tokens = self.tokens
+        while self.pos < len(tokens):
+            kind, value = tokens[self.pos]
+            if kind == "op" and value != "(":
+                if value == ")":
+                    break
+                power = _INFIX_POWER[value]
+                if power <= min_power:
+                    break
+                self.pos += 1
+                if power == 40:
+                    left = self.power(left, self.expression(power - 1))
+                    continue
+                right = self.expression(power)
+                if value == "+":
+                    left = left + right
+                elif value == "-":
+                    left = left - right
+                elif value == "*":
+                    left = left * right
+                else:
+                    left = left / right
+                continue
+            if _IMPLICIT_POWER <= min_power:
+                break
+            left = left * self.expression(_IMPLICIT_POWER)
+        return left
+
+    def prefix(self) -> Expr:
+        if self.pos >= len(self.tokens):
+            raise _OutsideGrammar()
+        kind, value = self.tokens[self.pos]
+        self.pos += 1
+        if kind == "num":
+            return self.number(value)
+        if kind == "sym":
+            return self.symbol(value)
+        if value == "(":
+            inner = self.expression(0)
+            if self.pos >= len(self.tokens) or self.tokens[self.pos] != ("op", ")"):
+                raise _OutsideGrammar()
+            self.pos += 1
+            return inner
+        if value == "-":
+            return -self.expression(_UNARY_POWER)
+        if value == "+":
+            return +self.expression(_UNARY_POWER)
+        raise _OutsideGrammar()
+
+    def number(self, value: str) -> Expr:
+        return Float(value) if "." in value else Integer(value)
+
+    def symbol(self, value: str) -> Expr:
+        symbol = _fast_symbols.get(value)
+        if symbol is None:
+            symbol = _fast_symbols.setdefault(value, Symbol(value))
+        return symbol
+
+    def power(self, base: Expr, exponent: Expr) -> Expr:
+        return base**exponent
+
+
+def _parse_expression(text: str) -> Expr:
+    if _FAST_PARSER:
+        try:
+            return _FastParser(_fast_tokens(text)).parse()
+        except _OutsideGrammar:
+            pass
+    return parse_expr(text, transformations=_TRANSFORMATIONS, evaluate=True)
+
+
+def _parse_normalized(normalized: str) -> ParsedStep:
     if not normalized:
-        return ParsedStep(raw, normalized, False, None, None, "empty_step")
+        return ParsedStep(normalized, normalized, False, None, None, "empty_step")
 
     if normalized.count("=") == 1:
         lhs_raw, rhs_raw = normalized.split("=")
         try:
-            lhs = parse_expr(lhs_raw, transformations=_TRANSFORMATIONS, evaluate=True)
-            rhs = parse_expr(rhs_raw, transformations=_TRANSFORMATIONS, evaluate=True)
+            lhs = _parse_expression(lhs_raw)
+            rhs = _parse_expression(rhs_raw)
             eq = Eq(lhs, rhs, evaluate=False)
         except Exception as exc:
-            return ParsedStep(raw, normalized, True, None, None, f"parse_error:{exc}")
-        return ParsedStep(raw, normalized, True, None, eq, None)
+            return ParsedStep(normalized, normalized, True, None, None, f"parse_error:{exc}")
+        return ParsedStep(normalized, normalized, True, None, eq, None)
 
     if "=" in normalized:
-        return ParsedStep(raw, normalized, True, None, None, "invalid_equation_format")
+        return ParsedStep(normalized, normalized, True, None, None, "invalid_equation_format")
 
     try:
-        expr = parse_expr(normalized, transformations=_TRANSFORMATIONS, evaluate=True)
+        expr = _parse_expression(normalized)
     except Exception as exc:
-        return ParsedStep(raw, normalized, False, None, None, f"parse_error:{exc}")
-    return ParsedStep(raw, normalized, False, expr, None, None)
+        return ParsedStep(normalized, normalized, False, None, None, f"parse_error:{exc}")
+    return ParsedStep(normalized, normalized, False, expr, None, None)
 
 
 def apply_substitutions(step: ParsedStep, substitutions: dict[str, Expr]) -> ParsedStep:
@@ -121,20 +350,162 @@ def apply_substitutions(step: ParsedStep, substitutions: dict[str, Expr]) -> Par
     return step
 
 
+@lru_cache(maxsize=256)
+def _symbol(name: str) -> Expr:
+    return sympify(name)
+
+
+def _polynomial_coefficients(expr: Expr, symbol: Expr) -> tuple[Rational, Rational, Rational] | None:
+    if not expr.free_symbols <= {symbol}:
+        return None
+    for power in expr.atoms(Pow):
+        if power.base.has(symbol) and not (power.exp.is_Integer and 0 < power.exp <= 2):
+            return None
+    coefficients = [S.Zero, S.Zero, S.Zero]
+    for term in Add.make_args(expr.expand()):
+        coeff, rest = term.as_coeff_Mul()
+        if not coeff.is_Rational:
+            return None
+        if rest == 1:
+            degree = 0
+        elif rest == symbol:
+            degree = 1
+        elif rest.is_Pow and rest.base == symbol and rest.exp == 2:
+            degree = 2
+        else:
+            return None
+        coefficients[degree] += coeff
+    c, b, a = coefficients
+    return a, b, c
+
+
+def _polynomial_solution_set(eq: Eq, symbol: Expr) -> Set | None:
+    coefficients = _polynomial_coefficients(eq.lhs - eq.rhs, symbol)
+    if coefficients is None:
+        return None
+    a, b, c = coefficients
+    if a == 0 and b == 0:
+        return S.Reals if c == 0 else S.EmptySet
+    if a == 0:
+        return FiniteSet(-c / b)
+    discriminant = b**2 - 4 * a * c
+    if discriminant < 0:
+        return S.EmptySet
+    if discriminant == 0:
+        return FiniteSet(-b / (2 * a))
+    root = sqrt(discriminant)
+    return FiniteSet((-b - root) / (2 * a), (-b + root) / (2 * a))
+
+
 def _solution_set(eq: Eq, variable: str) -> Set | None:
-    symbol = sympify(variable)
+    symbol = _symbol(variable)
     try:
+        # Substitutions build an evaluating Eq, which may already be BooleanTrue/BooleanFalse.
+        if isinstance(eq, Eq):
+            fast = _polynomial_solution_set(eq, symbol)
+            if fast is not None:
+                return fast
         return solveset(eq, symbol, domain=S.Reals)
     except Exception:
         return None
 
 
+def _is_canonical_set(value: Set) -> bool:
+    if value in (S.Reals, S.EmptySet):
+        return True
+    return isinstance(value, FiniteSet) and all(item.is_Rational for item in value)
+
+
+def _sets_equivalent(a: Set, b: Set) -> bool:
+    if _is_canonical_set(a) and _is_canonical_set(b):
+        return a == b
+    return bool(simplify(a.symmetric_difference(b)) == S.EmptySet)
+
+
+class SolutionSetMemo:
+    def __init__(self) -> None:
+        self._sets: dict[tuple[str, str, tuple[tuple[str, Expr], ...]], Set | None] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(
+        step: ParsedStep,
+        variable: str,
+        substitutions: dict[str, Expr],
+    ) -> tuple[str, str, tuple[tuple[str, Expr], ...]]:
+        return (step.normalized, variable, tuple(sorted(substitutions.items())))
+
+    def seed(self, step: ParsedStep, variable: str, substitutions: dict[str, Expr], value: Set | None) -> None:
+        if step.eq is not None:
+            self._sets.setdefault(self._key(step, variable, substitutions), value)
+
+    def solve(self, step: ParsedStep, variable: str, substitutions: dict[str, Expr]) -> Set | None:
+        if step.eq is None:
+            return None
+        key = self._key(step, variable, substitutions)
+        if key in self._sets:
+            self.hits += 1
+            return self._sets[key]
+        self.misses += 1
+        value = _solution_set(step.eq, variable)
+        self._sets[key] = value
+        return value
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._sets), "hits": self.hits, "misses": self.misses}
+
+
+def _numeric_probe(diff: Expr, trials: int) -> bool | None:
+    # True: some sample point is provably non-zero. False: every usable point is
+    # exactly zero. None: no point could be decided.
+    symbols = sorted(diff.free_symbols, key=str)
+    agreed = 0
+    for _ in range(max(1, trials) if symbols else 1):
+        point = {symbol: Rational(_rng.randint(-97, 97), _rng.randint(1, 13)) for symbol in symbols}
+        value = diff.xreplace(point) if point else diff
+        if value.has(S.NaN, S.ComplexInfinity, S.Infinity, S.NegativeInfinity):
+            continue
+        if value.is_Rational:
+            if value != 0:
+                return True
+            agreed += 1
+            continue
+        is_zero = value.is_zero
+        if is_zero is False:
+            return True
+        if is_zero:
+            agreed += 1
+    return False if agreed else None
+
+
+def expressions_equivalent(
+    a: Expr,
+    b: Expr,
+    symbolic_confirm: bool | None = None,
+    trials: int | None = None,
+) -> bool:
+    diff = a - b
+    if diff.is_Rational:
+        return diff == 0
+    if diff.has(Float):
+        # With decimals a non-zero sample can be rounding error, so only simplify can decide.
+        return bool(simplify(diff) == 0)
+    probe = _numeric_probe(diff, _NUMERIC_TRIALS if trials is None else trials)
+    if probe is True:
+        return False
+    confirm = _SYMBOLIC_CONFIRM if symbolic_confirm is None else symbolic_confirm
+    if probe is False and not confirm:
+        return True
+    return bool(simplify(diff) == 0)
+
+
 def _set_to_string(value: Set | None) -> str | None:
     return None if value is None else str(value)
 
 
 def _has_unknown_symbols(step: ParsedStep, variable: str, substitutions: dict[str, Expr]) -> bool:
-    known = {sympify(variable), *[sympify(k) for k in substitutions.keys()]}
+    known = {_symbol(variable), *[_symbol(k) for k in substitutions.keys()]}
     if step.eq is not None:
         if not hasattr(step.eq, "lhs") or not hasattr(step.eq, "rhs"):
             return False
@@ -146,7 +517,7 @@ def _has_unknown_symbols(step: ParsedStep, variable: str, substitutions: dict[st
     return any(symbol not in known for symbol in symbols)
 
 
-def classify_error(previous: ParsedStep, current: ParsedStep) -> str:
+def classify_error(previous: ParsedStep | ArithmeticStep, current: ParsedStep | ArithmeticStep) -> str:
     if previous.parse_error or current.parse_error:
         return "parse_error"
     if previous.is_equation and current.is_equation:
@@ -171,13 +542,58 @@ def classify_error(previous: ParsedStep, current: ParsedStep) -> str:
     return "not_equivalent"
 
 
+def timeout_validation(previous: ParsedStep, current: ParsedStep) -> StepValidationPayload:
+    return StepValidationPayload(
+        from_step=previous.raw,
+        to_step=current.raw,
+        from_normalized=previous.normalized,
+        to_normalized=current.normalized,
+        equivalent=False,
+        validation_status="undetermined",
+        equivalence_mode="solution_set" if previous.is_equation and current.is_equation else "algebraic",
+        reason=TIMEOUT_REASON,
+    )
+
+
+def parse_step_within(raw: str, deadline: Deadline | None) -> ParsedStep:
+    if deadline is None:
+        return parse_step(raw)
+    try:
+        with deadline.step():
+            return parse_step(raw)
+    except ComputeTimeout:
+        normalized = normalize_text(raw)
+        return ParsedStep(raw, normalized, "=" in normalized, None, None, TIMEOUT_REASON)
+
+
 def compare_steps(
     previous: ParsedStep,
     current: ParsedStep,
     variable: str,
     substitutions: dict[str, Expr] | None = None,
+    memo: SolutionSetMemo | None = None,
+    deadline: Deadline | None = None,
+) -> StepValidationPayload:
+    if TIMEOUT_REASON in (previous.parse_error, current.parse_error):
+        return timeout_validation(previous, current)
+    if deadline is None:
+        return _compare_steps(previous, current, variable, substitutions, memo)
+    try:
+        with deadline.step():
+            return _compare_steps(previous, current, variable, substitutions, memo)
+    except ComputeTimeout:
+        return timeout_validation(previous, current)
+
+
+def _compare_steps(
+    previous: ParsedStep,
+    current: ParsedStep,
+    variable: str,
+    substitutions: dict[str, Expr] | None,
+    memo: SolutionSetMemo | None,
 ) -> StepValidationPayload:
     effective_subs = substitutions or {}
+    solver = memo or SolutionSetMemo()
     prev = apply_substitutions(previous, effective_subs)
     curr = apply_substitutions(current, effective_subs)
 
@@ -211,8 +627,8 @@ def compare_steps(
 
     if prev.is_equation and curr.is_equation and prev.eq is not None and curr.eq is not None:
         mode: EquivalenceMode = "solution_set"
-        prev_set = _solution_set(prev.eq, variable)
-        curr_set = _solution_set(curr.eq, variable)
+        prev_set = solver.solve(prev, variable, effective_subs)
+        curr_set = solver.solve(curr, variable, effective_subs)
         if prev_set is None or curr_set is None:
             return StepValidationPayload(
                 from_step=prev.raw,
@@ -240,7 +656,7 @@ def compare_steps(
                 current_solution_set=_set_to_string(curr_set),
             )
 
-        equivalent = bool(simplify(prev_set.symmetric_difference(curr_set)) == S.EmptySet)
+        equivalent = _sets_equivalent(prev_set, curr_set)
         return StepValidationPayload(
             from_step=prev.raw,
             to_step=curr.raw,
@@ -268,7 +684,7 @@ def compare_steps(
         )
 
     try:
-        equivalent = bool(simplify(prev.expr - curr.expr) == 0)
+        equivalent = expressions_equivalent(prev.expr, curr.expr)
     except Exception:
         return StepValidationPayload(
             from_step=prev.raw,
@@ -292,6 +708,129 @@ def compare_steps(
     )
 
 
+# Larger powers are left to SymPy rather than expanded here.
+_MAX_EXACT_EXPONENT = 64
+_ALL_REALS = str(S.Reals)
+_NO_SOLUTION = str(S.EmptySet)
+
+
+class _FractionParser(_FastParser):
+    __slots__ = ()
+
+    def number(self, value: str) -> Fraction:
+        # parse_expr turns decimals into binary Floats, which exact arithmetic would not reproduce.
+        if "." in value:
+            raise _OutsideGrammar(value)
+        return Fraction(int(value))
+
+    def symbol(self, value: str) -> Fraction:
+        raise _OutsideGrammar(value)
+
+    def power(self, base: Fraction, exponent: Fraction) -> Fraction:
+        if exponent.denominator != 1 or abs(exponent.numerator) > _MAX_EXACT_EXPONENT:
+            raise _OutsideGrammar()
+        return base**exponent.numerator
+
+
+@dataclass(frozen=True)
+class ArithmeticStep:
+    raw: str
+    normalized: str
+    is_equation: bool
+    value: Fraction | None
+    sides: tuple[Fraction, Fraction] | None
+    parse_error: str | None = None
+
+
+def _exact_value(text: str) -> Fraction | None:
+    try:
+        return _FractionParser(_fast_tokens(text)).parse()
+    except (_OutsideGrammar, ZeroDivisionError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _parse_arithmetic_normalized(normalized: str) -> ArithmeticStep | None:
+    if not normalized or normalized.count("=") > 1:
+        return None
+    if "=" not in normalized:
+        value = _exact_value(normalized)
+        return None if value is None else ArithmeticStep(normalized, normalized, False, value, None)
+    lhs_raw, rhs_raw = normalized.split("=")
+    lhs = _exact_value(lhs_raw)
+    rhs = None if lhs is None else _exact_value(rhs_raw)
+    if lhs is None or rhs is None:
+        return None
+    return ArithmeticStep(normalized, normalized, True, None, (lhs, rhs))
+
+
+def parse_arithmetic(raw: str) -> ArithmeticStep | None:
+    # Constant-only lines built from integers, + - * / ^, parentheses and implicit multiplication.
+    # Anything else (variables, decimals, division by zero, syntax errors) returns None so the
+    # caller can use parse_step instead.
+    step = _parse_arithmetic_normalized(normalize_text(raw))
+    return step if step is None or step.raw == raw else replace(step, raw=raw)
+
+
+def coerce_arithmetic_step(previous: ArithmeticStep, current: ArithmeticStep) -> ArithmeticStep:
+    if previous.value is None or current.sides is None:
+        return current
+    lhs, rhs = current.sides
+    if previous.value == lhs:
+        chosen = rhs
+    elif previous.value == rhs:
+        chosen = lhs
+    else:
+        return current
+    return ArithmeticStep(current.raw, str(chosen), False, chosen, None)
+
+
+def _constant_solution_set(sides: tuple[Fraction, Fraction]) -> str:
+    return _ALL_REALS if sides[0] == sides[1] else _NO_SOLUTION
+
+
+def compare_arithmetic(previous: ArithmeticStep, current: ArithmeticStep) -> StepValidationPayload:
+    # Mirrors compare_steps for constant-only steps, so both engines report identical payloads.
+    if previous.sides is not None and current.sides is not None:
+        prev_set = _constant_solution_set(previous.sides)
+        curr_set = _constant_solution_set(current.sides)
+        equivalent = prev_set == curr_set
+        return StepValidationPayload(
+            from_step=previous.raw,
+            to_step=current.raw,
+            from_normalized=previous.normalized,
+            to_normalized=current.normalized,
+            equivalent=equivalent,
+            validation_status="valid" if equivalent else "invalid",
+            equivalence_mode="solution_set",
+            reason="equivalent_solution_set" if equivalent else "not_equivalent_solution_set",
+            previous_solution_set=prev_set,
+            current_solution_set=curr_set,
+        )
+    if previous.value is None or current.value is None:
+        return StepValidationPayload(
+            from_step=previous.raw,
+            to_step=current.raw,
+            from_normalized=previous.normalized,
+            to_normalized=current.normalized,
+            equivalent=False,
+            validation_status="invalid",
+            equivalence_mode="algebraic",
+            reason="mixed_or_invalid_step_type",
+        )
+    equivalent = previous.value == current.value
+    return StepValidationPayload(
+        from_step=previous.raw,
+        to_step=current.raw,
+        from_normalized=previous.normalized,
+        to_normalized=current.normalized,
+        equivalent=equivalent,
+        validation_status="valid" if equivalent else "invalid",
+        equivalence_mode="algebraic",
+        reason="equivalent_expression" if equivalent else "not_equivalent_expression",
+    )
+
+
 def build_candidate_lines(
     ocr_lines: list[str],
     ocr_candidates: list[OcrLineCandidatesPayload] | None,
@@ -325,48 +864,155 @@ def build_candidate_lines(
     return result
 
 
+# A later line that the previous line's roots do not satisfy costs about one OCR rank.
+_INCONSISTENT_PENALTY = 6
+
+
+@lru_cache(maxsize=4096)
+def _rational_roots(normalized: str, variable: str) -> tuple[Expr, ...] | None:
+    step = parse_step(normalized)
+    if step.eq is None:
+        return None
+    try:
+        roots = _polynomial_solution_set(step.eq, _symbol(variable))
+    except Exception:
+        return None
+    if not isinstance(roots, FiniteSet) or not all(root.is_rational for root in roots):
+        return None
+    return tuple(roots)
+
+
+@lru_cache(maxsize=16384)
+def _line_consistency(previous: str, current: str, variable: str) -> bool | None:
+    roots = _rational_roots(previous, variable)
+    step = parse_step(current)
+    if roots is None or step.eq is None:
+        return None
+    symbol = _symbol(variable)
+    residual = step.eq.lhs - step.eq.rhs
+    if not residual.free_symbols <= {symbol}:
+        return None
+    try:
+        return all(residual.subs(symbol, root) == 0 for root in roots)
+    except Exception:
+        return None
+
+
+_S_TOKEN = re.compile(r"[sS]")
+_S_RESULT = re.compile(r"=\s*[sS]\b")
+_AMBIGUOUS_MESSAGE = "Hay ambiguedad OCR en al menos una linea."
+
+
+class _BeamNode:
+    __slots__ = ("parent", "option", "score", "line_idx", "ambiguous")
+
+    def __init__(
+        self,
+        parent: _BeamNode | None,
+        option: str,
+        score: int,
+        line_idx: int,
+        ambiguous: bool,
+    ) -> None:
+        self.parent = parent
+        self.option = option
+        self.score = score
+        self.line_idx = line_idx
+        self.ambiguous = ambiguous
+
+
+def _line_options(options: list[str], check_parse: bool = False) -> list[tuple[str, int, bool]]:
+    ranked = list(enumerate(dict.fromkeys(options)))
+    ambiguous = len(ranked) > 1
+    if check_parse:
+        # Variants that do not parse would only be penalised after a full evaluation; drop them
+        # up front unless nothing on the line parses. Survivors keep their OCR rank, so a line whose
+        # primary reading was dropped is still flagged as ambiguous.
+        parseable = [(rank, option) for rank, option in ranked if parse_step(option).parse_error is None]
+        if parseable:
+            ranked = parseable
+    prepared: list[tuple[str, int, bool]] = []
+    for rank, option in ranked:
+        delta = 10 - rank * 3
+        if _S_TOKEN.search(option) and _S_RESULT.search(option):
+            delta -= 3
+        if not normalize_text(option):
+            delta -= 5
+        prepared.append((option, delta, ambiguous and rank > 0))
+    return prepared
+
+
+def _materialize(node: _BeamNode) -> SequenceCandidate:
+    lines: list[str] = []
+    ambiguous_lines: list[int] = []
+    current: _BeamNode | None = node
+    while current is not None:
+        lines.append(current.option)
+        if current.ambiguous:
+            ambiguous_lines.append(current.line_idx)
+        current = current.parent
+    lines.reverse()
+    ambiguous_lines.reverse()
+    return SequenceCandidate(
+        lines=lines,
+        score=node.score,
+        warning_type="ocr_ambiguous" if ambiguous_lines else None,
+        warning_message=_AMBIGUOUS_MESSAGE if ambiguous_lines else None,
+        ambiguous_lines=ambiguous_lines,
+    )
+
+
+def _transition_penalties(
+    beams: list[_BeamNode | None],
+    prepared: list[tuple[str, int, bool]],
+    prompt: str,
+    variable: str,
+) -> list[list[int]]:
+    normalized = [normalize_text(option) for option, _, _ in prepared]
+    penalties: list[list[int]] = []
+    for beam in beams:
+        previous = normalize_text(prompt if beam is None else beam.option)
+        penalties.append(
+            [_INCONSISTENT_PENALTY if _line_consistency(previous, text, variable) is False else 0 for text in normalized]
+        )
+    return penalties
+
+
 def choose_candidate_sequences(
     ocr_lines: list[str],
     ocr_candidates: list[OcrLineCandidatesPayload] | None,
     beam_width: int = 5,
     top_k: int = 3,
+    prompt: str | None = None,
+    variable: str = "x",
 ) -> list[SequenceCandidate]:
     candidate_lines = build_candidate_lines(ocr_lines, ocr_candidates, top_k=top_k)
     if not candidate_lines:
         return []
-    beams: list[SequenceCandidate] = [
-        SequenceCandidate(lines=[], score=0, warning_type=None, warning_message=None, ambiguous_lines=[])
-    ]
-
+    # Parse and consistency signals need the prompt; without it only rank heuristics apply.
+    check_steps = prompt is not None
+    consistency_prompt = prompt if prompt is not None and "=" in prompt else None
+    beams: list[_BeamNode | None] = [None]
+    scores = [0]
     for line_idx, options in enumerate(candidate_lines, start=1):
-        next_beams: list[SequenceCandidate] = []
-        unique_options = list(dict.fromkeys(options))
-        ambiguous = len(unique_options) > 1
-        for beam in beams:
-            for rank, option in enumerate(unique_options):
-                score = beam.score + (10 - rank * 3)
-                warning_type = beam.warning_type
-                warning_message = beam.warning_message
-                ambiguous_lines = list(beam.ambiguous_lines)
-                norm = normalize_text(option)
-                if re.search(r"[sS]", option) and re.search(r"=\s*[sS]\b", option):
-                    score -= 3
-                if ambiguous and rank > 0:
-                    ambiguous_lines.append(line_idx)
-                    if warning_type is None:
-                        warning_type = "ocr_ambiguous"
-                        warning_message = "Hay ambiguedad OCR en al menos una linea."
-                if not norm:
-                    score -= 5
-                next_beams.append(
-                    SequenceCandidate(
-                        lines=[*beam.lines, option],
-                        score=score,
-                        warning_type=warning_type,
-                        warning_message=warning_message,
-                        ambiguous_lines=ambiguous_lines,
-                    )
-                )
-        next_beams.sort(key=lambda b: b.score, reverse=True)
-        beams = next_beams[:beam_width]
-    return beams
+        prepared = _line_options(options, check_parse=check_steps and len(options) > 1)
+        if consistency_prompt is not None and len(prepared) > 1:
+            penalties = _transition_penalties(beams, prepared, consistency_prompt, variable)
+        else:
+            penalties = [[0] * len(prepared) for _ in beams]
+        # nlargest keeps expansion order on ties, exactly like a stable descending sort.
+        survivors = heapq.nlargest(
+            beam_width,
+            (
+                (scores[beam_pos] + delta - penalties[beam_pos][option_pos], beam_pos, option_pos)
+                for beam_pos in range(len(beams))
+                for option_pos, (_, delta, _) in enumerate(prepared)
+            ),
+            key=itemgetter(0),
+        )
+        beams = [
+            _BeamNode(beams[beam_pos], prepared[option_pos][0], score, line_idx, prepared[option_pos][2])
+            for score, beam_pos, option_pos in survivors
+        ]
+        scores = [score for score, _, _ in survivors]
+    return [_materialize(node) for node in beams if node is not None]
@@ -1,18 +1,31 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import os
-import urllib.error
-import urllib.request
+import threading
 from dataclasses import dataclass
 from typing import Any
+from urllib.parse import urlsplit
 
 from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
 
+from .feedback_cache import FeedbackCache
+from .http_pool import HttpConnectionPool
 from .schemas import PedagogicalOutput
 
-_GROQ_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
+_GROQ_ENDPOINT = os.getenv("MATHFIGHT_GROQ_ENDPOINT", "https://api.groq.com/openai/v1/chat/completions")
 _GROQ_MODEL = "llama-3.1-8b-instant"
+# Matches the prompt_versions row; bump both when the prompt changes so cached feedback is not reused.
+PROMPT_VERSION = "v1-linear-feedback"
+_GROQ_POOL_SIZE = int(os.getenv("MATHFIGHT_GROQ_POOL_SIZE", "8"))
+_GROQ_CONNECT_TIMEOUT_S = float(os.getenv("MATHFIGHT_GROQ_CONNECT_TIMEOUT_S", "3"))
+_GROQ_READ_TIMEOUT_S = float(os.getenv("MATHFIGHT_GROQ_READ_TIMEOUT_S", "12"))
+
+_transport: HttpConnectionPool | None = None
+_transport_path = urlsplit(_GROQ_ENDPOINT).path or "/"
+_transport_lock = threading.Lock()
 
 
 @dataclass(frozen=True)
@@ -31,7 +44,7 @@ class FeedbackInput:
     warning_message: str | None
 
 
-def _fallback(input_data: FeedbackInput) -> PedagogicalOutput:
+def fallback_feedback(input_data: FeedbackInput) -> PedagogicalOutput:
     if input_data.decision == "correct":
         return PedagogicalOutput(
             short_feedback="Resultado y proceso correctos.",
@@ -142,6 +155,60 @@ def _build_messages(input_data: FeedbackInput) -> list[dict[str, str]]:
     ]
 
 
+def _build_transport(
+    endpoint: str,
+    pool_size: int | None = None,
+    connect_timeout: float | None = None,
+    read_timeout: float | None = None,
+) -> HttpConnectionPool:
+    return HttpConnectionPool(
+        endpoint,
+        max_idle=_GROQ_POOL_SIZE if pool_size is None else pool_size,
+        connect_timeout=_GROQ_CONNECT_TIMEOUT_S if connect_timeout is None else connect_timeout,
+        read_timeout=_GROQ_READ_TIMEOUT_S if read_timeout is None else read_timeout,
+    )
+
+
+def configure_feedback_transport(
+    endpoint: str | None = None,
+    pool_size: int | None = None,
+    connect_timeout: float | None = None,
+    read_timeout: float | None = None,
+) -> HttpConnectionPool:
+    global _transport, _transport_path
+    url = endpoint or _GROQ_ENDPOINT
+    pool = _build_transport(url, pool_size, connect_timeout, read_timeout)
+    with _transport_lock:
+        previous, _transport = _transport, pool
+        _transport_path = urlsplit(url).path or "/"
+    if previous is not None:
+        previous.close()
+    return pool
+
+
+def _get_transport() -> tuple[HttpConnectionPool, str]:
+    global _transport, _transport_path
+    with _transport_lock:
+        if _transport is None:
+            _transport = _build_transport(_GROQ_ENDPOINT)
+            _transport_path = urlsplit(_GROQ_ENDPOINT).path or "/"
+        return _transport, _transport_path
+
+
+def close_feedback_transport() -> None:
+    global _transport
+    with _transport_lock:
+        pool, _transport = _transport, None
+    if pool is not None:
+        pool.close()
+
+
+def feedback_transport_stats() -> dict[str, float | int]:
+    with _transport_lock:
+        pool = _transport
+    return {} if pool is None else pool.stats()
+
+
 def _call_groq(messages: list[dict[str, str]], api_key: str) -> str:
     payload = {
         "model": _GROQ_MODEL,
@@ -149,18 +216,17 @@ def _call_groq(messages: list[dict[str, str]], api_key: str) -> str:
         "response_format": {"type": "json_object"},
         "messages": messages,
     }
-    req = urllib.request.Request(
-        _GROQ_ENDPOINT,
-        data=json.dumps(payload).encode("utf-8"),
+    pool, path = _get_transport()
+    response = pool.request(
+        "POST",
+        path,
+        body=json.dumps(payload).encode("utf-8"),
         headers={
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         },
-        method="POST",
     )
-    with urllib.request.urlopen(req, timeout=12) as response:
-        body = response.read().decode("utf-8")
-    decoded = json.loads(body)
+    decoded = json.loads(response.body.decode("utf-8"))
     return (
         decoded.get("choices", [{}])[0]
         .get("message", {})
@@ -171,16 +237,33 @@ def _call_groq(messages: list[dict[str, str]], api_key: str) -> str:
     )
 
 
-def generate_pedagogical_feedback(input_data: FeedbackInput) -> PedagogicalOutput:
-    api_key = os.getenv("GROQ_API_KEY", "").strip()
-    if not api_key:
-        return _fallback(input_data)
+def feedback_cache_key(input_data: FeedbackInput) -> str:
+    # step_validations only repeat the normalized steps with raw OCR spelling, so they stay out of the key.
+    canonical = {
+        "prompt_version": PROMPT_VERSION,
+        "model": _GROQ_MODEL,
+        "decision": input_data.decision,
+        "error_type": input_data.error_type,
+        "warning_type": input_data.warning_type,
+        "warning_message": input_data.warning_message,
+        "expected_final": input_data.expected_final,
+        "normalized_steps": input_data.normalized_steps,
+        "wrong_lines": input_data.wrong_lines,
+        "warning_lines": input_data.warning_lines,
+        "final_result_correct": input_data.final_result_correct,
+        "process_valid": input_data.process_valid,
+        "locale": input_data.locale,
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
 
+def _generate_with_llm(input_data: FeedbackInput, api_key: str) -> PedagogicalOutput | None:
     messages = _build_messages(input_data)
     try:
         raw = _call_groq(messages, api_key)
         return PedagogicalOutput.model_validate(json.loads(raw))
-    except (urllib.error.URLError, TimeoutError, json.JSONDecodeError, ValidationError, KeyError):
+    except (OSError, json.JSONDecodeError, ValidationError, KeyError):
         pass
 
     repair_messages = messages + [
@@ -194,6 +277,50 @@ def generate_pedagogical_feedback(input_data: FeedbackInput) -> PedagogicalOutpu
     try:
         raw = _call_groq(repair_messages, api_key)
         return PedagogicalOutput.model_validate(json.loads(raw))
-    except (urllib.error.URLError, TimeoutError, json.JSONDecodeError, ValidationError, KeyError):
-        return _fallback(input_data)
+    except (OSError, json.JSONDecodeError, ValidationError, KeyError):
+        return None
+
+
+def _api_key() -> str:
+    return os.getenv("GROQ_API_KEY", "").strip()
+
+
+def llm_feedback_enabled() -> bool:
+    return bool(_api_key())
+
+
+def cached_pedagogical_feedback(input_data: FeedbackInput, cache: FeedbackCache | None) -> PedagogicalOutput | None:
+    if cache is None or not cache.enabled:
+        return None
+    return cache.get(feedback_cache_key(input_data))
+
+
+def generate_pedagogical_feedback(
+    input_data: FeedbackInput,
+    cache: FeedbackCache | None = None,
+) -> PedagogicalOutput:
+    api_key = _api_key()
+    if not api_key:
+        return fallback_feedback(input_data)
+
+    active_cache = cache if cache is not None and cache.enabled else None
+    key = feedback_cache_key(input_data)
+    if active_cache is not None:
+        cached = active_cache.get(key)
+        if cached is not None:
+            return cached
+
+    output = _generate_with_llm(input_data, api_key)
+    if output is None:
+        # Fallback text is cheap to rebuild and must not shadow a later LLM answer.
+        return fallback_feedback(input_data)
+    if active_cache is not None:
+        active_cache.put(key, PROMPT_VERSION, output)
+    return output
+
 
+async def generate_pedagogical_feedback_async(
+    input_data: FeedbackInput,
+    cache: FeedbackCache | None = None,
+) -> PedagogicalOutput:
+    return await run_in_threadpool(generate_pedagogical_feedback, input_data, cache)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any, Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class OcrCandidatePayload(BaseModel):
@@ -17,13 +17,23 @@ class OcrLineCandidatesPayload(BaseModel):
 
 
 class ValidateSolutionRequest(BaseModel):
-    equation_prompt: str
-    expected_final: str
+    exercise_id: str | None = None
+    equation_prompt: str = ""
+    expected_final: str = ""
     context_hint: str | None = None
     ocr_lines: list[str] = Field(default_factory=list)
     ocr_candidates: list[OcrLineCandidatesPayload] | None = None
     variable: str = "x"
     locale: str = "es"
+    feedback_mode: Literal["inline", "deferred"] | None = None
+    beam_width: int | None = Field(default=None, ge=1, le=64)
+    top_k: int | None = Field(default=None, ge=1, le=10)
+
+    @model_validator(mode="after")
+    def _require_exercise(self) -> ValidateSolutionRequest:
+        if self.exercise_id is None and not (self.equation_prompt and self.expected_final):
+            raise ValueError("either exercise_id or both equation_prompt and expected_final are required")
+        return self
 
 
 class StepValidationPayload(BaseModel):
@@ -59,10 +69,36 @@ class ValidateSolutionResponse(BaseModel):
     step_validations: list[StepValidationPayload] = Field(default_factory=list)
     pedagogical_feedback: str = ""
     suggested_correction_steps: list[str] = Field(default_factory=list)
+    feedback_id: str | None = None
     debug: dict[str, Any] = Field(default_factory=dict)
 
 
+class ValidateSolutionsRequest(BaseModel):
+    items: list[ValidateSolutionRequest] = Field(min_length=1, max_length=200)
+
+
+class ValidateSolutionsResponse(BaseModel):
+    results: list[ValidateSolutionResponse] = Field(default_factory=list)
+
+
 class PedagogicalOutput(BaseModel):
     short_feedback: str
     correction_steps: list[str] = Field(default_factory=list)
     tone: Literal["confirmatory_warning", "corrective", "unreadable_help"] = "corrective"
+
+
+class FeedbackStatusResponse(BaseModel):
+    feedback_id: str
+    status: Literal["pending", "ready"]
+    feedback: PedagogicalOutput | None = None
+
+
+class SessionLineRequest(BaseModel):
+    text: str
+    candidates: list[OcrCandidatePayload] | None = None
+
+
+class SessionResponse(BaseModel):
+    session_id: str
+    lines: list[str] = Field(default_factory=list)
+    result: ValidateSolutionResponse
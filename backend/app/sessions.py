@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, cast
+
+from .prompting import fallback_feedback
+from .schemas import OcrCandidatePayload, OcrLineCandidatesPayload, ValidateSolutionRequest, ValidateSolutionResponse
+
+if TYPE_CHECKING:
+    from .grading import GradingResult
+
+_TTL_SECONDS = float(os.getenv("MATHFIGHT_SESSION_TTL_S", "900"))
+_MAX_SESSIONS = int(os.getenv("MATHFIGHT_SESSION_MAX", "10000"))
+
+
+class UnknownSessionError(KeyError):
+    pass
+
+
+class InvalidLineError(ValueError):
+    pass
+
+
+class ValidationSession:
+    def __init__(self, session_id: str, template: ValidateSolutionRequest, exercise_id: str | None) -> None:
+        from .grading import CandidateTrie, seed_memo
+        from .math_engine import SolutionSetMemo
+
+        self.session_id = session_id
+        self.template = template.model_copy(update={"ocr_lines": [], "ocr_candidates": None})
+        self.exercise_id = exercise_id
+        self.lines: list[str] = list(template.ocr_lines)
+        self.candidates: list[list[OcrCandidatePayload] | None] = [None] * len(self.lines)
+        for line in template.ocr_candidates or []:
+            if 1 <= line.lineIndex <= len(self.lines):
+                self.candidates[line.lineIndex - 1] = line.candidates
+        # Solution sets and checked transitions survive between updates; only new suffixes are validated.
+        self.memo = SolutionSetMemo()
+        self.trie = CandidateTrie(self.template)
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.result: ValidateSolutionResponse | None = None
+        seed_memo(self.template, self.memo)
+
+    def _payload(self) -> ValidateSolutionRequest:
+        ocr_candidates = [
+            OcrLineCandidatesPayload(lineIndex=index, candidates=options)
+            for index, options in enumerate(self.candidates, start=1)
+            if options
+        ]
+        return self.template.model_copy(
+            update={"ocr_lines": list(self.lines), "ocr_candidates": ocr_candidates or None}
+        )
+
+    def _grade(self) -> ValidateSolutionResponse:
+        from .grading import build_feedback_input, build_response, build_unreadable_response, decide, grade_submission
+
+        payload = self._payload()
+        if not any(line.strip() for line in self.lines):
+            return build_unreadable_response("parse_error", max(1, len(self.lines)))
+        grading: GradingResult = grade_submission(payload, self.memo, trie=self.trie)
+        if grading.best_eval is None:
+            return build_unreadable_response("parse_error", grading.final_result_line)
+        self.trie.retain([cast(list[str], item["lines"]) for item in grading.candidate_scores])
+        verdict = decide(grading)
+        # Live updates use the rule-based text; LLM feedback belongs to the final submission.
+        feedback = fallback_feedback(build_feedback_input(payload, grading, verdict))
+        return build_response(payload, grading, verdict, feedback, exercise_id=self.exercise_id)
+
+    def current(self) -> ValidateSolutionResponse:
+        with self.lock:
+            if self.result is None:
+                self.result = self._grade()
+            return self.result
+
+    def set_line(
+        self,
+        line_number: int,
+        text: str,
+        candidates: list[OcrCandidatePayload] | None = None,
+    ) -> ValidateSolutionResponse:
+        with self.lock:
+            if line_number < 1 or line_number > len(self.lines) + 1:
+                raise InvalidLineError(f"line {line_number} is out of range 1..{len(self.lines) + 1}")
+            if line_number == len(self.lines) + 1:
+                self.lines.append(text)
+                self.candidates.append(candidates)
+            else:
+                self.lines[line_number - 1] = text
+                self.candidates[line_number - 1] = candidates
+            self.result = self._grade()
+            return self.result
+
+    def truncate(self, line_number: int) -> ValidateSolutionResponse:
+        with self.lock:
+            if line_number < 1 or line_number > len(self.lines):
+                raise InvalidLineError(f"line {line_number} is out of range 1..{len(self.lines)}")
+            del self.lines[line_number - 1 :]
+            del self.candidates[line_number - 1 :]
+            self.result = self._grade()
+            return self.result
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds: float | None = None, max_sessions: int | None = None) -> None:
+        self._ttl = _TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._max = max(1, _MAX_SESSIONS if max_sessions is None else max_sessions)
+        self._sessions: OrderedDict[str, ValidationSession] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "expired": 0, "evicted": 0, "deleted": 0}
+
+    def _purge(self, now: float) -> None:
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen < self._ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._stats["expired"] += 1
+
+    def create(self, template: ValidateSolutionRequest, exercise_id: str | None = None) -> ValidationSession:
+        session = ValidationSession(uuid.uuid4().hex, template, exercise_id)
+        with self._lock:
+            self._purge(session.last_seen)
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self._max:
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+            self._stats["created"] += 1
+        return session
+
+    def get(self, session_id: str) -> ValidationSession:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise UnknownSessionError(session_id)
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if self._sessions.pop(session_id, None) is None:
+                raise UnknownSessionError(session_id)
+            self._stats["deleted"] += 1
+
+    def stats(self) -> dict[str, float | int]:
+        with self._lock:
+            self._purge(time.monotonic())
+            return {**self._stats, "active": len(self._sessions), "ttl_seconds": self._ttl}
@@ -1,96 +1,397 @@
 from __future__ import annotations
 
+import argparse
 import json
+import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
+import weakref
+import zlib
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Literal, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PersistenceMode = Literal["sync", "background"]
+DiagnosticsLayout = Literal["rows", "blob"]
 
 
 @dataclass(frozen=True)
 class DbConfig:
     path: str
+    persistence_mode: PersistenceMode = "sync"
+    write_queue_size: int = 1000
+    write_batch_size: int = 50
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    cache_size: int = -8000
+    mmap_size: int = 0
+    busy_retries: int = 3
+    diagnostics_layout: DiagnosticsLayout = "rows"
 
 
-def _utc_now() -> str:
+def utc_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
 def load_db_config() -> DbConfig:
     default_path = str(Path(__file__).resolve().parent.parent / "mathfight.db")
-    return DbConfig(path=os.getenv("MATHFIGHT_DB_PATH", default_path))
+    mode = os.getenv("MATHFIGHT_PERSISTENCE_MODE", "sync").strip().lower()
+    layout = os.getenv("MATHFIGHT_DIAGNOSTICS_LAYOUT", "rows").strip().lower()
+    return DbConfig(
+        path=os.getenv("MATHFIGHT_DB_PATH", default_path),
+        persistence_mode="background" if mode == "background" else "sync",
+        write_queue_size=int(os.getenv("MATHFIGHT_WRITE_QUEUE_SIZE", "1000")),
+        write_batch_size=int(os.getenv("MATHFIGHT_WRITE_BATCH_SIZE", "50")),
+        journal_mode=os.getenv("MATHFIGHT_SQLITE_JOURNAL_MODE", "WAL"),
+        synchronous=os.getenv("MATHFIGHT_SQLITE_SYNCHRONOUS", "NORMAL"),
+        busy_timeout_ms=int(os.getenv("MATHFIGHT_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        cache_size=int(os.getenv("MATHFIGHT_SQLITE_CACHE_SIZE", "-8000")),
+        mmap_size=int(os.getenv("MATHFIGHT_SQLITE_MMAP_SIZE", "0")),
+        busy_retries=int(os.getenv("MATHFIGHT_SQLITE_BUSY_RETRIES", "3")),
+        diagnostics_layout="blob" if layout == "blob" else "rows",
+    )
+
+
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def _apply_pragmas(conn: sqlite3.Connection, config: DbConfig) -> None:
+    journal_mode = config.journal_mode.upper()
+    synchronous = config.synchronous.upper()
+    if journal_mode not in _JOURNAL_MODES:
+        raise ValueError(f"unsupported journal_mode: {config.journal_mode}")
+    if synchronous not in _SYNCHRONOUS_LEVELS:
+        raise ValueError(f"unsupported synchronous level: {config.synchronous}")
+    conn.execute(f"PRAGMA busy_timeout = {int(config.busy_timeout_ms)}")
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = {int(config.cache_size)}")
+    conn.execute(f"PRAGMA mmap_size = {int(config.mmap_size)}")
 
 
 def get_connection(config: DbConfig) -> sqlite3.Connection:
-    conn = sqlite3.connect(config.path)
+    conn = sqlite3.connect(config.path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn, config)
     return conn
 
 
-def init_db(config: DbConfig) -> None:
+def _is_busy(exc: sqlite3.OperationalError) -> bool:
+    message = str(exc).lower()
+    return "locked" in message or "busy" in message
+
+
+class _ThreadConnections:
+    # Held only by one thread's local storage; its finalizer closes the connections when the thread exits.
+    def __init__(self) -> None:
+        self.by_path: dict[str, sqlite3.Connection] = {}
+
+
+class ConnectionManager:
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open: set[sqlite3.Connection] = set()
+        self._opened = 0
+        self._acquired = 0
+        self._transactions = 0
+        self._busy_retries = 0
+        self._busy_failures = 0
+        self._lock_wait_ms = 0.0
+        self._max_lock_wait_ms = 0.0
+
+    def acquire(self, config: DbConfig) -> sqlite3.Connection:
+        holder: _ThreadConnections | None = getattr(self._local, "connections", None)
+        if holder is None:
+            holder = _ThreadConnections()
+            weakref.finalize(holder, self._close_thread, holder.by_path)
+            self._local.connections = holder
+        conn = holder.by_path.get(config.path)
+        if conn is None:
+            conn = get_connection(config)
+            conn.isolation_level = None
+            holder.by_path[config.path] = conn
+            with self._lock:
+                self._open.add(conn)
+                self._opened += 1
+        with self._lock:
+            self._acquired += 1
+        return conn
+
+    def run_in_transaction(self, config: DbConfig, work: Callable[[sqlite3.Connection], T]) -> T:
+        conn = self.acquire(config)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as exc:
+                self._record_wait(started)
+                if not _is_busy(exc) or attempt >= config.busy_retries:
+                    with self._lock:
+                        self._busy_failures += 1
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._busy_retries += 1
+                time.sleep(min(0.05 * 2**attempt, 1.0))
+                continue
+            self._record_wait(started)
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            with self._lock:
+                self._transactions += 1
+            return result
+
+    def _record_wait(self, started: float) -> None:
+        waited = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._lock_wait_ms += waited
+            self._max_lock_wait_ms = max(self._max_lock_wait_ms, waited)
+
+    def _close_thread(self, connections: dict[str, sqlite3.Connection]) -> None:
+        with self._lock:
+            for conn in connections.values():
+                self._open.discard(conn)
+        for conn in connections.values():
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._open)
+            self._open.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stats(self) -> dict[str, float | int]:
+        with self._lock:
+            return {
+                "open": len(self._open),
+                "opened": self._opened,
+                "acquired": self._acquired,
+                "reused": self._acquired - self._opened,
+                "transactions": self._transactions,
+                "busy_retries": self._busy_retries,
+                "busy_failures": self._busy_failures,
+                "lock_wait_ms": round(self._lock_wait_ms, 3),
+                "max_lock_wait_ms": round(self._max_lock_wait_ms, 3),
+            }
+
+
+_connections = ConnectionManager()
+
+
+def run_in_transaction(config: DbConfig, work: Callable[[sqlite3.Connection], T]) -> T:
+    return _connections.run_in_transaction(config, work)
+
+
+def close_connections() -> None:
+    _connections.close_all()
+
+
+def connection_stats() -> dict[str, float | int]:
+    return _connections.stats()
+
+
+_migrated_paths: set[str] = set()
+
+_BASELINE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS rule_memory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        topic TEXT NOT NULL,
+        rule_key TEXT NOT NULL UNIQUE,
+        formal_rule TEXT NOT NULL,
+        informal_equivalence TEXT NOT NULL,
+        examples_json TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS error_catalog (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        error_type TEXT NOT NULL UNIQUE,
+        description TEXT NOT NULL,
+        detection_hint TEXT NOT NULL,
+        feedback_template TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prompt_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        system_prompt TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS validation_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        equation_prompt TEXT NOT NULL,
+        expected_final TEXT NOT NULL,
+        ocr_lines_json TEXT NOT NULL,
+        decision TEXT NOT NULL,
+        error_type TEXT,
+        warning_type TEXT,
+        wrong_lines_json TEXT NOT NULL,
+        warning_lines_json TEXT NOT NULL DEFAULT '[]',
+        final_result_correct INTEGER NOT NULL DEFAULT 0,
+        process_valid INTEGER NOT NULL DEFAULT 0,
+        latency_ms INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS step_diagnostics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id INTEGER NOT NULL,
+        step_index INTEGER NOT NULL,
+        from_step TEXT NOT NULL,
+        to_step TEXT NOT NULL,
+        equivalent INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(run_id) REFERENCES validation_runs(id)
+    )
+    """,
+)
+
+
+def _baseline_schema(conn: sqlite3.Connection) -> None:
+    for statement in _BASELINE_TABLES:
+        conn.execute(statement)
+    _migrate(conn)
+    _seed(conn)
+
+
+def _step_validations_blob(conn: sqlite3.Connection) -> None:
+    _ensure_column(conn, "validation_runs", "step_validations_blob", "BLOB")
+
+
+def _validation_runs_cache_hit(conn: sqlite3.Connection) -> None:
+    _ensure_column(conn, "validation_runs", "cache_hit", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _validation_runs_timed_out(conn: sqlite3.Connection) -> None:
+    _ensure_column(conn, "validation_runs", "timed_out", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _feedback_cache(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feedback_cache (
+            cache_key TEXT PRIMARY KEY,
+            prompt_version TEXT NOT NULL,
+            output_json TEXT NOT NULL,
+            expires_at REAL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_cache_created_at ON feedback_cache(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_cache_expires_at ON feedback_cache(expires_at)")
+
+
+def _run_feedback(conn: sqlite3.Connection) -> None:
+    _ensure_column(conn, "validation_runs", "feedback_id", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_validation_runs_feedback_id ON validation_runs(feedback_id)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS run_feedback (
+            feedback_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            output_json TEXT,
+            created_at TEXT NOT NULL,
+            completed_at TEXT
+        )
+        """
+    )
+
+
+# Append-only: each entry runs exactly once per database, in order.
+_MIGRATIONS: list[tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _baseline_schema),
+    (2, _step_validations_blob),
+    (3, _validation_runs_cache_hit),
+    (4, _validation_runs_timed_out),
+    (5, _feedback_cache),
+    (6, _run_feedback),
+]
+
+
+def current_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return int(row["version"] or 0)
+
+
+def migrate(config: DbConfig) -> int:
     Path(config.path).parent.mkdir(parents=True, exist_ok=True)
-    with get_connection(config) as conn:
-        conn.executescript(
+    conn = get_connection(config)
+    conn.isolation_level = None
+    try:
+        conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS rule_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                topic TEXT NOT NULL,
-                rule_key TEXT NOT NULL UNIQUE,
-                formal_rule TEXT NOT NULL,
-                informal_equivalence TEXT NOT NULL,
-                examples_json TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS error_catalog (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                error_type TEXT NOT NULL UNIQUE,
-                description TEXT NOT NULL,
-                detection_hint TEXT NOT NULL,
-                feedback_template TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS prompt_versions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                system_prompt TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS validation_runs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                equation_prompt TEXT NOT NULL,
-                expected_final TEXT NOT NULL,
-                ocr_lines_json TEXT NOT NULL,
-                decision TEXT NOT NULL,
-                error_type TEXT,
-                warning_type TEXT,
-                wrong_lines_json TEXT NOT NULL,
-                warning_lines_json TEXT NOT NULL DEFAULT '[]',
-                final_result_correct INTEGER NOT NULL DEFAULT 0,
-                process_valid INTEGER NOT NULL DEFAULT 0,
-                latency_ms INTEGER NOT NULL,
-                created_at TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS step_diagnostics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                run_id INTEGER NOT NULL,
-                step_index INTEGER NOT NULL,
-                from_step TEXT NOT NULL,
-                to_step TEXT NOT NULL,
-                equivalent INTEGER NOT NULL,
-                reason TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY(run_id) REFERENCES validation_runs(id)
-            );
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at TEXT NOT NULL
+            )
             """
         )
-        _migrate(conn)
-        _seed(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_schema_version(conn)
+            for target, step in _MIGRATIONS:
+                if target <= version:
+                    continue
+                step(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                    (target, utc_now()),
+                )
+                version = target
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _migrated_paths.add(config.path)
+    return version
+
+
+def schema_ready(config: DbConfig) -> bool:
+    return config.path in _migrated_paths
+
+
+def ensure_schema(config: DbConfig) -> None:
+    if not schema_ready(config):
+        migrate(config)
+
+
+def init_db(config: DbConfig) -> None:
+    migrate(config)
 
 
 def _migrate(conn: sqlite3.Connection) -> None:
@@ -113,7 +414,6 @@ def _migrate(conn: sqlite3.Connection) -> None:
         "process_valid",
         "INTEGER NOT NULL DEFAULT 0",
     )
-    conn.commit()
 
 
 def _ensure_column(conn: sqlite3.Connection, table: str, column: str, definition: str) -> None:
@@ -125,7 +425,7 @@ def _ensure_column(conn: sqlite3.Connection, table: str, column: str, definition
 
 
 def _seed(conn: sqlite3.Connection) -> None:
-    now = _utc_now()
+    now = utc_now()
     rule_rows = [
         (
             "ecuaciones_lineales",
@@ -195,7 +495,216 @@ def _seed(conn: sqlite3.Connection) -> None:
             now,
         ),
     )
-    conn.commit()
+
+
+@dataclass(frozen=True)
+class ValidationRunRecord:
+    equation_prompt: str
+    expected_final: str
+    ocr_lines: list[str]
+    decision: str
+    error_type: str | None
+    warning_type: str | None
+    wrong_lines: list[int]
+    warning_lines: list[int]
+    final_result_correct: bool
+    process_valid: bool
+    latency_ms: int
+    step_validations: list[dict[str, Any]]
+    created_at: str
+    cache_hit: bool = False
+    timed_out: bool = False
+    feedback_id: str | None = None
+
+
+def encode_step_validations(step_validations: list[dict[str, Any]]) -> bytes:
+    return zlib.compress(json.dumps(step_validations, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_step_validations(blob: bytes) -> list[dict[str, Any]]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _write_runs(
+    conn: sqlite3.Connection,
+    records: list[ValidationRunRecord],
+    layout: DiagnosticsLayout = "rows",
+) -> None:
+    diagnostics: list[tuple[Any, ...]] = []
+    for record in records:
+        blob = encode_step_validations(record.step_validations) if layout == "blob" else None
+        cursor = conn.execute(
+            """
+            INSERT INTO validation_runs
+                (
+                    equation_prompt, expected_final, ocr_lines_json, decision, error_type, warning_type,
+                    wrong_lines_json, warning_lines_json, final_result_correct, process_valid, latency_ms, created_at,
+                    step_validations_blob, cache_hit, timed_out, feedback_id
+                )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                record.equation_prompt,
+                record.expected_final,
+                json.dumps(record.ocr_lines),
+                record.decision,
+                record.error_type,
+                record.warning_type,
+                json.dumps(record.wrong_lines),
+                json.dumps(record.warning_lines),
+                1 if record.final_result_correct else 0,
+                1 if record.process_valid else 0,
+                record.latency_ms,
+                record.created_at,
+                blob,
+                1 if record.cache_hit else 0,
+                1 if record.timed_out else 0,
+                record.feedback_id,
+            ),
+        )
+        if blob is not None:
+            continue
+        run_id = cursor.lastrowid
+        diagnostics.extend(
+            (
+                run_id,
+                i,
+                item.get("from_step", ""),
+                item.get("to_step", ""),
+                1 if item.get("equivalent") else 0,
+                item.get("reason", ""),
+                record.created_at,
+            )
+            for i, item in enumerate(record.step_validations)
+        )
+    if diagnostics:
+        conn.executemany(
+            """
+            INSERT INTO step_diagnostics
+                (run_id, step_index, from_step, to_step, equivalent, reason, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            diagnostics,
+        )
+
+
+_STOP = object()
+
+
+class ValidationRunWriter:
+    def __init__(self, config: DbConfig) -> None:
+        self._config = config
+        self._queue: queue.Queue[object] = queue.Queue(maxsize=max(1, config.write_queue_size))
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name="validation-run-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: ValidationRunRecord) -> bool:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def close(self, timeout: float = 10.0) -> None:
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "capacity": self._queue.maxsize,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "batches": self._batches,
+            }
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self._config.write_batch_size:
+                try:
+                    extra = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if extra is _STOP:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(extra)
+            self._write_batch(batch)  # type: ignore[arg-type]
+            if stop:
+                return
+
+    def _write_batch(self, batch: list[ValidationRunRecord]) -> None:
+        try:
+            run_in_transaction(
+                self._config,
+                lambda conn: _write_runs(conn, batch, self._config.diagnostics_layout),
+            )
+        except Exception:
+            logger.exception("Failed to persist %d validation runs", len(batch))
+            with self._lock:
+                self._failed += len(batch)
+        else:
+            with self._lock:
+                self._written += len(batch)
+                self._batches += 1
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+_writers: dict[str, ValidationRunWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def _writer_for(config: DbConfig) -> ValidationRunWriter:
+    with _writers_lock:
+        writer = _writers.get(config.path)
+        if writer is None:
+            writer = ValidationRunWriter(config)
+            _writers[config.path] = writer
+        return writer
+
+
+def shutdown_writers() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+    close_connections()
+
+
+def persistence_stats(config: DbConfig) -> dict[str, object]:
+    stats: dict[str, object] = {"mode": config.persistence_mode}
+    writer = _writers.get(config.path)
+    if writer is not None:
+        stats.update(writer.stats())
+    return stats
 
 
 def save_validation_run(
@@ -213,48 +722,157 @@ def save_validation_run(
     process_valid: bool,
     latency_ms: int,
     step_validations: list[dict[str, Any]],
+    cache_hit: bool = False,
 ) -> None:
-    with get_connection(config) as conn:
-        cursor = conn.execute(
+    record = ValidationRunRecord(
+        equation_prompt=equation_prompt,
+        expected_final=expected_final,
+        ocr_lines=ocr_lines,
+        decision=decision,
+        error_type=error_type,
+        warning_type=warning_type,
+        wrong_lines=wrong_lines,
+        warning_lines=warning_lines,
+        final_result_correct=final_result_correct,
+        process_valid=process_valid,
+        latency_ms=latency_ms,
+        step_validations=step_validations,
+        created_at=utc_now(),
+        cache_hit=cache_hit,
+    )
+    save_validation_runs(config, [record])
+
+
+def save_validation_runs(config: DbConfig, records: list[ValidationRunRecord]) -> None:
+    if config.persistence_mode == "background":
+        writer = _writer_for(config)
+        for record in records:
+            writer.submit(record)
+        return
+    run_in_transaction(config, lambda conn: _write_runs(conn, records, config.diagnostics_layout))
+
+
+def load_step_validations(config: DbConfig, run_id: int) -> list[dict[str, Any]]:
+    conn = _connections.acquire(config)
+    row = conn.execute(
+        "SELECT step_validations_blob FROM validation_runs WHERE id = ?",
+        (run_id,),
+    ).fetchone()
+    if row is None:
+        return []
+    if row["step_validations_blob"] is not None:
+        return decode_step_validations(row["step_validations_blob"])
+    rows = conn.execute(
+        """
+        SELECT from_step, to_step, equivalent, reason
+        FROM step_diagnostics
+        WHERE run_id = ?
+        ORDER BY step_index
+        """,
+        (run_id,),
+    ).fetchall()
+    return [
+        {
+            "from_step": item["from_step"],
+            "to_step": item["to_step"],
+            "equivalent": bool(item["equivalent"]),
+            "reason": item["reason"],
+        }
+        for item in rows
+    ]
+
+
+def load_cached_feedback(config: DbConfig, cache_key: str, now: float) -> tuple[str, float | None] | None:
+    conn = _connections.acquire(config)
+    row = conn.execute(
+        "SELECT output_json, expires_at FROM feedback_cache WHERE cache_key = ?",
+        (cache_key,),
+    ).fetchone()
+    if row is None or (row["expires_at"] is not None and row["expires_at"] <= now):
+        return None
+    return row["output_json"], row["expires_at"]
+
+
+def store_cached_feedback(
+    config: DbConfig,
+    cache_key: str,
+    prompt_version: str,
+    output_json: str,
+    expires_at: float | None,
+    max_rows: int,
+    now: float,
+) -> None:
+    def write(conn: sqlite3.Connection) -> None:
+        conn.execute(
             """
-            INSERT INTO validation_runs
-                (
-                    equation_prompt, expected_final, ocr_lines_json, decision, error_type, warning_type,
-                    wrong_lines_json, warning_lines_json, final_result_correct, process_valid, latency_ms, created_at
-                )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT OR REPLACE INTO feedback_cache (cache_key, prompt_version, output_json, expires_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
             """,
-            (
-                equation_prompt,
-                expected_final,
-                json.dumps(ocr_lines),
-                decision,
-                error_type,
-                warning_type,
-                json.dumps(wrong_lines),
-                json.dumps(warning_lines),
-                1 if final_result_correct else 0,
-                1 if process_valid else 0,
-                latency_ms,
-                _utc_now(),
-            ),
+            (cache_key, prompt_version, output_json, expires_at, utc_now()),
         )
-        run_id = cursor.lastrowid
-        for i, item in enumerate(step_validations):
-            conn.execute(
-                """
-                INSERT INTO step_diagnostics
-                    (run_id, step_index, from_step, to_step, equivalent, reason, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    run_id,
-                    i,
-                    item.get("from_step", ""),
-                    item.get("to_step", ""),
-                    1 if item.get("equivalent") else 0,
-                    item.get("reason", ""),
-                    _utc_now(),
-                ),
+        conn.execute("DELETE FROM feedback_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        conn.execute(
+            """
+            DELETE FROM feedback_cache WHERE cache_key IN (
+                SELECT cache_key FROM feedback_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
             )
-        conn.commit()
+            """,
+            (max_rows,),
+        )
+
+    run_in_transaction(config, write)
+
+
+def save_run_feedback(config: DbConfig, feedback_id: str, status: str, output_json: str | None) -> None:
+    now = utc_now()
+    run_in_transaction(
+        config,
+        lambda conn: conn.execute(
+            """
+            INSERT INTO run_feedback (feedback_id, status, output_json, created_at, completed_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(feedback_id) DO UPDATE SET
+                status = excluded.status,
+                output_json = excluded.output_json,
+                completed_at = excluded.completed_at
+            """,
+            (feedback_id, status, output_json, now, None if output_json is None else now),
+        ),
+    )
+
+
+def load_run_feedback(config: DbConfig, feedback_id: str) -> tuple[str, str | None] | None:
+    conn = _connections.acquire(config)
+    row = conn.execute(
+        "SELECT status, output_json FROM run_feedback WHERE feedback_id = ?",
+        (feedback_id,),
+    ).fetchone()
+    return None if row is None else (row["status"], row["output_json"])
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.storage")
+    parser.add_argument("command", choices=["migrate", "version"])
+    parser.add_argument("--db", help="database path (defaults to MATHFIGHT_DB_PATH)")
+    args = parser.parse_args(argv)
+    config = DbConfig(path=args.db) if args.db else load_db_config()
+    if args.command == "migrate":
+        version = migrate(config)
+        print(f"{config.path}: schema version {version}")
+        return
+    if not Path(config.path).exists():
+        print(f"{config.path}: schema version 0")
+        return
+    conn = get_connection(config)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        ).fetchone()
+        version = current_schema_version(conn) if exists else 0
+    finally:
+        conn.close()
+    print(f"{config.path}: schema version {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import importlib
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Literal
+
+from .prompting import fallback_feedback
+from .schemas import ValidateSolutionRequest
+from .workers import start_pool
+
+if TYPE_CHECKING:
+    from .exercises import AnswerKey, ExerciseBank
+
+WarmupStatus = Literal["pending", "warming", "ready", "failed"]
+
+_raw_exercises = os.getenv("MATHFIGHT_WARMUP_EXERCISES")
+_EXERCISES: list[str] | None = (
+    None if _raw_exercises is None else [item.strip() for item in _raw_exercises.split(",") if item.strip()]
+)
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _default_keys(bank: ExerciseBank) -> list[AnswerKey]:
+    # One exercise per bank, so the SymPy and exact-arithmetic paths have both run once.
+    first: dict[str, AnswerKey] = {}
+    for key in bank.keys():
+        first.setdefault(key.bank, key)
+    return list(first.values())
+
+
+class Warmup:
+    def __init__(self, exercises: list[str] | None = None) -> None:
+        self._exercises = _EXERCISES if exercises is None else exercises
+        self._created = time.perf_counter()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._status: WarmupStatus = "pending"
+        self._report: dict[str, object] = {}
+
+    @property
+    def status(self) -> WarmupStatus:
+        return self._status
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def _update(self, status: WarmupStatus | None = None, **values: object) -> None:
+        with self._lock:
+            self._report.update(values)
+            if status is not None:
+                self._status = status
+
+    def _grade(self, key: AnswerKey) -> None:
+        from .grading import build_feedback_input, build_response, decide, grade_submission
+
+        payload = ValidateSolutionRequest(
+            exercise_id=key.qualified_id,
+            equation_prompt=key.prompt,
+            expected_final=key.expected_final,
+            context_hint=key.context_hint,
+            ocr_lines=[key.prompt, key.expected_final],
+            variable=key.variable,
+        )
+        grading = grade_submission(payload)
+        if grading.best_eval is None:
+            return
+        verdict = decide(grading)
+        feedback = fallback_feedback(build_feedback_input(payload, grading, verdict))
+        build_response(payload, grading, verdict, feedback, exercise_id=key.qualified_id)
+
+    def run(self) -> None:
+        started = time.perf_counter()
+        self._update(status="warming")
+        try:
+            step = time.perf_counter()
+            # The grading modules pull in SymPy; this is the import cost kept off app startup.
+            importlib.import_module(".grading", __package__)
+            from .exercises import get_exercise_bank
+
+            self._update(engine_import_ms=_elapsed_ms(step))
+            step = time.perf_counter()
+            bank = get_exercise_bank()
+            self._update(bank_load_ms=_elapsed_ms(step), exercises=len(bank))
+            step = time.perf_counter()
+            start_pool()
+            self._update(pool_start_ms=_elapsed_ms(step))
+
+            step = time.perf_counter()
+            graded = 0
+            failed: list[str] = []
+            keys: list[AnswerKey] = []
+            if self._exercises is None:
+                keys = _default_keys(bank)
+            else:
+                for exercise_id in self._exercises:
+                    try:
+                        keys.append(bank.get(exercise_id))
+                    except KeyError:
+                        failed.append(exercise_id)
+            for key in keys:
+                try:
+                    self._grade(key)
+                    graded += 1
+                except Exception:
+                    failed.append(key.qualified_id)
+            self._update(grading_ms=_elapsed_ms(step), graded=graded, failed=failed)
+        except Exception as exc:
+            self._update(status="failed", error=f"{type(exc).__name__}: {exc}", warmup_ms=_elapsed_ms(started))
+            return
+        self._update(
+            status="ready",
+            warmup_ms=_elapsed_ms(started),
+            ready_after_ms=_elapsed_ms(self._created),
+        )
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float | None = None) -> None:
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def report(self) -> dict[str, object]:
+        with self._lock:
+            return {"status": self._status, **self._report}
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING, Literal
+
+from starlette.concurrency import run_in_threadpool
+
+from .schemas import ValidateSolutionRequest
+
+if TYPE_CHECKING:
+    from .grading import GradingResult
+
+ExecutionMode = Literal["inline", "process"]
+
+_EXECUTION_MODE: ExecutionMode = (
+    "process" if os.getenv("MATHFIGHT_EXECUTION_MODE", "inline").strip().lower() == "process" else "inline"
+)
+_WORKERS = int(os.getenv("MATHFIGHT_GRADING_WORKERS", str(os.cpu_count() or 1)))
+_MAX_TASKS_PER_WORKER = int(os.getenv("MATHFIGHT_WORKER_MAX_TASKS", "1000"))
+_MAX_PENDING = int(os.getenv("MATHFIGHT_WORKER_QUEUE_LIMIT", str(max(1, _WORKERS) * 8)))
+_START_METHOD = os.getenv("MATHFIGHT_WORKER_START_METHOD", "spawn")
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(max(1, _MAX_PENDING))
+_stats_lock = threading.Lock()
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "in_flight": 0}
+
+
+class GradingQueueFull(RuntimeError):
+    pass
+
+
+def _warm_worker() -> None:
+    # Imports SymPy and fills its internal caches before the first real task arrives.
+    from .grading import grade_submission
+
+    grade_submission(
+        ValidateSolutionRequest(equation_prompt="2x+5=17", expected_final="x=6", ocr_lines=["2x=12", "x=6"])
+    )
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if _WORKERS <= 1 and _EXECUTION_MODE == "inline":
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, _WORKERS),
+                mp_context=multiprocessing.get_context(_START_METHOD),
+                initializer=_warm_worker,
+                # Recycling is not supported by the fork start method.
+                max_tasks_per_child=(
+                    _MAX_TASKS_PER_WORKER if _MAX_TASKS_PER_WORKER > 0 and _START_METHOD != "fork" else None
+                ),
+            )
+        return _pool
+
+
+def start_pool() -> None:
+    if _EXECUTION_MODE != "process":
+        return
+    pool = _get_pool()
+    if pool is None:
+        return
+    # Submitting one no-op per worker forces every process to spawn and run its warm-up now.
+    for future in [pool.submit(os.getpid) for _ in range(max(1, _WORKERS))]:
+        future.result()
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def pool_stats() -> dict[str, object]:
+    with _stats_lock:
+        stats: dict[str, object] = dict(_stats)
+    stats.update(
+        {
+            "mode": _EXECUTION_MODE,
+            "workers": _WORKERS,
+            "max_pending": _MAX_PENDING,
+            "max_tasks_per_worker": _MAX_TASKS_PER_WORKER,
+            "started": _pool is not None,
+        }
+    )
+    return stats
+
+
+def _count(key: str, delta: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += delta
+
+
+@contextmanager
+def grading_slot() -> Iterator[None]:
+    # Admission control for process mode; inline grading is bounded by the server thread pool.
+    if _EXECUTION_MODE == "inline":
+        yield
+        return
+    if not _pending.acquire(blocking=False):
+        _count("rejected")
+        raise GradingQueueFull("grading queue is full")
+    _count("submitted")
+    _count("in_flight")
+    try:
+        yield
+    except BaseException:
+        _count("failed")
+        raise
+    else:
+        _count("completed")
+    finally:
+        _count("in_flight", -1)
+        _pending.release()
+
+
+async def run_grading(payload: ValidateSolutionRequest) -> GradingResult:
+    from .grading import grade_submission
+
+    pool = _get_pool() if _EXECUTION_MODE == "process" else None
+    if pool is None:
+        return await run_in_threadpool(grade_submission, payload)
+    with grading_slot():
+        return await asyncio.wrap_future(pool.submit(grade_submission, payload))
+
+
+def _group_key(payload: ValidateSolutionRequest) -> tuple[str, str, str, str]:
+    return (
+        payload.equation_prompt,
+        payload.expected_final,
+        payload.context_hint or "",
+        payload.variable,
+    )
+
+
+def grade_many(payloads: list[ValidateSolutionRequest]) -> list[GradingResult]:
+    from .grading import grade_group
+
+    groups: dict[tuple[str, str, str, str], list[int]] = {}
+    for index, payload in enumerate(payloads):
+        groups.setdefault(_group_key(payload), []).append(index)
+
+    results: list[GradingResult | None] = [None] * len(payloads)
+    pool = _get_pool() if len(groups) > 1 and _WORKERS > 1 else None
+    if pool is None:
+        for indices in groups.values():
+            graded = grade_group([payloads[i] for i in indices])
+            for index, item in zip(indices, graded):
+                results[index] = item
+    else:
+        with ExitStack() as slots:
+            # One queue slot per group, taken up front so a batch is admitted or rejected as a whole.
+            for _ in groups:
+                slots.enter_context(grading_slot())
+            futures: list[tuple[list[int], Future[list[GradingResult]]]] = [
+                (indices, pool.submit(grade_group, [payloads[i] for i in indices])) for indices in groups.values()
+            ]
+            for indices, future in futures:
+                for index, item in zip(indices, future.result()):
+                    results[index] = item
+    missing = [index for index, item in enumerate(results) if item is None]
+    if missing:
+        raise RuntimeError(f"grading returned no result for items {missing}")
+    return [item for item in results if item is not None]
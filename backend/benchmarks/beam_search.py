@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.math_engine import choose_candidate_sequences
+from app.schemas import OcrCandidatePayload, OcrLineCandidatesPayload
+
+
+def _workload(line_count: int, options: int, rng: random.Random) -> tuple[list[str], list[OcrLineCandidatesPayload]]:
+    lines = [f"{rng.randint(1, 9)}x={rng.randint(1, 99)}" for _ in range(line_count)]
+    candidates = [
+        OcrLineCandidatesPayload(
+            lineIndex=index,
+            candidates=[OcrCandidatePayload(text=f"{line[:-1]}{k}") for k in range(options)],
+        )
+        for index, line in enumerate(lines, start=1)
+    ]
+    return lines, candidates
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Time choose_candidate_sequences against OCR line count.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[5, 10, 20, 40, 80])
+    parser.add_argument("--beam-width", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    print(f"{'lines':>6} {'beam':>5} {'top_k':>5} {'us/call':>10} {'us/line':>9}")
+    for beam_width in args.beam_width:
+        for line_count in args.lines:
+            lines, candidates = _workload(line_count, args.top_k, rng)
+            timer = timeit.Timer(
+                lambda: choose_candidate_sequences(lines, candidates, beam_width=beam_width, top_k=args.top_k)
+            )
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=args.repeat, number=number)) / number * 1e6
+            print(f"{line_count:>6} {beam_width:>5} {args.top_k:>5} {best:>10.1f} {best / line_count:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
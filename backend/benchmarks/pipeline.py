@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+_BACKEND = Path(__file__).resolve().parents[1]
+_ASSETS = _BACKEND.parent / "assets"
+_STAGES = ["parse_step", "choose_candidate_sequences", "compare_steps", "evaluate_sequence", "validate_solution"]
+# Typical handwriting misreads; every noisy line also carries the clean reading as an OCR candidate.
+_OCR_CONFUSIONS = {"1": "l", "2": "z", "5": "s", "0": "o"}
+
+
+@dataclass(frozen=True)
+class Submission:
+    kind: str
+    payload: dict[str, object]
+
+
+def _load_exercises() -> list[dict[str, str]]:
+    exercises: list[dict[str, str]] = []
+    for path in [_ASSETS / "seed_exercises.json", *sorted((_ASSETS / "elementary").glob("*.json"))]:
+        for item in json.loads(path.read_text(encoding="utf-8"))["exercises"]:
+            exercises.append(item)
+    return exercises
+
+
+def _bump_last_number(text: str) -> str:
+    match = None
+    for match in re.finditer(r"\d+", text):
+        pass
+    if match is None:
+        return text + "+1"
+    return f"{text[: match.start()]}{int(match.group()) + 1}{text[match.end() :]}"
+
+
+def _correct_lines(prompt: str, expected: str) -> list[str]:
+    if "=" in prompt:
+        lhs, rhs = prompt.split("=", 1)
+        return [f"2({lhs.strip()})=2({rhs.strip()})", prompt, expected]
+    return [f"{prompt}={expected}", expected]
+
+
+def _wrong_lines(prompt: str, expected: str) -> list[str]:
+    lines = _correct_lines(prompt, expected)
+    return [*lines[:-1], _bump_last_number(expected)]
+
+
+def _noisy(text: str, rng: random.Random) -> str:
+    positions = [index for index, char in enumerate(text) if char in _OCR_CONFUSIONS]
+    if not positions:
+        return text
+    index = rng.choice(positions)
+    return text[:index] + _OCR_CONFUSIONS[text[index]] + text[index + 1 :]
+
+
+def _submission(
+    item: dict[str, str],
+    lines: list[str],
+    kind: str,
+    candidates: list[dict[str, object]] | None,
+) -> Submission:
+    payload: dict[str, object] = {
+        "equation_prompt": item["prompt"],
+        "expected_final": item["expected_final"],
+        "context_hint": item.get("context_hint"),
+        "ocr_lines": lines,
+    }
+    if candidates:
+        payload["ocr_candidates"] = candidates
+    return Submission(kind, payload)
+
+
+def build_corpus(seed: int = 0) -> list[Submission]:
+    rng = random.Random(seed)
+    corpus: list[Submission] = []
+    for item in _load_exercises():
+        prompt, expected = item["prompt"], item["expected_final"]
+        correct = _correct_lines(prompt, expected)
+        corpus.append(_submission(item, correct, "correct", None))
+        corpus.append(_submission(item, _wrong_lines(prompt, expected), "wrong", None))
+        noisy_lines: list[str] = []
+        candidates: list[dict[str, object]] = []
+        for line_index, line in enumerate(correct, start=1):
+            noisy = _noisy(line, rng)
+            noisy_lines.append(noisy)
+            if noisy != line:
+                options = [noisy, line, _bump_last_number(line)]
+                candidates.append({"lineIndex": line_index, "candidates": [{"text": text} for text in options]})
+        corpus.append(_submission(item, noisy_lines, "ocr_noisy", candidates))
+    return corpus
+
+
+def _summary(samples_ns: list[int], failures: int) -> dict[str, object]:
+    if not samples_ns:
+        return {"samples": 0, "failures": failures}
+    micros = [value / 1000 for value in samples_ns]
+    cuts = statistics.quantiles(micros, n=100, method="inclusive") if len(micros) > 1 else [micros[0]] * 99
+    total_s = sum(samples_ns) / 1e9
+    return {
+        "samples": len(micros),
+        "failures": failures,
+        "mean_us": round(statistics.fmean(micros), 2),
+        "p50_us": round(cuts[49], 2),
+        "p95_us": round(cuts[94], 2),
+        "p99_us": round(cuts[98], 2),
+        "max_us": round(max(micros), 2),
+        "throughput_per_s": round(len(micros) / total_s, 1) if total_s else None,
+    }
+
+
+def _time_calls(
+    calls: list[Callable[[], object]],
+    repeat: int,
+    before: Callable[[], None] | None = None,
+) -> dict[str, object]:
+    # One untimed pass fills imports and SymPy's own caches; only the following passes are recorded.
+    samples: list[int] = []
+    failures = 0
+    for round_index in range(repeat + 1):
+        for call in calls:
+            if before is not None:
+                before()
+            started = time.perf_counter_ns()
+            try:
+                call()
+            except Exception:
+                failures += round_index > 0
+                continue
+            elapsed = time.perf_counter_ns() - started
+            if round_index > 0:
+                samples.append(elapsed)
+    return _summary(samples, failures)
+
+
+def run(corpus: list[Submission], repeat: int, stages: list[str]) -> dict[str, dict[str, object]]:
+    from fastapi.testclient import TestClient
+
+    from app.grading import _evaluate_sequence
+    from app.main import app
+    from app.math_engine import (
+        SequenceCandidate,
+        SolutionSetMemo,
+        choose_candidate_sequences,
+        clear_parse_cache,
+        compare_steps,
+        parse_context_substitutions,
+        parse_step,
+    )
+    from app.schemas import ValidateSolutionRequest
+
+    requests = [ValidateSolutionRequest.model_validate(item.payload) for item in corpus]
+    results: dict[str, dict[str, object]] = {}
+
+    if "parse_step" in stages:
+        texts = sorted(
+            {
+                text
+                for request in requests
+                for text in [
+                    request.equation_prompt,
+                    request.expected_final,
+                    *request.ocr_lines,
+                    *[option.text for line in request.ocr_candidates or [] for option in line.candidates],
+                ]
+            }
+        )
+        # The parse cache is cleared before every call so each sample is a real parse.
+        results["parse_step"] = _time_calls(
+            [lambda text=text: parse_step(text) for text in texts],
+            repeat,
+            clear_parse_cache,
+        )
+
+    def choose(request: ValidateSolutionRequest) -> list[SequenceCandidate]:
+        return choose_candidate_sequences(
+            request.ocr_lines,
+            request.ocr_candidates,
+            prompt=request.equation_prompt,
+            variable=request.variable,
+        )
+
+    if "choose_candidate_sequences" in stages:
+        results["choose_candidate_sequences"] = _time_calls(
+            [lambda request=request: choose(request) for request in requests], repeat
+        )
+
+    if "compare_steps" in stages:
+        pairs = []
+        for request in requests:
+            steps = [parse_step(request.equation_prompt), *[parse_step(line) for line in request.ocr_lines]]
+            substitutions = parse_context_substitutions(request.context_hint)
+            pairs.extend((a, b, request.variable, substitutions) for a, b in zip(steps, steps[1:]))
+        results["compare_steps"] = _time_calls(
+            [
+                lambda a=a, b=b, variable=variable, subs=subs: compare_steps(a, b, variable, subs, SolutionSetMemo())
+                for a, b, variable, subs in pairs
+            ],
+            repeat,
+        )
+
+    if "evaluate_sequence" in stages:
+        chosen = [(request, choose(request)[0]) for request in requests]
+        results["evaluate_sequence"] = _time_calls(
+            [
+                lambda request=request, candidate=candidate: _evaluate_sequence(request, candidate, SolutionSetMemo())
+                for request, candidate in chosen
+            ],
+            repeat,
+        )
+
+    if "validate_solution" in stages:
+        client = TestClient(app)
+
+        def post(payload: dict[str, object]) -> None:
+            response = client.post("/v1/validate-solution", json=payload)
+            response.raise_for_status()
+
+        results["validate_solution"] = _time_calls(
+            [lambda payload=item.payload: post(payload) for item in corpus], repeat
+        )
+    return results
+
+
+def _commit() -> str:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_BACKEND,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return completed.stdout.strip() or "unknown"
+
+
+def _print_table(stages: dict[str, dict[str, object]], baseline: dict[str, dict[str, object]] | None) -> None:
+    header = f"{'stage':<28} {'n':>6} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'ops/s':>10}"
+    print(header + (f" {'p50 vs base':>12}" if baseline else ""))
+    for name, stats in stages.items():
+        if not stats.get("samples"):
+            print(f"{name:<28} {'-':>6}")
+            continue
+        row = (
+            f"{name:<28} {stats['samples']:>6} {stats['p50_us']:>10} {stats['p95_us']:>10} "
+            f"{stats['p99_us']:>10} {stats['throughput_per_s']:>10}"
+        )
+        previous = (baseline or {}).get(name, {})
+        if previous.get("p50_us"):
+            row += f" {stats['p50_us'] / previous['p50_us']:>11.2f}x"
+        print(row)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Time the grading pipeline stage by stage over an exercise corpus.")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the corpus per stage")
+    parser.add_argument("--stages", nargs="+", choices=_STAGES, default=_STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="JSON result file (default: benchmarks/results/pipeline-<commit>.json)",
+    )
+    parser.add_argument("--compare", type=Path, help="earlier JSON result to compare p50 against")
+    args = parser.parse_args(argv)
+
+    commit = _commit()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep benchmark runs out of the development database.
+        os.environ.setdefault("MATHFIGHT_DB_PATH", str(Path(tmp) / "bench.db"))
+        corpus = build_corpus(args.seed)
+        stages = run(corpus, max(1, args.repeat), args.stages)
+
+    kinds = {kind: sum(1 for item in corpus if item.kind == kind) for kind in ("correct", "wrong", "ocr_noisy")}
+    result = {
+        "meta": {
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sympy": metadata.version("sympy"),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "repeat": max(1, args.repeat),
+            "seed": args.seed,
+            "corpus": {"submissions": len(corpus), **kinds},
+        },
+        "stages": stages,
+    }
+    output = args.output or _BACKEND / "benchmarks" / "results" / f"pipeline-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+
+    baseline = None
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["stages"]
+    _print_table(stages, baseline)
+    print(f"wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
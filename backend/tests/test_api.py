@@ -1,12 +1,24 @@
+import json
+import os
+import threading
 import unittest
+from dataclasses import replace
 from pathlib import Path
+from unittest import mock
 import sys
 
 from fastapi.testclient import TestClient
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
+from app import main as main_module
+from app import workers
+from app.cache import LruCache
+from app.feedback_cache import FeedbackCache
+from app.feedback_jobs import FeedbackJobs
+from app.grading import GradingResult, grade_submission
 from app.main import app
+from app.storage import ensure_schema, run_in_transaction
 
 
 class ApiTest(unittest.TestCase):
@@ -93,6 +105,22 @@ class ApiTest(unittest.TestCase):
         if data["decision"] == "correct_with_warnings":
             self.assertTrue(len(data["warning_lines"]) >= 1)
 
+    def test_unparseable_primary_reading_keeps_ocr_warning(self) -> None:
+        response = self.client.post(
+            "/v1/validate-solution",
+            json={
+                "equation_prompt": "2x+5=17",
+                "expected_final": "x=6",
+                "ocr_lines": ["2x==12", "x=6"],
+                "ocr_candidates": [{"lineIndex": 1, "candidates": [{"text": "2x==12"}, {"text": "2x=12"}]}],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["decision"], "correct_with_warnings")
+        self.assertEqual(data["warning_type"], "ocr_ambiguous")
+        self.assertEqual(data["warning_lines"], [1])
+
     def test_expression_prompt_accepts_equation_line(self) -> None:
         response = self.client.post(
             "/v1/validate-solution",
@@ -145,6 +173,342 @@ class ApiTest(unittest.TestCase):
         self.assertEqual(data["decision"], "correct")
         self.assertTrue(data["final_result_correct"])
 
+    def test_migrated_schema_is_not_rechecked_off_the_event_loop(self) -> None:
+        ensure_schema(main_module.db_config)
+        with mock.patch.object(main_module, "ensure_schema") as ensure:
+            response = self.client.post(
+                "/v1/validate-solution",
+                json={"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]},
+            )
+        self.assertEqual(response.status_code, 200)
+        ensure.assert_not_called()
+
+    def test_response_cache_hit_and_bypass(self) -> None:
+        body = {
+            "equation_prompt": "3x-4=11",
+            "expected_final": "x=5",
+            "ocr_lines": ["3x=15", "x=5"],
+        }
+        with mock.patch.object(main_module, "response_cache", LruCache(8, ttl_seconds=60)):
+            first = self.client.post("/v1/validate-solution", json=body).json()
+            second = self.client.post("/v1/validate-solution", json={**body, "ocr_lines": [" 3x=15", "x=5 "]}).json()
+            spaced = self.client.post("/v1/validate-solution", json={**body, "ocr_lines": ["3x = 15", "x = 5"]}).json()
+            bypassed = self.client.post(
+                "/v1/validate-solution",
+                json=body,
+                headers={"X-MathFight-Cache": "bypass"},
+            ).json()
+            stats = self.client.get("/v1/metrics").json()["response_cache"]
+        self.assertEqual(first["debug"]["response_cache"], "miss")
+        self.assertEqual(second["debug"]["response_cache"], "hit")
+        self.assertEqual(second["decision"], first["decision"])
+        self.assertEqual(spaced["debug"]["response_cache"], "miss")
+        self.assertEqual(bypassed["debug"]["response_cache"], "bypass")
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_timed_out_response_is_not_cached(self) -> None:
+        body = {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]}
+
+        def timed_out(*args: object, **kwargs: object) -> GradingResult:
+            return replace(grade_submission(*args, **kwargs), timed_out=True)
+
+        with (
+            mock.patch.object(main_module, "response_cache", LruCache(8, ttl_seconds=60)),
+            mock.patch("app.grading.grade_submission", side_effect=timed_out),
+        ):
+            first = self.client.post("/v1/validate-solution", json=body).json()
+            second = self.client.post("/v1/validate-solution", json=body).json()
+            cached = main_module.response_cache.stats().size
+        self.assertTrue(first["debug"]["timed_out"])
+        self.assertEqual(first["debug"]["response_cache"], "miss")
+        self.assertEqual(second["debug"]["response_cache"], "miss")
+        self.assertEqual(cached, 0)
+
+    def test_response_cache_keys_on_resolved_exercise_id(self) -> None:
+        literal = {"equation_prompt": "3x - 4 = 11", "expected_final": "x=5", "ocr_lines": ["3x=15", "x=5"]}
+        by_id = {"exercise_id": "seed_secondary_linear_eq_001", "ocr_lines": ["3x=15", "x=5"]}
+        with mock.patch.object(main_module, "response_cache", LruCache(8, ttl_seconds=60)):
+            first = self.client.post("/v1/validate-solution", json=literal).json()
+            second = self.client.post("/v1/validate-solution", json=by_id).json()
+            third = self.client.post("/v1/validate-solution", json=by_id).json()
+        self.assertEqual(first["debug"]["response_cache"], "miss")
+        self.assertEqual(second["debug"]["response_cache"], "miss")
+        self.assertEqual(second["debug"]["exercise_id"], "seed_exercises:seed_secondary_linear_eq_001")
+        self.assertEqual(third["debug"]["response_cache"], "hit")
+        self.assertEqual(third["debug"]["exercise_id"], "seed_exercises:seed_secondary_linear_eq_001")
+
+    def test_exercise_id_uses_precomputed_answer_key(self) -> None:
+        response = self.client.post(
+            "/v1/validate-solution",
+            json={"exercise_id": "seed_secondary_linear_eq_001", "ocr_lines": ["3x=15", "x=5"]},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["decision"], "correct")
+        self.assertEqual(data["debug"]["exercise_id"], "seed_exercises:seed_secondary_linear_eq_001")
+        self.assertGreaterEqual(data["debug"]["solution_set_memo"]["hits"], 2)
+
+    def test_exercise_id_qualified_by_bank(self) -> None:
+        response = self.client.post(
+            "/v1/validate-solution",
+            json={
+                "exercise_id": "elementary/addition_subtraction:seed_primary_add_sub_001",
+                "ocr_lines": ["4+3=7"],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["decision"], "correct")
+
+    def test_exercise_id_errors(self) -> None:
+        ambiguous = self.client.post(
+            "/v1/validate-solution",
+            json={"exercise_id": "seed_primary_add_sub_001", "ocr_lines": ["x=6"]},
+        )
+        unknown = self.client.post("/v1/validate-solution", json={"exercise_id": "nope", "ocr_lines": ["x=6"]})
+        missing = self.client.post("/v1/validate-solution", json={"ocr_lines": ["x=6"]})
+        self.assertEqual(ambiguous.status_code, 422)
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(missing.status_code, 422)
+
+    def test_batch_validation_preserves_order(self) -> None:
+        response = self.client.post(
+            "/v1/validate-solutions",
+            json={
+                "items": [
+                    {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]},
+                    {"equation_prompt": "3x-4=11", "expected_final": "x=5", "ocr_lines": ["3x=15", "x=4"]},
+                    {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=5"]},
+                    {"exercise_id": "seed_primary_fractions_001", "ocr_lines": []},
+                ]
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        decisions = [item["decision"] for item in response.json()["results"]]
+        self.assertEqual(decisions, ["correct", "incorrect", "incorrect", "unreadable"])
+
+    def test_batch_feedback_reuses_one_executor(self) -> None:
+        reply = json.dumps({"short_feedback": "Bien.", "correction_steps": [], "tone": "corrective"})
+        body = {
+            "items": [
+                {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]},
+                {"equation_prompt": "3x-4=11", "expected_final": "x=5", "ocr_lines": ["3x=15", "x=4"]},
+            ]
+        }
+        with (
+            mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}),
+            mock.patch("app.prompting._call_groq", return_value=reply),
+            mock.patch.object(main_module, "feedback_cache", FeedbackCache(None, maxsize=0)),
+            mock.patch.object(main_module, "_FEEDBACK_CONCURRENCY", 2),
+        ):
+            main_module._shutdown_batch_executor()
+            for _ in range(4):
+                self.assertEqual(self.client.post("/v1/validate-solutions", json=body).status_code, 200)
+            threads = [thread for thread in threading.enumerate() if thread.name.startswith("batch-feedback")]
+            main_module._shutdown_batch_executor()
+        self.assertGreaterEqual(len(threads), 1)
+        self.assertLessEqual(len(threads), 2)
+
+    def test_batch_validation_reports_bad_item(self) -> None:
+        response = self.client.post(
+            "/v1/validate-solutions",
+            json={"items": [{"equation_prompt": "x=1", "expected_final": "x=1"}, {"exercise_id": "nope"}]},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("items[1]", response.json()["detail"])
+
+    def test_process_mode_grades_in_a_worker_process(self) -> None:
+        with (
+            mock.patch.object(workers, "_EXECUTION_MODE", "process"),
+            mock.patch.object(workers, "_WORKERS", 1),
+        ):
+            try:
+                response = self.client.post(
+                    "/v1/validate-solution",
+                    json={"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]},
+                )
+                stats = workers.pool_stats()
+            finally:
+                workers.shutdown_pool()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["decision"], "correct")
+        self.assertTrue(stats["started"])
+        self.assertGreaterEqual(stats["completed"], 1)
+
+    def test_process_mode_rejects_when_queue_is_full(self) -> None:
+        exhausted = threading.BoundedSemaphore(1)
+        exhausted.acquire()
+        with (
+            mock.patch.object(workers, "_EXECUTION_MODE", "process"),
+            mock.patch.object(workers, "_pending", exhausted),
+        ):
+            response = self.client.post(
+                "/v1/validate-solution",
+                json={"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["x=6"]},
+            )
+            workers.shutdown_pool()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(workers.pool_stats()["rejected"], 1)
+
+    def test_pending_feedback_is_not_evicted(self) -> None:
+        release = threading.Event()
+        reply = json.dumps({"short_feedback": "Muy bien.", "correction_steps": [], "tone": "corrective"})
+
+        def slow_groq(messages: list, api_key: str) -> str:
+            release.wait(5)
+            return reply
+
+        cache = FeedbackCache(None, maxsize=0)
+        jobs = FeedbackJobs(main_module.db_config, cache, workers=1, keep=1)
+        bodies = [
+            {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", line]}
+            for line in ["x=6", "x=7", "x=8"]
+        ]
+        with (
+            mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}),
+            mock.patch("app.prompting._call_groq", side_effect=slow_groq),
+            mock.patch.object(main_module, "feedback_cache", cache),
+            mock.patch.object(main_module, "feedback_jobs", jobs),
+        ):
+            try:
+                ids = [
+                    self.client.post("/v1/validate-solution", json={**body, "feedback_mode": "deferred"}).json()[
+                        "feedback_id"
+                    ]
+                    for body in bodies
+                ]
+                statuses = [self.client.get(f"/v1/feedback/{feedback_id}").status_code for feedback_id in ids]
+            finally:
+                release.set()
+                jobs.shutdown()
+        self.assertEqual(statuses, [200, 200, 200])
+
+    def test_process_mode_batch_respects_queue_limit(self) -> None:
+        one_slot = threading.BoundedSemaphore(1)
+        body = {
+            "items": [
+                {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]},
+                {"equation_prompt": "3x-4=11", "expected_final": "x=5", "ocr_lines": ["3x=15", "x=5"]},
+            ]
+        }
+        with (
+            mock.patch.object(workers, "_EXECUTION_MODE", "process"),
+            mock.patch.object(workers, "_WORKERS", 2),
+            mock.patch.object(workers, "_pending", one_slot),
+        ):
+            try:
+                response = self.client.post("/v1/validate-solutions", json=body)
+            finally:
+                workers.shutdown_pool()
+        self.assertEqual(response.status_code, 503)
+        # The slot taken for the first group is given back when the batch is rejected.
+        self.assertTrue(one_slot.acquire(blocking=False))
+
+    def test_deferred_feedback_is_fetched_later(self) -> None:
+        release = threading.Event()
+        reply = json.dumps({"short_feedback": "Muy bien.", "correction_steps": ["Sigue asi."], "tone": "corrective"})
+
+        def slow_groq(messages: list, api_key: str) -> str:
+            release.wait(5)
+            return reply
+
+        cache = FeedbackCache(None, maxsize=0)
+        jobs = FeedbackJobs(main_module.db_config, cache)
+        body = {
+            "equation_prompt": "2x+5=17",
+            "expected_final": "x=6",
+            "ocr_lines": ["2x=12", "x=6"],
+            "feedback_mode": "deferred",
+        }
+        with (
+            mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}),
+            mock.patch("app.prompting._call_groq", side_effect=slow_groq),
+            mock.patch.object(main_module, "feedback_cache", cache),
+            mock.patch.object(main_module, "feedback_jobs", jobs),
+        ):
+            data = self.client.post("/v1/validate-solution", json=body).json()
+            feedback_id = data["feedback_id"]
+            pending = self.client.get(f"/v1/feedback/{feedback_id}").json()
+            release.set()
+            ready = self.client.get(f"/v1/feedback/{feedback_id}", params={"wait": 5}).json()
+            jobs.shutdown()
+        self.assertEqual(data["decision"], "correct")
+        self.assertEqual(data["pedagogical_feedback"], "Resultado y proceso correctos.")
+        self.assertEqual(pending["status"], "pending")
+        self.assertEqual(ready["status"], "ready")
+        self.assertEqual(ready["feedback"]["short_feedback"], "Muy bien.")
+
+        stored = run_in_transaction(
+            main_module.db_config,
+            lambda conn: conn.execute(
+                """
+                SELECT f.status FROM validation_runs r JOIN run_feedback f ON f.feedback_id = r.feedback_id
+                WHERE r.feedback_id = ?
+                """,
+                (feedback_id,),
+            ).fetchone(),
+        )
+        self.assertEqual(stored["status"], "ready")
+        # Once the in-memory handle is gone the stored copy is served.
+        self.assertEqual(self.client.get(f"/v1/feedback/{feedback_id}").json()["status"], "ready")
+
+    def test_deferred_feedback_without_llm_is_inline(self) -> None:
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": ""}):
+            data = self.client.post(
+                "/v1/validate-solution",
+                json={
+                    "equation_prompt": "2x+5=17",
+                    "expected_final": "x=6",
+                    "ocr_lines": ["x=6"],
+                    "feedback_mode": "deferred",
+                },
+            ).json()
+        self.assertIsNone(data["feedback_id"])
+        self.assertEqual(self.client.get("/v1/feedback/missing").status_code, 404)
+
+    def _stream(self, body: dict[str, object]) -> list[tuple[str, dict]]:
+        with self.client.stream("POST", "/v1/validate-solution/stream", json=body) as response:
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+            events = []
+            for block in response.read().decode("utf-8").strip().split("\n\n"):
+                name, data = block.split("\n", 1)
+                events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    def test_stream_emits_steps_then_verdict_then_feedback(self) -> None:
+        events = self._stream({"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=7"]})
+        names = [name for name, _ in events]
+        self.assertEqual(names, ["step", "step", "verdict", "feedback", "done"])
+        self.assertEqual([data["line"] for _, data in events[:2]], [1, 2])
+        self.assertFalse(events[1][1]["step"]["equivalent"])
+        self.assertEqual(events[2][1]["decision"], "incorrect")
+        self.assertEqual(events[2][1]["wrong_lines"], [2])
+        self.assertIn("short_feedback", events[3][1])
+
+    def test_stream_reports_grading_failure_in_band(self) -> None:
+        body = {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]}
+        with mock.patch("app.grading.grade_submission", side_effect=RuntimeError("boom")):
+            events = self._stream(body)
+        self.assertEqual([name for name, _ in events], ["error", "done"])
+        self.assertEqual(events[0][1]["detail"], "grading failed")
+
+    def test_stream_respects_process_queue_limit(self) -> None:
+        exhausted = threading.BoundedSemaphore(1)
+        exhausted.acquire()
+        body = {"equation_prompt": "2x+5=17", "expected_final": "x=6", "ocr_lines": ["2x=12", "x=6"]}
+        with (
+            mock.patch.object(workers, "_EXECUTION_MODE", "process"),
+            mock.patch.object(workers, "_pending", exhausted),
+        ):
+            events = self._stream(body)
+        self.assertEqual([name for name, _ in events], ["error", "done"])
+        self.assertEqual(events[0][1]["detail"], "grading queue is full")
+
+    def test_stream_rejects_unknown_exercise(self) -> None:
+        response = self.client.post("/v1/validate-solution/stream", json={"exercise_id": "nope", "ocr_lines": ["x=6"]})
+        self.assertEqual(response.status_code, 404)
+
 
 if __name__ == "__main__":
     unittest.main()
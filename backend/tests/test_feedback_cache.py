@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from dataclasses import replace
+from pathlib import Path
+from unittest import mock
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.feedback_cache import FeedbackCache
+from app.prompting import FeedbackInput, feedback_cache_key, generate_pedagogical_feedback
+from app.schemas import PedagogicalOutput
+from app.storage import DbConfig, get_connection, migrate
+
+_LLM_REPLY = json.dumps(
+    {"short_feedback": "Revisa el signo.", "correction_steps": ["Cambia el signo al trasladar."], "tone": "corrective"}
+)
+
+
+def _input(**changes: object) -> FeedbackInput:
+    base = FeedbackInput(
+        decision="incorrect",
+        error_type="sign_error",
+        warning_type=None,
+        expected_final="x=6",
+        normalized_steps=["2*x+5=17", "2*x=22"],
+        step_validations=[{"from_step": "2x+5=17", "to_step": "2x=22"}],
+        wrong_lines=[1],
+        warning_lines=[],
+        final_result_correct=False,
+        process_valid=False,
+        locale="es-CL",
+        warning_message=None,
+    )
+    return replace(base, **changes)
+
+
+def _output(text: str = "Revisa el signo.") -> PedagogicalOutput:
+    return PedagogicalOutput(short_feedback=text, correction_steps=["Paso"], tone="corrective")
+
+
+class FeedbackCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.config = DbConfig(path=str(Path(self._tmp.name) / "test.db"))
+        migrate(self.config)
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _rows(self) -> int:
+        conn = get_connection(self.config)
+        try:
+            return conn.execute("SELECT COUNT(*) AS n FROM feedback_cache").fetchone()["n"]
+        finally:
+            conn.close()
+
+    def test_memory_then_database_hit(self) -> None:
+        cache = FeedbackCache(self.config, maxsize=8, max_rows=8, ttl_seconds=60)
+        self.assertIsNone(cache.get("k"))
+        cache.put("k", "v1", _output())
+        self.assertEqual(cache.get("k").short_feedback, "Revisa el signo.")
+        cache.clear_memory()
+        self.assertEqual(cache.get("k").short_feedback, "Revisa el signo.")
+        self.assertEqual(cache.get("k").short_feedback, "Revisa el signo.")
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["memory_hits"], stats["db_hits"]), (1, 2, 1))
+
+    def test_expired_entries_are_ignored(self) -> None:
+        cache = FeedbackCache(self.config, maxsize=8, max_rows=8, ttl_seconds=0.05)
+        cache.put("k", "v1", _output())
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_database_keeps_newest_rows(self) -> None:
+        cache = FeedbackCache(self.config, maxsize=0, max_rows=2, ttl_seconds=60)
+        for key in ["a", "b", "c"]:
+            cache.put(key, "v1", _output(key))
+        self.assertEqual(self._rows(), 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c").short_feedback, "c")
+
+    def test_key_ignores_raw_step_text_but_not_locale(self) -> None:
+        base = feedback_cache_key(_input())
+        self.assertEqual(base, feedback_cache_key(_input(step_validations=[])))
+        self.assertNotEqual(base, feedback_cache_key(_input(locale="en-US")))
+        self.assertNotEqual(base, feedback_cache_key(_input(wrong_lines=[2])))
+
+    def test_llm_is_called_once_per_key(self) -> None:
+        cache = FeedbackCache(self.config, maxsize=8, max_rows=8, ttl_seconds=60)
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}), mock.patch(
+            "app.prompting._call_groq", return_value=_LLM_REPLY
+        ) as call:
+            first = generate_pedagogical_feedback(_input(), cache)
+            second = generate_pedagogical_feedback(_input(step_validations=[]), cache)
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(first, second)
+
+    def test_fallback_is_not_cached(self) -> None:
+        cache = FeedbackCache(self.config, maxsize=8, max_rows=8, ttl_seconds=60)
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}), mock.patch(
+            "app.prompting._call_groq", side_effect=TimeoutError()
+        ):
+            generate_pedagogical_feedback(_input(), cache)
+        self.assertEqual(cache.stats()["writes"], 0)
+        self.assertEqual(self._rows(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import json
+import unittest
+from pathlib import Path
+from unittest import mock
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.exercises import default_assets_dir
+from app import workers
+from app.grading import CandidateTrie, _evaluate_sequence, _score_eval, grade_group, grade_submission
+from app.math_engine import SolutionSetMemo, choose_candidate_sequences
+from app.schemas import ValidateSolutionRequest
+
+
+def _ambiguous_payload(last_line: str = "x=6") -> ValidateSolutionRequest:
+    return ValidateSolutionRequest.model_validate(
+        {
+            "equation_prompt": "2x+5=17",
+            "expected_final": "x=6",
+            "ocr_lines": ["2x=12", "x=12/2", last_line],
+            "ocr_candidates": [
+                {"lineIndex": 2, "candidates": [{"text": "x=12/2"}, {"text": "x=1/2"}, {"text": "x=12/z"}]},
+                {"lineIndex": 3, "candidates": [{"text": last_line}, {"text": "x=S"}, {"text": "x=8"}]},
+            ],
+        }
+    )
+
+
+class GradingTest(unittest.TestCase):
+    def test_shared_prefixes_match_independent_evaluation(self) -> None:
+        for payload in [_ambiguous_payload(), _ambiguous_payload("x=7")]:
+            graded = grade_submission(payload, prune=False)
+            candidates = choose_candidate_sequences(
+                payload.ocr_lines,
+                payload.ocr_candidates,
+                beam_width=5,
+                top_k=3,
+                prompt=payload.equation_prompt,
+            )
+            independent = []
+            for candidate in candidates:
+                evaluated = _evaluate_sequence(payload, candidate, SolutionSetMemo())
+                independent.append(
+                    {
+                        "lines": candidate.lines,
+                        "score": _score_eval(evaluated) + candidate.score,
+                        "final_result_correct": evaluated.final_result_correct,
+                        "process_valid": evaluated.process_valid,
+                    }
+                )
+            self.assertEqual(graded.candidate_scores, independent)
+            self.assertGreater(graded.transitions["reused"], 0)
+
+    def test_pruning_keeps_the_selected_candidate(self) -> None:
+        payload = _ambiguous_payload()
+        full = grade_submission(payload, prune=False)
+        pruned = grade_submission(payload, prune=True)
+        self.assertGreater(pruned.pruned_candidates, 0)
+        self.assertEqual(pruned.best_candidate, full.best_candidate)
+        self.assertEqual(pruned.best_eval, full.best_eval)
+        kept = len(pruned.candidate_scores)
+        self.assertEqual(pruned.candidate_scores, full.candidate_scores[:kept])
+
+    def test_exact_arithmetic_matches_sympy(self) -> None:
+        path = default_assets_dir() / "elementary" / "addition_subtraction.json"
+        items = json.loads(path.read_text(encoding="utf-8"))["exercises"]
+        exact_prompts = 0
+        for item in items:
+            prompt, expected = item["prompt"], item["expected_final"]
+            attempts = [
+                [expected],
+                [f"{prompt}={expected}", expected],
+                [f"{prompt}={expected}1", f"{expected}1"],
+                [f"{expected}={prompt}"],
+                ["7=7", expected],
+                [f"({prompt})*2/2", "2^3-8", expected],
+                [f"{expected}/0"],
+                ["x", expected],
+                ["0.5", expected],
+                [f"{prompt}+", expected],
+            ]
+            for lines in attempts:
+                payload = ValidateSolutionRequest.model_validate(
+                    {"equation_prompt": prompt, "expected_final": expected, "ocr_lines": lines}
+                )
+                exact_trie = CandidateTrie(payload, arithmetic=True)
+                exact_prompts += exact_trie.arithmetic_root is not None
+                exact = grade_submission(payload, trie=exact_trie)
+                sympy = grade_submission(payload, trie=CandidateTrie(payload, arithmetic=False))
+                self.assertEqual(exact.best_eval, sympy.best_eval, lines)
+                self.assertEqual(exact.candidate_scores, sympy.candidate_scores, lines)
+        self.assertEqual(exact_prompts, len(items) * 10)
+
+    def test_exact_arithmetic_does_not_touch_sympy(self) -> None:
+        payload = ValidateSolutionRequest.model_validate(
+            {"equation_prompt": "4 + 3", "expected_final": "7", "ocr_lines": ["4+3=7", "7"]}
+        )
+        with mock.patch("app.grading.parse_step_within", side_effect=AssertionError("sympy parse")), mock.patch(
+            "app.grading.compare_steps", side_effect=AssertionError("sympy compare")
+        ):
+            graded = grade_submission(payload, trie=CandidateTrie(payload, arithmetic=True))
+        self.assertTrue(graded.best_eval.final_result_correct)
+        self.assertTrue(graded.best_eval.process_valid)
+        self.assertEqual(graded.best_eval.normalized_steps, ["4+3", "7", "7"])
+
+    def test_decimal_prompts_stay_on_sympy(self) -> None:
+        payload = ValidateSolutionRequest.model_validate(
+            {"equation_prompt": "0.5 + 0.25", "expected_final": "0.75", "ocr_lines": ["0.75"]}
+        )
+        self.assertIsNone(CandidateTrie(payload, arithmetic=True).arithmetic_root)
+        self.assertTrue(grade_submission(payload).best_eval.final_result_correct)
+
+    def test_grade_group_times_each_item(self) -> None:
+        payloads = [_ambiguous_payload(), _ambiguous_payload("x=7")]
+        results = grade_group(payloads)
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsNotNone(result.grading_ms)
+            self.assertGreater(result.grading_ms, 0)
+
+    def test_grade_many_refuses_to_drop_results(self) -> None:
+        payloads = [_ambiguous_payload(), _ambiguous_payload("x=7")]
+        with mock.patch("app.grading.grade_group", side_effect=lambda group: grade_group(group)[:1]):
+            with self.assertRaises(RuntimeError):
+                workers.grade_many(payloads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import prompting
+from app.http_pool import HttpConnectionPool, HttpTransportError
+from app.prompting import FeedbackInput, configure_feedback_transport, generate_pedagogical_feedback
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", "0"))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append((self.path, request))
+        if self.path == "/slow":
+            time.sleep(0.5)
+        if self.path == "/error":
+            self._reply(500, b"{}")
+            return
+        if self.path == "/drop":
+            # Answers as keep-alive, then hangs up so the client holds a stale connection.
+            self.close_connection = True
+        content = json.dumps(
+            {"short_feedback": "Bien hecho.", "correction_steps": ["Sigue asi."], "tone": "confirmatory_warning"}
+        )
+        self._reply(200, json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8"))
+
+
+def _feedback_input() -> FeedbackInput:
+    return FeedbackInput(
+        decision="correct",
+        error_type=None,
+        warning_type=None,
+        expected_final="x=6",
+        normalized_steps=["2*x+5=17", "x=6"],
+        step_validations=[],
+        wrong_lines=[],
+        warning_lines=[],
+        final_result_correct=True,
+        process_valid=True,
+        locale="es-CL",
+        warning_message=None,
+    )
+
+
+class HttpPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self) -> None:
+        prompting.close_feedback_transport()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused_across_requests(self) -> None:
+        pool = HttpConnectionPool(self.base_url)
+        try:
+            responses = [pool.request("POST", "/ok", body=b"{}") for _ in range(3)]
+        finally:
+            pool.close()
+        self.assertEqual([item.reused for item in responses], [False, True, True])
+        self.assertEqual(self.server.connections, 1)
+        stats = pool.stats()
+        self.assertEqual(stats["opened"], 1)
+        self.assertEqual(stats["reused"], 2)
+        self.assertEqual(stats["requests"], 3)
+        self.assertGreater(stats["avg_latency_ms"], 0)
+
+    def test_stale_connection_is_replaced(self) -> None:
+        pool = HttpConnectionPool(self.base_url)
+        try:
+            pool.request("POST", "/drop", body=b"{}")
+            time.sleep(0.05)
+            response = pool.request("POST", "/ok", body=b"{}")
+        finally:
+            pool.close()
+        self.assertEqual(response.status, 200)
+        self.assertFalse(response.reused)
+        self.assertEqual(pool.stats()["opened"], 2)
+        self.assertEqual(pool.stats()["errors"], 0)
+
+    def test_read_timeout(self) -> None:
+        pool = HttpConnectionPool(self.base_url, read_timeout=0.1)
+        try:
+            with self.assertRaises(TimeoutError):
+                pool.request("POST", "/slow", body=b"{}")
+        finally:
+            pool.close()
+        self.assertEqual(pool.stats()["errors"], 1)
+
+    def test_error_status_raises(self) -> None:
+        pool = HttpConnectionPool(self.base_url)
+        try:
+            with self.assertRaises(HttpTransportError) as ctx:
+                pool.request("POST", "/error", body=b"{}")
+        finally:
+            pool.close()
+        self.assertEqual(ctx.exception.status, 500)
+
+    def test_async_request(self) -> None:
+        pool = HttpConnectionPool(self.base_url)
+
+        async def run() -> list[int]:
+            responses = await asyncio.gather(*(pool.arequest("POST", "/ok", body=b"{}") for _ in range(4)))
+            return [item.status for item in responses]
+
+        try:
+            self.assertEqual(asyncio.run(run()), [200, 200, 200, 200])
+        finally:
+            pool.close()
+
+    def test_feedback_uses_pooled_transport(self) -> None:
+        pool = configure_feedback_transport(f"{self.base_url}/openai/v1/chat/completions")
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}):
+            first = generate_pedagogical_feedback(_feedback_input())
+            generate_pedagogical_feedback(_feedback_input())
+        self.assertEqual(first.short_feedback, "Bien hecho.")
+        self.assertEqual(self.server.requests[0][0], "/openai/v1/chat/completions")
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(pool.stats()["reused"], 1)
+
+    def test_feedback_falls_back_on_server_error(self) -> None:
+        configure_feedback_transport(f"{self.base_url}/error")
+        with mock.patch.dict(os.environ, {"GROQ_API_KEY": "test-key"}):
+            feedback = generate_pedagogical_feedback(_feedback_input())
+        self.assertEqual(feedback.short_feedback, "Resultado y proceso correctos.")
+        self.assertEqual(len(self.server.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
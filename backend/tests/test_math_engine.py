@@ -1,18 +1,78 @@
+import json
+import random
+import re
+import threading
+import time
 import unittest
 from pathlib import Path
+from unittest import mock
 import sys
 
+from sympy import Integer, S, Symbol, solveset, srepr
+from sympy.parsing.sympy_parser import parse_expr
+
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
+from app.exercises import default_assets_dir
 from app.math_engine import (
+    _TRANSFORMATIONS,
+    Deadline,
+    SequenceCandidate,
+    SolutionSetMemo,
+    _parse_expression,
+    _polynomial_solution_set,
+    build_candidate_lines,
     choose_candidate_sequences,
+    clear_parse_cache,
     compare_steps,
+    configure_parse_cache,
+    expressions_equivalent,
+    parse_cache_stats,
     parse_context_substitutions,
+    normalize_text,
     parse_step,
 )
 from app.schemas import OcrCandidatePayload, OcrLineCandidatesPayload
 
 
+def _reference_candidate_sequences(
+    ocr_lines: list[str],
+    ocr_candidates: list[OcrLineCandidatesPayload] | None,
+    beam_width: int,
+    top_k: int,
+) -> list[SequenceCandidate]:
+    # The original copy-per-expansion beam search, kept as the oracle for the rewritten one.
+    candidate_lines = build_candidate_lines(ocr_lines, ocr_candidates, top_k=top_k)
+    if not candidate_lines:
+        return []
+    beams = [SequenceCandidate(lines=[], score=0, warning_type=None, warning_message=None, ambiguous_lines=[])]
+    for line_idx, options in enumerate(candidate_lines, start=1):
+        next_beams = []
+        unique_options = list(dict.fromkeys(options))
+        ambiguous = len(unique_options) > 1
+        for beam in beams:
+            for rank, option in enumerate(unique_options):
+                score = beam.score + (10 - rank * 3)
+                warning_type = beam.warning_type
+                warning_message = beam.warning_message
+                ambiguous_lines = list(beam.ambiguous_lines)
+                if re.search(r"[sS]", option) and re.search(r"=\s*[sS]\b", option):
+                    score -= 3
+                if ambiguous and rank > 0:
+                    ambiguous_lines.append(line_idx)
+                    if warning_type is None:
+                        warning_type = "ocr_ambiguous"
+                        warning_message = "Hay ambiguedad OCR en al menos una linea."
+                if not normalize_text(option):
+                    score -= 5
+                next_beams.append(
+                    SequenceCandidate([*beam.lines, option], score, warning_type, warning_message, ambiguous_lines)
+                )
+        next_beams.sort(key=lambda b: b.score, reverse=True)
+        beams = next_beams[:beam_width]
+    return beams
+
+
 class MathEngineTest(unittest.TestCase):
     def test_solution_set_equivalent(self) -> None:
         a = parse_step("2x=4")
@@ -96,6 +156,194 @@ class MathEngineTest(unittest.TestCase):
         self.assertGreaterEqual(len(seqs), 1)
         self.assertIn("x=S", seqs[0].lines[0])
 
+    def test_beam_search_matches_reference(self) -> None:
+        rng = random.Random(7)
+        pool = ["x=5", "x=S", "x = s", "2x=10", "x=6", "x=5", "", " ", "x=8", "S=x"]
+        for _ in range(200):
+            line_count = rng.randint(1, 7)
+            lines = [rng.choice(pool[:5]) for _ in range(line_count)]
+            candidates = [
+                OcrLineCandidatesPayload(
+                    lineIndex=index,
+                    candidates=[OcrCandidatePayload(text=rng.choice(pool)) for _ in range(rng.randint(0, 4))],
+                )
+                for index in range(1, line_count + 1)
+                if rng.random() < 0.7
+            ]
+            beam_width = rng.randint(1, 6)
+            top_k = rng.randint(1, 4)
+            self.assertEqual(
+                choose_candidate_sequences(lines, candidates, beam_width=beam_width, top_k=top_k),
+                _reference_candidate_sequences(lines, candidates, beam_width, top_k),
+            )
+
+    def test_beam_drops_unparseable_variants_when_prompt_is_known(self) -> None:
+        candidates = [
+            OcrLineCandidatesPayload(
+                lineIndex=1,
+                candidates=[OcrCandidatePayload(text="2x==12"), OcrCandidatePayload(text="2x=12")],
+            )
+        ]
+        without = choose_candidate_sequences(["2x=12"], candidates)
+        with_prompt = choose_candidate_sequences(["2x=12"], candidates, prompt="2x+5=17")
+        self.assertIn(["2x==12"], [seq.lines for seq in without])
+        self.assertNotIn(["2x==12"], [seq.lines for seq in with_prompt])
+
+    def test_beam_prefers_variants_consistent_with_previous_line(self) -> None:
+        candidates = [
+            OcrLineCandidatesPayload(lineIndex=1, candidates=[OcrCandidatePayload(text="2x=12")]),
+            OcrLineCandidatesPayload(lineIndex=2, candidates=[OcrCandidatePayload(text="x=6")]),
+        ]
+        lines = ["2x=13", "x=8"]
+        self.assertEqual(choose_candidate_sequences(lines, candidates)[0].lines, ["2x=13", "x=8"])
+        best = choose_candidate_sequences(lines, candidates, prompt="2x+5=17")[0]
+        self.assertEqual(best.lines, ["2x=12", "x=6"])
+        self.assertEqual(best.ambiguous_lines, [1, 2])
+
+    def test_solution_set_memo_solves_each_step_once(self) -> None:
+        memo = SolutionSetMemo()
+        steps = [parse_step(text) for text in ["2x+5=17", "2x=12", "x=6"]]
+        compare_steps(steps[0], steps[1], "x", memo=memo)
+        compare_steps(steps[1], steps[2], "x", memo=memo)
+        compare_steps(steps[2], parse_step("x=6"), "x", memo=memo)
+        self.assertEqual(memo.misses, 3)
+        self.assertEqual(memo.hits, 3)
+
+    def test_exhausted_request_budget_times_out_step(self) -> None:
+        deadline = Deadline(step_budget_ms=0, request_budget_ms=1)
+        time.sleep(0.01)
+        result = compare_steps(parse_step("2x+5=17"), parse_step("2x=12"), "x", deadline=deadline)
+        self.assertEqual(result.validation_status, "undetermined")
+        self.assertEqual(result.reason, "timeout")
+        self.assertTrue(deadline.timed_out)
+
+    @unittest.skipUnless(threading.current_thread() is threading.main_thread(), "SIGALRM needs the main thread")
+    def test_step_budget_interrupts_slow_solve(self) -> None:
+        def slow_solution_set(*args: object, **kwargs: object) -> None:
+            time.sleep(2)
+
+        deadline = Deadline(step_budget_ms=50, request_budget_ms=0)
+        started = time.perf_counter()
+        with mock.patch("app.math_engine._solution_set", side_effect=slow_solution_set):
+            result = compare_steps(parse_step("2x+5=17"), parse_step("2x=12"), "x", deadline=deadline)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(result.reason, "timeout")
+
+    def test_step_budget_off_the_main_thread_reports_overrun(self) -> None:
+        def slow_solution_set(*args: object, **kwargs: object) -> None:
+            time.sleep(0.2)
+
+        deadline = Deadline(step_budget_ms=50, request_budget_ms=0)
+        results = []
+        with mock.patch("app.math_engine._solution_set", side_effect=slow_solution_set):
+            worker = threading.Thread(
+                target=lambda: results.append(
+                    compare_steps(parse_step("2x+5=17"), parse_step("2x=12"), "x", deadline=deadline)
+                )
+            )
+            worker.start()
+            worker.join()
+        self.assertEqual(results[0].validation_status, "undetermined")
+        self.assertEqual(results[0].reason, "timeout")
+        self.assertTrue(deadline.timed_out)
+
+    def test_numeric_probe_rejects_without_simplify(self) -> None:
+        a = parse_step("(x+1)^2")
+        b = parse_step("x^2+2x")
+        with mock.patch("app.math_engine.simplify", side_effect=AssertionError("simplify called")):
+            result = compare_steps(a, b, "x")
+        self.assertFalse(result.equivalent)
+        self.assertEqual(result.reason, "not_equivalent_expression")
+
+    def test_decimal_expressions_are_decided_by_simplify(self) -> None:
+        cases = [
+            ("0.3(x+1)^2", "0.3x^2+0.6x+0.3", True),
+            ("(x+0.5)(x-0.5)", "x^2-0.25", True),
+            ("0.3(x+1)^2", "0.3x^2+0.6x+0.4", False),
+        ]
+        for a, b, expected in cases:
+            for _ in range(5):
+                result = compare_steps(parse_step(a), parse_step(b), "x")
+                self.assertEqual(result.equivalent, expected, (a, b))
+
+    def test_numeric_probe_without_symbolic_confirmation(self) -> None:
+        a = parse_step("(x+1)^2").expr
+        b = parse_step("x^2+2x+1").expr
+        with mock.patch("app.math_engine.simplify", side_effect=AssertionError("simplify called")):
+            self.assertTrue(expressions_equivalent(a, b, symbolic_confirm=False))
+        self.assertTrue(expressions_equivalent(a, b, symbolic_confirm=True))
+
+    def test_polynomial_fast_path_matches_solveset(self) -> None:
+        x = Symbol("x")
+        for text in ["2x+5=17", "x/3+4=10", "x(x-1)=0", "x^2=2", "x^2+1=0", "(x+1)^2=4", "0=0", "0=5"]:
+            eq = parse_step(text).eq
+            fast = _polynomial_solution_set(eq, x)
+            self.assertIsNotNone(fast, text)
+            self.assertEqual(fast, solveset(eq, x, domain=S.Reals), text)
+
+    def test_polynomial_fast_path_falls_back(self) -> None:
+        x = Symbol("x")
+        for text in ["x^3=8", "1/x=2", "sqrt(x)=2", "0.5x=1"]:
+            self.assertIsNone(_polynomial_solution_set(parse_step(text).eq, x), text)
+
+    def test_substituted_steps_without_the_variable_still_solve(self) -> None:
+        substitutions = {"y": Integer(4)}
+        for text, expected_set in [("2y=8", "Reals"), ("2y=9", "EmptySet")]:
+            result = compare_steps(parse_step(text), parse_step("x=1"), "x", substitutions=substitutions)
+            self.assertEqual(result.validation_status, "invalid", text)
+            self.assertEqual(result.previous_solution_set, expected_set, text)
+            self.assertEqual(result.current_solution_set, "{1}", text)
+
+    def test_parse_cache_reuses_normalized_text(self) -> None:
+        clear_parse_cache()
+        first = parse_step("2x = 17 - 5")
+        second = parse_step("2x=17-5")
+        stats = parse_cache_stats()
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(first.eq, second.eq)
+        self.assertEqual(first.raw, "2x = 17 - 5")
+        self.assertEqual(second.raw, "2x=17-5")
+
+    def test_parse_cache_evicts_least_recently_used(self) -> None:
+        original_size = parse_cache_stats().maxsize
+        clear_parse_cache()
+        configure_parse_cache(2)
+        try:
+            parse_step("x=1")
+            parse_step("x=2")
+            parse_step("x=1")
+            parse_step("x=3")
+            stats = parse_cache_stats()
+            self.assertEqual(stats.size, 2)
+            self.assertEqual(stats.evictions, 1)
+            parse_step("x=1")
+            self.assertEqual(parse_cache_stats().hits, 2)
+        finally:
+            configure_parse_cache(original_size)
+            clear_parse_cache()
+
+    def test_fast_parser_matches_parse_expr_on_exercise_bank(self) -> None:
+        sides: set[str] = set()
+        for path in sorted(default_assets_dir().rglob("*.json")):
+            for item in json.loads(path.read_text(encoding="utf-8")).get("exercises", []):
+                for text in [item["prompt"], item["expected_final"]]:
+                    sides.update(side for side in normalize_text(text).split("=") if side)
+        sides.update(["3(x+1)", "(x+1)(x-1)", "x(x-2)", "1/2x", "-x^2", "2^-1", "0.5x-1.25", "6/2(1+2)", "x^2x"])
+        self.assertGreater(len(sides), 20)
+        with mock.patch("app.math_engine.parse_expr", side_effect=AssertionError("parse_expr fallback")):
+            fast = {text: _parse_expression(text) for text in sides}
+        for text, expr in fast.items():
+            expected = parse_expr(text, transformations=_TRANSFORMATIONS, evaluate=True)
+            self.assertEqual(srepr(expr), srepr(expected), text)
+
+    def test_fast_parser_leaves_other_syntax_to_parse_expr(self) -> None:
+        for text in ["sqrt(4)", "pi", "2E", "x2", "1e3", "0x10", "2j", "S(1)/2", "xy", "007", "1.2.3"]:
+            expected = parse_expr(text, transformations=_TRANSFORMATIONS, evaluate=True)
+            self.assertEqual(srepr(_parse_expression(text)), srepr(expected), text)
+        for text in ["2+", "(x+1", "2*/x"]:
+            self.assertTrue(parse_step(text).parse_error.startswith("parse_error:"), text)
+
 
 if __name__ == "__main__":
     unittest.main()
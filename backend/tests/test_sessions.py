@@ -0,0 +1,66 @@
+import time
+import unittest
+from pathlib import Path
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.main import app
+from app.schemas import ValidateSolutionRequest
+from app.sessions import InvalidLineError, SessionStore, UnknownSessionError
+
+
+def _template() -> ValidateSolutionRequest:
+    return ValidateSolutionRequest(equation_prompt="2x+5=17", expected_final="x=6")
+
+
+class SessionTest(unittest.TestCase):
+    def test_only_the_changed_suffix_is_validated(self) -> None:
+        session = SessionStore().create(_template())
+        first = session.set_line(1, "2x=12")
+        second = session.set_line(2, "x=5")
+        fixed = session.set_line(2, "x=6")
+        self.assertEqual(first.debug["transitions"], {"checked": 1, "reused": 0})
+        self.assertEqual(second.debug["transitions"], {"checked": 1, "reused": 1})
+        self.assertEqual(second.decision, "incorrect")
+        self.assertEqual(fixed.debug["transitions"], {"checked": 1, "reused": 1})
+        self.assertEqual(fixed.decision, "correct")
+        self.assertGreater(fixed.debug["solution_set_memo"]["hits"], 0)
+
+    def test_truncate_and_line_bounds(self) -> None:
+        session = SessionStore().create(_template().model_copy(update={"ocr_lines": ["2x=12", "x=6"]}))
+        self.assertEqual(session.current().decision, "correct")
+        truncated = session.truncate(2)
+        self.assertEqual(session.lines, ["2x=12"])
+        self.assertEqual(truncated.debug["transitions"]["checked"], 0)
+        with self.assertRaises(InvalidLineError):
+            session.set_line(3, "x=6")
+
+    def test_idle_sessions_expire(self) -> None:
+        store = SessionStore(ttl_seconds=0.05)
+        session = store.create(_template())
+        time.sleep(0.1)
+        with self.assertRaises(UnknownSessionError):
+            store.get(session.session_id)
+        self.assertEqual(store.stats()["expired"], 1)
+
+    def test_session_endpoints(self) -> None:
+        client = TestClient(app)
+        created = client.post("/v1/sessions", json={"exercise_id": "seed_secondary_linear_eq_001"})
+        self.assertEqual(created.status_code, 200)
+        session_id = created.json()["session_id"]
+        self.assertEqual(created.json()["result"]["decision"], "unreadable")
+        client.put(f"/v1/sessions/{session_id}/lines/1", json={"text": "3x=15"})
+        updated = client.put(f"/v1/sessions/{session_id}/lines/2", json={"text": "x=5"}).json()
+        self.assertEqual(updated["lines"], ["3x=15", "x=5"])
+        self.assertEqual(updated["result"]["decision"], "correct")
+        self.assertEqual(client.get(f"/v1/sessions/{session_id}").json()["result"]["decision"], "correct")
+        self.assertEqual(client.put(f"/v1/sessions/{session_id}/lines/9", json={"text": "x=5"}).status_code, 422)
+        self.assertEqual(client.delete(f"/v1/sessions/{session_id}").status_code, 204)
+        self.assertEqual(client.get(f"/v1/sessions/{session_id}").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+import gc
+import sqlite3
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import storage
+from app.storage import (
+    DbConfig,
+    ValidationRunWriter,
+    connection_stats,
+    ensure_schema,
+    get_connection,
+    load_step_validations,
+    migrate,
+    persistence_stats,
+    run_in_transaction,
+    save_validation_run,
+    shutdown_writers,
+)
+
+
+def _save(
+    config: DbConfig,
+    decision: str = "correct",
+    step_validations: list[dict[str, object]] | None = None,
+) -> None:
+    save_validation_run(
+        config,
+        equation_prompt="2x+5=17",
+        expected_final="x=6",
+        ocr_lines=["2x=12", "x=6"],
+        decision=decision,
+        error_type=None,
+        warning_type=None,
+        wrong_lines=[],
+        warning_lines=[],
+        final_result_correct=True,
+        process_valid=True,
+        latency_ms=3,
+        step_validations=step_validations
+        or [
+            {"from_step": "2x+5=17", "to_step": "2x=12", "equivalent": True, "reason": "equivalent_solution_set"},
+            {"from_step": "2x=12", "to_step": "x=6", "equivalent": True, "reason": "equivalent_solution_set"},
+        ],
+    )
+
+
+def _count(config: DbConfig, table: str) -> int:
+    conn = get_connection(config)
+    try:
+        return conn.execute(f"SELECT COUNT(*) AS n FROM {table}").fetchone()["n"]
+    finally:
+        conn.close()
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.config = DbConfig(path=str(Path(self._tmp.name) / "test.db"))
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_migrate_creates_schema_and_records_version(self) -> None:
+        version = migrate(self.config)
+        self.assertEqual(version, storage._MIGRATIONS[-1][0])
+        conn = get_connection(self.config)
+        try:
+            tables = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            seeded = conn.execute("SELECT COUNT(*) AS n FROM error_catalog").fetchone()["n"]
+        finally:
+            conn.close()
+        self.assertTrue({"schema_version", "validation_runs", "step_diagnostics"} <= tables)
+        self.assertEqual(seeded, 9)
+
+    def test_migrate_is_idempotent(self) -> None:
+        first = migrate(self.config)
+        second = migrate(self.config)
+        self.assertEqual(first, second)
+        conn = get_connection(self.config)
+        try:
+            rows = conn.execute("SELECT COUNT(*) AS n FROM schema_version").fetchone()["n"]
+        finally:
+            conn.close()
+        self.assertEqual(rows, len(storage._MIGRATIONS))
+
+    def test_migrate_upgrades_legacy_database(self) -> None:
+        conn = sqlite3.connect(self.config.path)
+        conn.execute(
+            """
+            CREATE TABLE validation_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                equation_prompt TEXT NOT NULL,
+                expected_final TEXT NOT NULL,
+                ocr_lines_json TEXT NOT NULL,
+                decision TEXT NOT NULL,
+                error_type TEXT,
+                wrong_lines_json TEXT NOT NULL,
+                latency_ms INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.commit()
+        conn.close()
+
+        migrate(self.config)
+        conn = get_connection(self.config)
+        try:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(validation_runs)")}
+        finally:
+            conn.close()
+        self.assertTrue({"warning_type", "warning_lines_json", "final_result_correct", "process_valid"} <= columns)
+
+    def test_ensure_schema_migrates_once_per_process(self) -> None:
+        ensure_schema(self.config)
+        with mock.patch("app.storage.migrate") as patched:
+            ensure_schema(self.config)
+        patched.assert_not_called()
+
+    def test_sync_persistence_writes_run_and_diagnostics(self) -> None:
+        migrate(self.config)
+        _save(self.config)
+        self.assertEqual(_count(self.config, "validation_runs"), 1)
+        self.assertEqual(_count(self.config, "step_diagnostics"), 2)
+
+    def test_background_persistence_flushes_on_shutdown(self) -> None:
+        config = DbConfig(path=self.config.path, persistence_mode="background", write_batch_size=8)
+        migrate(config)
+        for _ in range(5):
+            _save(config)
+        stats = persistence_stats(config)
+        self.assertEqual(stats["mode"], "background")
+        self.assertEqual(stats["enqueued"], 5)
+        shutdown_writers()
+        self.assertEqual(_count(config, "validation_runs"), 5)
+        self.assertEqual(_count(config, "step_diagnostics"), 10)
+
+    def test_background_writer_drops_when_queue_is_full(self) -> None:
+        config = DbConfig(path=self.config.path, persistence_mode="background", write_queue_size=1)
+        migrate(config)
+        release = threading.Event()
+        started = threading.Event()
+        original = ValidationRunWriter._write_batch
+
+        def blocking_write(writer: ValidationRunWriter, batch: list) -> None:
+            started.set()
+            release.wait(5)
+            original(writer, batch)
+
+        with mock.patch.object(ValidationRunWriter, "_write_batch", blocking_write):
+            writer = ValidationRunWriter(config)
+            record = storage.ValidationRunRecord(
+                equation_prompt="x=1",
+                expected_final="x=1",
+                ocr_lines=["x=1"],
+                decision="correct",
+                error_type=None,
+                warning_type=None,
+                wrong_lines=[],
+                warning_lines=[],
+                final_result_correct=True,
+                process_valid=True,
+                latency_ms=1,
+                step_validations=[],
+                created_at="2026-01-01T00:00:00+00:00",
+            )
+            self.assertTrue(writer.submit(record))
+            started.wait(5)
+            self.assertTrue(writer.submit(record))
+            self.assertFalse(writer.submit(record))
+            release.set()
+            writer.flush()
+            writer.close()
+        stats = writer.stats()
+        self.assertEqual(stats["dropped"], 1)
+        self.assertEqual(stats["written"], 2)
+        self.assertEqual(_count(config, "validation_runs"), 2)
+
+    def test_pooled_connection_is_reused_and_tuned(self) -> None:
+        migrate(self.config)
+        before = connection_stats()
+        _save(self.config)
+        _save(self.config)
+        after = connection_stats()
+        self.assertEqual(after["opened"] - before["opened"], 1)
+        self.assertEqual(after["transactions"] - before["transactions"], 2)
+        mode = run_in_transaction(self.config, lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual(mode, "wal")
+
+    def test_connection_is_closed_when_its_thread_exits(self) -> None:
+        migrate(self.config)
+        before = connection_stats()
+        opened: list[sqlite3.Connection] = []
+
+        def work() -> None:
+            run_in_transaction(self.config, lambda conn: opened.append(conn))
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+        gc.collect()
+        after = connection_stats()
+        self.assertEqual(after["opened"] - before["opened"], 1)
+        self.assertEqual(after["open"], before["open"])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            opened[0].execute("SELECT 1")
+
+    def test_busy_database_is_retried(self) -> None:
+        config = DbConfig(path=self.config.path, busy_timeout_ms=0, busy_retries=5)
+        migrate(config)
+        blocker = sqlite3.connect(config.path, isolation_level=None, check_same_thread=False)
+        blocker.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.1, lambda: blocker.execute("COMMIT"))
+        timer.start()
+        before = connection_stats()
+        try:
+            _save(config)
+        finally:
+            timer.join()
+            blocker.close()
+        after = connection_stats()
+        self.assertGreaterEqual(after["busy_retries"] - before["busy_retries"], 1)
+        self.assertEqual(_count(config, "validation_runs"), 1)
+
+    def test_blob_layout_round_trips_full_step_validations(self) -> None:
+        config = DbConfig(path=self.config.path, diagnostics_layout="blob")
+        migrate(config)
+        saved = [
+            {
+                "from_step": "2x+5=17",
+                "to_step": "2x=12",
+                "from_normalized": "2x+5=17",
+                "to_normalized": "2x=12",
+                "equivalent": True,
+                "validation_status": "valid",
+                "equivalence_mode": "solution_set",
+                "reason": "equivalent_solution_set",
+                "previous_solution_set": "{6}",
+                "current_solution_set": "{6}",
+            },
+            {
+                "from_step": "2x=12",
+                "to_step": "x=7",
+                "from_normalized": "2x=12",
+                "to_normalized": "x=7",
+                "equivalent": False,
+                "validation_status": "invalid",
+                "equivalence_mode": "solution_set",
+                "reason": "not_equivalent_solution_set",
+                "previous_solution_set": "{6}",
+                "current_solution_set": "{7}",
+            },
+        ]
+        _save(config, step_validations=saved)
+        self.assertEqual(_count(config, "step_diagnostics"), 0)
+        steps = load_step_validations(config, 1)
+        self.assertEqual(steps, saved)
+        self.assertEqual([item["validation_status"] for item in steps], ["valid", "invalid"])
+        self.assertEqual([item["equivalence_mode"] for item in steps], ["solution_set", "solution_set"])
+        self.assertEqual([item["current_solution_set"] for item in steps], ["{6}", "{7}"])
+
+    def test_row_layout_is_readable_through_the_same_helper(self) -> None:
+        migrate(self.config)
+        _save(self.config)
+        steps = load_step_validations(self.config, 1)
+        self.assertEqual(len(steps), 2)
+        self.assertTrue(steps[1]["equivalent"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import subprocess
+import unittest
+from pathlib import Path
+from unittest import mock
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import main as main_module
+from app.main import app
+from app.warmup import Warmup
+
+_BACKEND = Path(__file__).resolve().parents[1]
+
+
+class WarmupTest(unittest.TestCase):
+    def test_importing_the_app_does_not_load_sympy(self) -> None:
+        probe = "import sys; import app.main; print('sympy' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, "-c", probe],
+            cwd=_BACKEND,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_default_warmup_grades_one_exercise_per_bank(self) -> None:
+        warmup = Warmup()
+        warmup.run()
+        report = warmup.report()
+        self.assertEqual(report["status"], "ready")
+        self.assertEqual(report["failed"], [])
+        self.assertGreaterEqual(report["graded"], 2)
+        for key in ["engine_import_ms", "bank_load_ms", "grading_ms", "warmup_ms", "ready_after_ms"]:
+            self.assertIn(key, report)
+
+    def test_unknown_exercises_are_reported(self) -> None:
+        warmup = Warmup(["seed_secondary_linear_eq_001", "missing"])
+        warmup.run()
+        report = warmup.report()
+        self.assertTrue(warmup.ready)
+        self.assertEqual(report["graded"], 1)
+        self.assertEqual(report["failed"], ["missing"])
+
+    def test_ready_endpoint_waits_for_warmup(self) -> None:
+        warmup = Warmup([])
+        client = TestClient(app)
+        with mock.patch.object(main_module, "warmup", warmup):
+            pending = client.get("/ready")
+            self.assertEqual(pending.status_code, 503)
+            self.assertEqual(pending.json()["status"], "pending")
+            self.assertEqual(client.get("/health").status_code, 200)
+            warmup.start()
+            warmup.join()
+            done = client.get("/ready")
+        self.assertEqual(done.status_code, 200)
+        self.assertEqual(done.json()["status"], "ready")
+
+
+if __name__ == "__main__":
+    unittest.main()